@@ -0,0 +1,43 @@
+#!/usr/bin/python
+# Decode cost per message of presence sensor payloads:
+# old json.loads + state setter path vs per-sensor codecs
+import json
+import struct
+import time
+from telebots.sensors import Sensor
+
+
+def measure(name, process, payloads, rounds=5):
+    best = None
+    for _ in range(rounds):
+        started = time.time()
+        for payload in payloads:
+            process(payload)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print "%-10s %8.3f us/msg" % (name, best / len(payloads) * 1000000)
+
+
+def main(count=200000):
+    text = ['1' if idx % 3 else '0' for idx in range(count)]
+    binary = [struct.pack('!b', int(x)) for x in text]
+    stamped = [json.dumps({'status': int(x), 'changed': 1547438413}) for x in text]
+
+    sensor = Sensor.from_url("presence://mac@home/wireless/00:AA:BB:CC")
+
+    def old_process(payload):
+        sensor.state = json.loads(payload)
+
+    measure("old", old_process, text)
+    measure("json", lambda payload: sensor.process(None, payload), text)
+    measure("json+dict", lambda payload: sensor.process(None, payload), stamped)
+
+    sensor = Sensor.from_url("presence://mac@home/wireless/00:AA:BB:CC?codec=int")
+    measure("int", lambda payload: sensor.process(None, payload), text)
+
+    sensor = Sensor.from_url("presence://mac@home/wireless/00:AA:BB:CC?codec=binary")
+    measure("binary", lambda payload: sensor.process(None, payload), binary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# Compare MQTT message dispatch over 10k sensors:
+# linear topic_matches_sub scan (old) vs topic trie (new)
+import random
+import time
+from paho.mqtt.client import topic_matches_sub
+from telebots.sensors import Sensor
+from telebots.topics import TopicTrie
+
+
+def build_sensors(count):
+    sensors = []
+    for idx in range(count):
+        kind = idx % 3
+        if kind == 0:
+            url = "door://door_%d@home/door/%d" % (idx, idx)
+        elif kind == 1:
+            url = "presence://mac_%d@home/wireless/%012X" % (idx, idx)
+        else:
+            url = "camera://cam_%d@home/camera/%d" % (idx, idx)
+        sensors.append(Sensor.from_url(url))
+    return sensors
+
+
+def build_topics(sensors, count):
+    topics = []
+    for _ in range(count):
+        sensor = random.choice(sensors)
+        topic = sensor.topic
+        if topic.endswith('/#'):
+            topic = topic[:-1] + random.choice(['photo', 'video', 'videom'])
+        topics.append(topic)
+    return topics
+
+
+def linear_dispatch(sensors, topic):
+    for sensor in sensors:
+        if topic_matches_sub(sensor.topic, topic):
+            return sensor
+    return None
+
+
+def trie_dispatch(trie, topic):
+    for sensor in trie.match(topic):
+        return sensor
+    return None
+
+
+def measure(name, dispatch, topics):
+    started = time.time()
+    for topic in topics:
+        assert dispatch(topic) is not None
+    elapsed = time.time() - started
+    print "%-8s %8d messages %8.3f s %12.0f msg/s" % (name, len(topics), elapsed, len(topics) / elapsed)
+
+
+def main(sensor_count=10000):
+    random.seed(0)
+    sensors = build_sensors(sensor_count)
+    trie = TopicTrie()
+    for sensor in sensors:
+        trie.add(sensor.topic, sensor)
+
+    print "%d sensors" % sensor_count
+    measure("linear", lambda topic: linear_dispatch(sensors, topic), build_topics(sensors, 200))
+    measure("trie", lambda topic: trie_dispatch(trie, topic), build_topics(sensors, 200000))
+
+
+if __name__ == '__main__':
+    main()
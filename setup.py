@@ -20,6 +20,9 @@ setuptools.setup(
         'cssselect',
         'cachetools'
     ],
+    extras_require={
+        'photos': ['Pillow']
+    },
     dependency_links=[
         'https://github.com/led-spb/pytelegram_async/tarball/master#egg=pytelegram_async-0.1.0',
         'https://github.com/led-spb/paho_async/tarball/master#egg=paho_async-0.1.0',
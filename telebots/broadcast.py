@@ -0,0 +1,107 @@
+import time
+import socket
+import logging
+from tornado import gen
+from tornado.locks import Semaphore
+from tornado.httpclient import HTTPError
+
+
+class Delivery(object):
+    __slots__ = ('chat_id', 'response', 'error', 'latency', 'attempts')
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.response = None
+        self.error = None
+        self.latency = 0.0
+        self.attempts = 0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class BroadcastResult(object):
+    # Per recipient deliveries in order of recipients
+    def __init__(self, deliveries):
+        self.deliveries = deliveries
+
+    def __iter__(self):
+        return iter(self.deliveries)
+
+    def __len__(self):
+        return len(self.deliveries)
+
+    @property
+    def responses(self):
+        return [x.response for x in self.deliveries]
+
+    @property
+    def failed(self):
+        return [x for x in self.deliveries if not x.ok]
+
+    @property
+    def max_latency(self):
+        return max([x.latency for x in self.deliveries] or [0.0])
+
+
+class Broadcaster(object):
+    # Sends the same message to many chats with bounded concurrency,
+    # transient failures (timeouts, flood limits, server errors) are retried
+    def __init__(self, max_concurrent=8, retries=2, retry_delay=1.0):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.semaphore = Semaphore(max_concurrent)
+        self.sent = 0
+        self.failed = 0
+
+    @staticmethod
+    def is_transient(error):
+        if isinstance(error, HTTPError):
+            return error.code == 429 or error.code >= 500
+        return isinstance(error, (socket.error, IOError))
+
+    @gen.coroutine
+    def deliver(self, chat_id, send):
+        delivery = Delivery(chat_id)
+        started = time.time()
+        while True:
+            delivery.attempts += 1
+            try:
+                with (yield self.semaphore.acquire()):
+                    response = yield send(chat_id)
+                if hasattr(response, 'rethrow'):
+                    response.rethrow()
+                delivery.response = response
+                delivery.error = None
+                break
+            except Exception as e:
+                delivery.error = e
+                if delivery.attempts > self.retries or not self.is_transient(e):
+                    break
+                self.logger.debug("Retrying message to %s after error: %s", chat_id, e)
+                yield gen.sleep(self.retry_delay * delivery.attempts)
+        delivery.latency = time.time() - started
+
+        if delivery.ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+            self.logger.warn(
+                "Message to %s failed after %d attempts in %.2fs: %s",
+                chat_id, delivery.attempts, delivery.latency, delivery.error
+            )
+        raise gen.Return(delivery)
+
+    @gen.coroutine
+    def send(self, chat_ids, send):
+        # send is called with chat id and must return future
+        deliveries = yield [self.deliver(chat_id, send) for chat_id in chat_ids]
+        result = BroadcastResult(deliveries)
+        if len(result) > 0:
+            self.logger.debug(
+                "Broadcast to %d chats, %d failed, max latency %.2fs",
+                len(result), len(result.failed), result.max_latency
+            )
+        raise gen.Return(result)
@@ -7,6 +7,7 @@ import paho_async.client as mqtt
 import json
 import datetime
 import zlib
+from functools import partial
 import gpxpy.gpx
 import gpxpy.geo
 from cStringIO import StringIO
@@ -20,6 +21,10 @@ import humanize
 from collections import defaultdict
 import cachetools
 import telebots
+from telebots.media import MediaBroadcaster
+from telebots.upload import MediaUploader
+from telebots.broadcast import Broadcaster
+from telebots.ingest import IngestQueue
 
 
 def json_serial(obj):
@@ -30,7 +35,8 @@ def json_serial(obj):
 
 class CarMonitor(mqtt.TornadoMqttClient, BotRequestHandler):
 
-    def __init__(self, ioloop, url, name, track_path, api_key=None):
+    def __init__(self, ioloop, url, name, track_path, api_key=None, uploader=None, queue_size=0,
+                 queue_policies=None):
         BotRequestHandler.__init__(self)
         self.logger = logging.getLogger(self.__class__.__name__)
         self.url = url
@@ -58,6 +64,12 @@ class CarMonitor(mqtt.TornadoMqttClient, BotRequestHandler):
         self.activity_task = PeriodicCallback(self.activity_job, self.activity_check_interval.seconds*1000)
         self.activity_task.start()
         self.tracks_cache = cachetools.LRUCache(maxsize=32)
+        self.uploader = uploader
+        self.broadcaster = Broadcaster()
+        self.ingest = IngestQueue(
+            self.process_message, queue_size, policies=queue_policies
+        ) if queue_size > 0 else None
+        self.media = None
 
         mqtt.TornadoMqttClient.__init__(
             self, ioloop=ioloop, host=url.hostname, port=url.port if url.port is not None else 1883,
@@ -68,6 +80,7 @@ class CarMonitor(mqtt.TornadoMqttClient, BotRequestHandler):
     def assign_to(self, bot):
         BotRequestHandler.assign_to(self, bot)
         self.subscriptions.update({admin: False for admin in bot.admins})
+        self.media = MediaBroadcaster(bot, self.uploader, broadcaster=self.broadcaster)
 
     @staticmethod
     def human_date(value):
@@ -199,13 +212,7 @@ class CarMonitor(mqtt.TornadoMqttClient, BotRequestHandler):
             self.tracks_cache[track_name] = image
 
         # send image
-        self.bot.send_message(
-            to=chat_id,
-            message=Photo(
-                photo=File('image.png', StringIO(image), 'image/png'),
-                caption=track_name
-            )
-        )
+        yield self.media.send([chat_id], 'photo', image, 'image.png', 'image/png', caption=track_name)
         raise gen.Return()
 
     @gen.coroutine
@@ -307,16 +314,21 @@ class CarMonitor(mqtt.TornadoMqttClient, BotRequestHandler):
         f.write(gpx.to_xml())
         f.close()
 
-        map( lambda item: self.notify_track(item[0], filename, gpx) if item[1] else None,
-             self.subscriptions.items())
+        self.broadcast(self.listeners(), partial(self.notify_track, track_name=filename, gpx=gpx))
         pass
 
+    def listeners(self, all_events=True):
+        # chats which listen all events, or all subscribed chats for warnings
+        return [chat_id for chat_id, listen_all in self.subscriptions.items() if listen_all or not all_events]
+
+    def broadcast(self, chat_ids, send):
+        return self.broadcaster.send(chat_ids, send)
+
     # noinspection PyUnusedLocal
     def on_msg(self, device, event_time, payload):
         message = payload['text']
         self.logger.info("Message from %s: %s", device, message)
-        map(lambda item: self.notify_msg(item[0], device, message) if item[1] else None,
-            self.subscriptions.items())
+        self.broadcast(self.listeners(), partial(self.notify_msg, device=device, message=message))
         pass
 
     def notify_msg(self, chat_id, device, message):
@@ -336,20 +348,17 @@ class CarMonitor(mqtt.TornadoMqttClient, BotRequestHandler):
             low_battery = True
             msg = 'Has <b>low</b> battery (%d%%)' % battery
             self.logger.warn(device+' '+msg)
-            map(lambda item: self.notify_msg(item, device, msg),
-                self.subscriptions.keys())
+            self.broadcast(self.listeners(False), partial(self.notify_msg, device=device, message=msg))
         if battery >= self.low_battery[1] and low_battery:
             low_battery = False
             msg = 'Has <b>norm</b> battery (%d%%)' % battery
             self.logger.warn(device+' '+msg)
-            map(lambda item: self.notify_msg(item, device, msg),
-                self.subscriptions.keys())
+            self.broadcast(self.listeners(False), partial(self.notify_msg, device=device, message=msg))
 
         if last_charge != payload['charge']:
             msg = 'Ignition changed to %s' % ('ON' if payload['charge'] > 0 else 'OFF')
             self.logger.warn(msg)
-            map(lambda item: self.notify_msg(item[0], device, msg) if item[1] else None,
-                self.subscriptions.items())
+            self.broadcast(self.listeners(), partial(self.notify_msg, device=device, message=msg))
             pass
 
         distance = 0
@@ -359,8 +368,9 @@ class CarMonitor(mqtt.TornadoMqttClient, BotRequestHandler):
                 last_location[0], last_location[1], None, payload['lat'], payload['lon'], None
             )
 
-        map(lambda item: self.notify_location(item[0], device) if distance > 500 or item[1] else None,
-            self.subscriptions.items())
+        self.broadcast(
+            self.listeners(distance <= 500), lambda chat_id: gen.multi(self.notify_location(chat_id, device))
+        )
 
         self.devices[device]['status']['low_batt'] = low_battery
         self.devices[device]['status']['location_date'] = event_time
@@ -369,8 +379,14 @@ class CarMonitor(mqtt.TornadoMqttClient, BotRequestHandler):
         self.devices[device]['status']['charge'] = payload['charge']
         pass
 
-    # noinspection PyBroadException
     def on_mqtt_message(self, client, userdata, message):
+        if self.ingest is not None:
+            self.ingest.put(message)
+            return
+        self.process_message(message)
+
+    # noinspection PyBroadException
+    def process_message(self, message):
         try:
             # sysdate = datetime.datetime.now()
             self.logger.debug("Got mqtt message on topic %s", message.topic)
@@ -499,6 +515,10 @@ def main():
     parser.add_argument("--admin", nargs="+", type=int, help="Bot admin", dest="admins")
     parser.add_argument("-u", "--url", default="mqtt://localhost:1883", type=urlparse.urlparse)
     parser.add_argument("-v", action="store_true", default=False, help="Verbose logging", dest="verbose")
+    parser.add_argument("--queue", type=int, default=0, dest="queue_size",
+                        help="Process MQTT messages through queue of this size, 0 - process immediately")
+    parser.add_argument("--queue-policy", nargs="*", default=[], dest="queue_policies",
+                        help="Queue policy for topics pattern:keep|latest|drop")
     parser.add_argument("--logfile", help="Logging into file")
     args = parser.parse_args()
 
@@ -511,7 +531,11 @@ def main():
     ioloop = IOLoop.instance()
 
     bot = Bot(args.token, args.admins)
-    monitor = CarMonitor(ioloop=ioloop, url=args.url, name=args.name, track_path=args.store, api_key=args.key)
+    monitor = CarMonitor(
+        ioloop=ioloop, url=args.url, name=args.name, track_path=args.store, api_key=args.key,
+        uploader=MediaUploader(args.token), queue_size=args.queue_size,
+        queue_policies=[x.rsplit(':', 1) for x in args.queue_policies]
+    )
     bot.add_handler(monitor)
 
     monitor.start()
@@ -0,0 +1,81 @@
+import os
+import os.path
+import re
+import bisect
+import logging
+from collections import defaultdict
+
+
+class ClipIndex(object):
+    # Index of motion clips grouped by day and hour, directory is rescanned
+    # only when its mtime has changed and only new names are parsed
+    pattern = re.compile(r'^(\d{8})_(\d{2})\d{4}\.mp4$')
+
+    def __init__(self, path):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self._mtime = None
+        self._listed = set()
+        self._clips = {}
+        self._days = defaultdict(lambda: defaultdict(list))
+
+    def __len__(self):
+        self.refresh()
+        return len(self._clips)
+
+    def __contains__(self, name):
+        self.refresh()
+        return name in self._clips
+
+    def filename(self, name):
+        return os.path.join(self.path, name)
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+
+        listed = set(os.listdir(self.path))
+        for name in listed - self._listed:
+            match = self.pattern.match(name)
+            if match is not None:
+                self._add(name, *match.groups())
+        for name in self._listed - listed:
+            if name in self._clips:
+                self._remove(name)
+        self._listed = listed
+        self.logger.debug("Clip index refreshed, %d clips", len(self._clips))
+        return True
+
+    def _add(self, name, day, hour):
+        self._clips[name] = (day, hour)
+        bisect.insort(self._days[day][hour], name)
+
+    def _remove(self, name):
+        day, hour = self._clips.pop(name)
+        hours = self._days[day]
+        hours[hour].remove(name)
+        if len(hours[hour]) == 0:
+            del hours[hour]
+        if len(hours) == 0:
+            del self._days[day]
+
+    def days(self):
+        self.refresh()
+        return sorted(self._days.keys(), reverse=True)
+
+    def hours(self, day):
+        self.refresh()
+        if day not in self._days:
+            return []
+        return sorted(self._days[day].keys(), reverse=True)
+
+    def clips(self, day, hour):
+        self.refresh()
+        if day not in self._days or hour not in self._days[day]:
+            return []
+        return list(reversed(self._days[day][hour]))
@@ -0,0 +1,81 @@
+import os
+import json
+import tornado.web
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.locks import Condition
+
+
+class SensorSnapshot(object):
+    # JSON snapshot of all sensors, rebuilt only when registry version changes
+    def __init__(self, sensors):
+        self.sensors = sensors
+        self.changes = Condition()
+        # version numbers start again after restart, so etag includes instance id
+        self.instance = os.urandom(4).encode('hex')
+        self._version = None
+        self._body = None
+
+    def etag(self, version=None):
+        return '"%s-%d"' % (self.instance, self.sensors.version if version is None else version)
+
+    def snapshot(self):
+        version = self.sensors.version
+        if version != self._version:
+            self._body = json.dumps({
+                'version': version,
+                'sensors': [
+                    {
+                        'name': sensor.name,
+                        'type': sensor.type,
+                        'state': sensor.state_text(),
+                        'changed': sensor.changed,
+                        'triggered': sensor.triggered
+                    }
+                    for sensor in self.sensors if not sensor.is_dummy
+                ]
+            })
+            self._version = version
+        return self.etag(version), self._body
+
+    def notify(self):
+        self.changes.notify_all()
+
+    @gen.coroutine
+    def wait(self, etag, timeout):
+        # wait until snapshot differs from etag or timeout expires
+        deadline = IOLoop.current().time() + timeout
+        while self.etag() == etag:
+            changed = yield self.changes.wait(timeout=deadline)
+            if not changed:
+                break
+        pass
+
+
+class SensorStateHandler(tornado.web.RequestHandler):
+    max_wait = 60
+
+    def initialize(self, **kwargs):
+        for attr, value in kwargs.iteritems():
+            setattr(self, attr, value)
+
+    def compute_etag(self):
+        return self.current_etag
+
+    @gen.coroutine
+    def get(self, *args, **kwargs):
+        # ?wait=N holds request until sensors change when client state is actual
+        try:
+            wait = float(self.get_argument('wait', 0))
+        except ValueError:
+            raise tornado.web.HTTPError(400, 'wait must be a number of seconds')
+        known = self.request.headers.get('If-None-Match')
+        if wait > 0 and known is not None:
+            yield self.snapshot.wait(known, min(wait, self.max_wait))
+
+        self.current_etag, body = self.snapshot.snapshot()
+        self.set_header('Content-Type', 'application/json')
+        self.set_header('Cache-Control', 'no-cache')
+        # tornado replies 304 by itself when etag matches If-None-Match
+        self.write(body)
+        pass
@@ -0,0 +1,51 @@
+import logging
+from tornado.ioloop import IOLoop
+
+
+class NotificationDigest(object):
+    # Collects notifications per chat during short window and sends them
+    # as a single message, urgent notifications are sent immediately
+    def __init__(self, send, window=0, broadcast=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.send = send
+        self.broadcast = broadcast
+        self.window = window
+        self.pending = {}
+        self._timers = {}
+
+    def add(self, chat_id, text, urgent=False):
+        if urgent or self.window <= 0:
+            # keep order, pending notifications go first
+            self.flush(chat_id)
+            return self.send(chat_id, [text])
+
+        lines = self.pending.get(chat_id)
+        if lines is None:
+            lines = self.pending[chat_id] = []
+            self._timers[chat_id] = IOLoop.current().call_later(self.window, self.flush, chat_id)
+        lines.append(text)
+        return None
+
+    def add_many(self, chat_ids, text, urgent=False):
+        chat_ids = list(chat_ids)
+        if not (urgent or self.window <= 0) or self.broadcast is None:
+            return [self.add(chat_id, text, urgent) for chat_id in chat_ids]
+
+        for chat_id in chat_ids:
+            self.flush(chat_id)
+        return self.broadcast(chat_ids, [text])
+
+    def flush(self, chat_id):
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            IOLoop.current().remove_timeout(timer)
+        lines = self.pending.pop(chat_id, None)
+        if not lines:
+            return None
+        self.logger.debug("Sending digest of %d notifications to %s", len(lines), chat_id)
+        return self.send(chat_id, lines)
+
+    def flush_all(self):
+        for chat_id in list(self.pending.keys()):
+            self.flush(chat_id)
+        pass
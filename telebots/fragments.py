@@ -0,0 +1,52 @@
+import time
+
+
+def time_bucket(now, *timestamps):
+    # relative time text of older timestamps changes rarely, so it is refreshed with bigger step
+    ages = [now - value for value in timestamps if value and isinstance(value, (int, long, float))]
+    if len(ages) == 0:
+        return 0
+    age = min(ages)
+    if age < 60:
+        step = 10
+    elif age < 3600:
+        step = 60
+    elif age < 86400:
+        step = 600
+    else:
+        step = 3600
+    return int(now // step)
+
+
+class FragmentCache(object):
+    # Rendered text per sensor, rendered again only when sensor version or time bucket is changed
+    def __init__(self, render, fields=('changed',), extra=None):
+        self.render = render
+        self.fields = fields
+        self.extra = extra
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._cache)
+
+    def key(self, sensor, now):
+        key = (sensor.version, time_bucket(now, *[getattr(sensor, field) for field in self.fields]))
+        if self.extra is not None:
+            key += (self.extra(sensor),)
+        return key
+
+    def get(self, sensor, now=None):
+        key = self.key(sensor, now or time.time())
+        entry = self._cache.get(sensor.name)
+        if entry is not None and entry[0] is sensor and entry[1] == key:
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        text = self.render(sensor)
+        self._cache[sensor.name] = (sensor, key, text)
+        return text
+
+    def discard(self, name):
+        self._cache.pop(name, None)
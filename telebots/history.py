@@ -0,0 +1,136 @@
+import os
+import os.path
+import time
+import sqlite3
+import logging
+import datetime
+from tornado.ioloop import IOLoop
+
+
+class SensorHistory(object):
+    # Sensor state changes time-series in sqlite database. Changes are written by batches
+    # in one transaction, hourly and daily counters are updated in the same transaction.
+    # Raw events and hourly buckets are dropped after retention period, daily are kept forever
+    schema = [
+        "CREATE TABLE IF NOT EXISTS events (sensor TEXT, time REAL, state)",
+        "CREATE INDEX IF NOT EXISTS events_time ON events (time)",
+        "CREATE TABLE IF NOT EXISTS hourly (sensor TEXT, bucket INTEGER, changes INTEGER, triggers INTEGER, "
+        "PRIMARY KEY (sensor, bucket))",
+        "CREATE TABLE IF NOT EXISTS daily (sensor TEXT, bucket INTEGER, changes INTEGER, triggers INTEGER, "
+        "PRIMARY KEY (sensor, bucket))"
+    ]
+
+    def __init__(self, path, flush_interval=10, batch_size=500, raw_days=30, hourly_days=365):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+        self.pending = []
+        self.expired = 0
+        self._timer = None
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+            self._db = sqlite3.connect(self.path)
+            for statement in self.schema:
+                self._db.execute(statement)
+            self._db.commit()
+        return self._db
+
+    @staticmethod
+    def hour_bucket(timestamp):
+        return int(timestamp // 3600)
+
+    @staticmethod
+    def day_bucket(timestamp):
+        # local calendar day
+        return datetime.date.fromtimestamp(timestamp).toordinal()
+
+    def add(self, sensor, state, timestamp=None, triggered=False):
+        self.pending.append((sensor, timestamp or time.time(), state, 1 if triggered else 0))
+        if len(self.pending) >= self.batch_size or self.flush_interval <= 0:
+            self.flush()
+        elif self._timer is None:
+            self._timer = IOLoop.current().call_later(self.flush_interval, self.flush)
+        pass
+
+    def flush(self):
+        if self._timer is not None:
+            IOLoop.current().remove_timeout(self._timer)
+            self._timer = None
+        if len(self.pending) == 0:
+            return 0
+
+        events, self.pending = self.pending, []
+        counters = {}
+        for sensor, timestamp, state, trigger in events:
+            for table, bucket in (('hourly', self.hour_bucket(timestamp)), ('daily', self.day_bucket(timestamp))):
+                changes, triggers = counters.get((table, sensor, bucket), (0, 0))
+                counters[(table, sensor, bucket)] = (changes + 1, triggers + trigger)
+
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO events (sensor, time, state) VALUES (?, ?, ?)", [event[:3] for event in events]
+            )
+            for (table, sensor, bucket), (changes, triggers) in counters.iteritems():
+                self.db.execute(
+                    "INSERT OR IGNORE INTO %s (sensor, bucket, changes, triggers) VALUES (?, ?, 0, 0)" % table,
+                    (sensor, bucket)
+                )
+                self.db.execute(
+                    "UPDATE %s SET changes = changes + ?, triggers = triggers + ? "
+                    "WHERE sensor = ? AND bucket = ?" % table,
+                    (changes, triggers, sensor, bucket)
+                )
+        self.logger.debug("Stored %d events in %d buckets", len(events), len(counters))
+
+        if time.time() - self.expired > 3600:
+            self.expire()
+        return len(events)
+
+    def expire(self, now=None):
+        now = now or time.time()
+        with self.db:
+            self.db.execute("DELETE FROM events WHERE time < ?", (now - self.raw_days*86400,))
+            self.db.execute("DELETE FROM hourly WHERE bucket < ?", (self.hour_bucket(now - self.hourly_days*86400),))
+        self.expired = now
+        pass
+
+    def hourly(self, sensor, since):
+        # list of (bucket start time, changes, triggers)
+        return [
+            (bucket*3600, changes, triggers)
+            for bucket, changes, triggers in self.db.execute(
+                "SELECT bucket, changes, triggers FROM hourly WHERE sensor = ? AND bucket >= ? ORDER BY bucket",
+                (sensor, self.hour_bucket(since))
+            )
+        ]
+
+    def daily(self, sensor, since):
+        # list of (date, changes, triggers)
+        return [
+            (datetime.date.fromordinal(bucket), changes, triggers)
+            for bucket, changes, triggers in self.db.execute(
+                "SELECT bucket, changes, triggers FROM daily WHERE sensor = ? AND bucket >= ? ORDER BY bucket",
+                (sensor, self.day_bucket(since))
+            )
+        ]
+
+    def events(self, sensor, since):
+        return list(self.db.execute(
+            "SELECT time, state FROM events WHERE sensor = ? AND time >= ? ORDER BY time", (sensor, since)
+        ))
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        pass
@@ -5,33 +5,111 @@ import os
 import os.path
 import logging
 import shlex
+import signal
 import argparse
-import subprocess
+import sys
+import tempfile
 import time
 import datetime
+from collections import defaultdict
 import urlparse
 import paho_async.client as mqtt
-from cStringIO import StringIO
 from pytelegram_async.bot import Bot, BotRequestHandler, PatternMessageHandler, MessageHandler
 from pytelegram_async.entity import *
-from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado import gen
+from tornado.ioloop import IOLoop
 from jinja2 import Environment
-from paho.mqtt.client import topic_matches_sub
 import humanize
+import tornado.web
 import telebots
-from sensors import Sensor
+from sensors import Sensor, SensorRegistry, CameraSensor
+from templates import SensorTemplate, SensorTemplates
+from journal import SensorJournal
+from history import SensorHistory
+from rules import RuleEngine
+from media import MediaBroadcaster
+from upload import UploadSource, MediaUploader
+from processes import ProcessManager, ProgressMessage
+from digest import NotificationDigest
+from broadcast import Broadcaster
+from snapshots import SnapshotBuffer
+from variants import PhotoVariants
+from spool import PayloadSpool, SpooledPayload
+from clips import ClipIndex
+from watch import FileWatcher
+from ingest import IngestQueue
+from fragments import FragmentCache
+from shards import ShardForwarder, ShardCoordinator, ShardSupervisor, shard_of, is_sharded, watch_parent
+from dashboard import SensorSnapshot, SensorStateHandler
+from topics import consolidate, batches
+
+
+def subscribe_topics(client, topics, qos=0):
+    for batch in batches(topics):
+        client.subscribe([(topic, qos) for topic in batch])
+    pass
 
 
 class HomeBotHandler(BotRequestHandler, mqtt.TornadoMqttClient):
-    def __init__(self, ioloop, admins, mqtt_url, sensors=None, extra_cmds=None):
+    photo_record = '$photo'
+    photo_default = 'phone'
+    history_units = {'h': 3600, 'd': 86400, 'w': 7*86400, 'm': 30*86400, 'y': 365*86400}
+
+    def __init__(self, ioloop, admins, mqtt_url, sensors=None, extra_cmds=None, state_path=None,
+                 video_path='/home/hub/motion/storage', uploader=None, shell_timeouts=None, shell_max=2,
+                 digest_window=0, urgent_types=None, warm_start=True, snapshot_memory=16*1024*1024,
+                 snapshot_frames=10, spool_path=None, spool_threshold=512*1024, broadcast_max=8,
+                 history_path=None, rules=None, template_limit=None, template_idle=None, queue_size=0,
+                 queue_policies=None, shard_socket=None, photo_sizes=None, subscribe_wildcards=0):
         BotRequestHandler.__init__(self)
         self.logger = logging.getLogger(self.__class__.__name__)
         self.ioloop = ioloop
 
-        self.sensors = [self.build_sensor_from_url(url, admins) for url in sensors or []]
-        self.background_processes = []
+        self.spool = PayloadSpool(spool_path, spool_threshold)
+        self.spool.cleanup()
+        self.default_subscriptions = admins
+        self.sensor_urls = {}
+        self.sensors = SensorRegistry(
+            self.build_sensor_from_url(url, admins) for url in sensors or [] if not SensorTemplate.is_template(url)
+        )
+        # wildcard sensors are created only when their topic is seen
+        self.templates = SensorTemplates(
+            self.sensors, template_limit, template_idle, on_created=self.sensor_created, on_evicted=self.sensor_evicted
+        )
+        for url in sensors or []:
+            if SensorTemplate.is_template(url):
+                self.templates.add(SensorTemplate(url, admins))
+        self.journal = SensorJournal(state_path) if state_path is not None else None
+        self.records = {}
+        # chat_id -> preferred photo variant, stored in journal as pseudo-sensor record
+        self.photo_preferences = {}
+        self.restore_sensors()
+        self.history = SensorHistory(history_path) if history_path is not None else None
+        self.state_snapshot = SensorSnapshot(self.sensors)
+        self.clips = ClipIndex(video_path)
+        self.snapshots = SnapshotBuffer(snapshot_memory, snapshot_frames)
+        # downscaled photos are sent according to chat preference when sizes are configured
+        self.photo_variants = PhotoVariants(photo_sizes) if photo_sizes else None
+        if self.photo_variants is not None and not self.photo_variants.available:
+            self.logger.warn("Pillow is not installed, camera photos are sent in original size")
+            self.photo_variants = None
+        self.processes = ProcessManager(max_running=shell_max)
 
         self.trigger_gap = 300
+        self.broadcaster = Broadcaster(max_concurrent=broadcast_max)
+        self.digest = NotificationDigest(self.send_digest, digest_window, broadcast=self.broadcast_digest)
+        self.urgent_types = set(urgent_types or [])
+        self.rules = RuleEngine(self.fire_rule)
+        for rule in rules or []:
+            name, expression = rule.split(':', 1)
+            self.rules.add(name.strip(), expression, self.sensors, self.templates.templates)
+        self.warm_start = warm_start
+        # messages are processed inside MQTT callback unless queue is enabled
+        self.ingest = IngestQueue(
+            self.process_message, queue_size, policies=queue_policies
+        ) if queue_size > 0 else None
+        # state sensors are processed by ingestion workers which send changes to coordinator socket
+        self.coordinator = ShardCoordinator(shard_socket, self.apply_shard_change) if shard_socket else None
 
         self.jinja = Environment()
         self.jinja.filters['human_date'] = self.human_date
@@ -44,7 +122,14 @@ class HomeBotHandler(BotRequestHandler, mqtt.TornadoMqttClient):
             "<b>type</b>: {{sensor.type}}\n"
             "<b>state</b>: {{sensor.state_text()}}\n"
             "<b>changed</b>: {{ sensor.changed | human_date }}\n"
-            "<b>triggered</b>: {{ sensor.triggered | human_date }}"
+            "<b>triggered</b>: {{ sensor.triggered | human_date }}\n"
+            "<b>suppressed</b>: {{ sensor.suppressed.repeats }} repeats, {{ sensor.suppressed.flaps }} flaps"
+        )
+        # rendered sensor texts are reused until sensor is changed or relative time moves
+        self.status_fragments = FragmentCache(lambda sensor: self.sensor_template.render(sensor=sensor))
+        self.full_fragments = FragmentCache(
+            lambda sensor: self.sensor_full_template.render(sensor=sensor), fields=('changed', 'triggered'),
+            extra=lambda sensor: (sensor.suppressed['repeats'], sensor.suppressed['flaps'])
         )
 
         host = mqtt_url.hostname
@@ -53,6 +138,8 @@ class HomeBotHandler(BotRequestHandler, mqtt.TornadoMqttClient):
         self.logger.info("Trying connect to MQTT broker at %s:%d" % (host, port))
 
         self.subscribe = False
+        # sibling topics are subscribed with one wildcard filter, messages are still dispatched by exact topic
+        self.subscribe_wildcards = subscribe_wildcards
         mqtt.TornadoMqttClient.__init__(
             self, ioloop=ioloop, host=mqtt_url.hostname,
             port=mqtt_url.port if mqtt_url.port is not None else 1883,
@@ -60,44 +147,178 @@ class HomeBotHandler(BotRequestHandler, mqtt.TornadoMqttClient):
         )
         self.version = telebots.version
         self.shell_commands = extra_cmds or {}
-        self._periodic_task = PeriodicCallback(callback=self.periodic_handler, callback_time=1000)
+        self.shell_timeouts = shell_timeouts or {}
+        self.uploader = uploader
+        self.media = None
+        self.broker_client = None
         pass
 
-    def periodic_handler(self):
-        # check background processes for finished and send notification
-        for info in list(self.background_processes):
-            process, chat, command = info
-            if process.poll() is not None:
-                self.background_processes.remove(info)
-
-                logging.info('Command "%s" is ends', command)
-                (result, _) = process.communicate()
-                logging.debug(result)
-                if result is not None and result.strip() != "":
-                    self.bot.send_message(
-                        to=chat['id'], message=result.strip(), parse_mode='HTML'
-                    )
-        pass
-
-    def start(self):
-        super(HomeBotHandler, self).start()
-        self._periodic_task.start()
+    def assign_to(self, bot):
+        BotRequestHandler.assign_to(self, bot)
+        self.media = MediaBroadcaster(bot, self.uploader, broadcaster=self.broadcaster)
 
     def build_sensor_from_url(self, url, admins):
-        sensor = Sensor.from_url(url, admins)
+        sensor = self.setup_sensor(Sensor.from_url(url, admins))
+        self.sensor_urls[sensor.name] = url
+        return sensor
+
+    def setup_sensor(self, sensor):
         if sensor.type == "camera":
             sensor.on_changed = self.event_camera
+            sensor.spool = self.spool
         elif sensor.type == "notify":
             sensor.on_changed = self.event_notify
         else:
             sensor.on_changed = self.event_sensor
         return sensor
 
+    def sensor_created(self, sensor):
+        self.setup_sensor(sensor)
+        if sensor.name in self.records:
+            sensor.restore(self.records[sensor.name])
+        self.rules.attach(sensor)
+        pass
+
+    def sensor_evicted(self, sensor):
+        # keep state and subscriptions until sensor appears again
+        self.records[sensor.name] = self.sensor_record(sensor)
+        self.rules.detach(sensor)
+        self.status_fragments.discard(sensor.name)
+        self.full_fragments.discard(sensor.name)
+        pass
+
+    def subscribed_topics(self):
+        if self.coordinator is not None:
+            return set(sensor.topic for sensor in self.sensors if not is_sharded(sensor))
+        topics = set(sensor.topic for sensor in self.sensors if sensor.name not in self.templates)
+        topics.update(self.templates.topics)
+        return topics
+
+    def subscription_filters(self):
+        topics = self.subscribed_topics()
+        if self.subscribe_wildcards > 0:
+            return consolidate(topics, self.subscribe_wildcards)
+        return topics
+
+    def apply_shard_change(self, record):
+        self.templates.materialize(record['topic'])
+        sensor = self.sensors.get(record['name'])
+        if sensor is None:
+            self.logger.warn("Change for unknown sensor %s from ingestion worker", record['name'])
+            return
+        if not record['retained']:
+            # worker has no restored state and may repeat state known from journal
+            if record['state'] != sensor.state or not sensor.changed:
+                sensor.apply(record['state'], record['changed'])
+            return
+        sensor.restore({'state': record['state'], 'changed': record['changed']})
+        self.rules.update(sensor, silent=True)
+        self.store_sensor(sensor, state=sensor.state, changed=sensor.changed)
+        self.state_snapshot.notify()
+        pass
+
+    def reload_sensors(self, urls):
+        # apply new sensors list, unchanged sensors keep their state and subscriptions
+        topics = self.subscription_filters()
+        static = [url for url in urls if not SensorTemplate.is_template(url)]
+        templates = [url for url in urls if SensorTemplate.is_template(url)]
+        current = set(self.sensor_urls.itervalues())
+        added, removed = [], []
+
+        # new sensors and templates are validated before anything is changed
+        built = [
+            (url, Sensor.from_url(url, self.default_subscriptions)) for url in static if url not in current
+        ]
+        built_templates = [
+            SensorTemplate(url, self.default_subscriptions)
+            for url in templates if url not in [x.url for x in self.templates.templates]
+        ]
+        names = [name for name, url in self.sensor_urls.iteritems() if url in static]
+        names.extend(sensor.name for _, sensor in built)
+        seen = set()
+        for name in names:
+            if name in seen:
+                raise ValueError("Sensor %s is defined more than once" % name)
+            seen.add(name)
+
+        for name, url in self.sensor_urls.items():
+            if url not in static:
+                sensor = self.sensors.get(name)
+                del self.sensor_urls[name]
+                self.sensors.remove(sensor)
+                self.sensor_evicted(sensor)
+                removed.append(sensor)
+
+        for template in self.templates.templates[:]:
+            if template.url not in templates:
+                removed.extend(self.templates.remove(template.url))
+        for template in built_templates:
+            self.templates.add(template)
+
+        for url, sensor in built:
+            self.setup_sensor(sensor)
+            self.sensor_urls[sensor.name] = url
+            if sensor.name in self.templates:
+                removed.append(self.templates.drop(sensor.name))
+            previous = self.records.pop(sensor.name, None)
+            if previous is not None:
+                if [x for x in removed if x.name == sensor.name and x.type != sensor.type]:
+                    # sensor type is changed, only subscriptions are kept
+                    previous = {'subscriptions': previous.get('subscriptions', [])}
+                sensor.restore(previous)
+            self.sensors.add(sensor)
+            self.rules.attach(sensor)
+            added.append(sensor)
+
+        if self.broker_client is not None:
+            new_topics = self.subscription_filters()
+            # new filters go first so replaced wildcard does not lose messages
+            subscribe_topics(self.broker_client, new_topics - topics)
+            for batch in batches(topics - new_topics):
+                self.broker_client.unsubscribe(batch)
+        self.state_snapshot.notify()
+        self.logger.info(
+            "Sensors reloaded, added: %s, removed: %s",
+            ','.join(x.name for x in added) or '-', ','.join(x.name for x in removed) or '-'
+        )
+        return added, removed
+
     def sensor_by_name(self, name):
+        return self.sensors.get(name)
+
+    @staticmethod
+    def sensor_record(sensor):
+        record = {'subscriptions': sorted(sensor.subscriptions)}
+        if not sensor.is_dummy:
+            record.update(state=sensor.state, changed=sensor.changed, triggered=sensor.triggered)
+        return record
+
+    def restore_sensors(self):
+        if self.journal is None:
+            return
+        self.records = self.journal.load()
+        self.photo_preferences = dict(
+            (int(chat_id), variant) for chat_id, variant in self.records.get(self.photo_record, {}).iteritems()
+        )
         for sensor in self.sensors:
-            if sensor.name == name:
-                return sensor
-        return None
+            if sensor.name in self.records:
+                sensor.restore(self.records[sensor.name])
+        self.journal.compact(self.sensors_table())
+        pass
+
+    def sensors_table(self):
+        # records of sensors not created from templates yet are kept too
+        table = dict(self.records)
+        table.update((sensor.name, self.sensor_record(sensor)) for sensor in self.sensors)
+        return table
+
+    def store_sensor(self, sensor, **fields):
+        if self.journal is None:
+            return
+        self.journal.append(sensor.name, **fields)
+        if self.journal.should_compact():
+            self.journal.compact(self.sensors_table())
+        pass
 
     @staticmethod
     def human_date(value):
@@ -108,70 +329,156 @@ class HomeBotHandler(BotRequestHandler, mqtt.TornadoMqttClient):
     def on_mqtt_connect(self, client, obj, flags, rc):
         self.logger.info("MQTT broker: %s", mqtt.connack_string(rc))
         if rc == 0:
+            self.broker_client = client
             # Subscribe sensors topics
-            for sensor in self.sensors:
-                client.subscribe(sensor.topic)
+            subscribe_topics(client, self.subscription_filters())
         pass
 
     def on_mqtt_message(self, client, obj, message):
+        if self.ingest is not None:
+            self.ingest.put(message)
+            return None
+        return self.process_message(message)
+
+    def process_message(self, message):
+        self.templates.materialize(message.topic)
         if message.retain:
+            if self.warm_start:
+                self.load_retained(message)
             return
         self.logger.info("topic %s, payload: %s" % (
             message.topic,
             "[binary]" if len(message.payload) > 10 else message.payload
         ))
-        for sensor in self.sensors:
-            if topic_matches_sub(sensor.topic, message.topic):
-                return sensor.process(message.topic, message.payload)
+        for sensor in self.matched_sensors(message.topic):
+            return sensor.process(message.topic, message.payload)
+        pass
+
+    def matched_sensors(self, topic):
+        sensors = self.sensors.match(topic)
+        if self.coordinator is not None:
+            # wildcard filter may also deliver topics of sensors owned by ingestion workers
+            sensors = [sensor for sensor in sensors if not is_sharded(sensor)]
+        return sensors
+
+    def load_retained(self, message):
+        for sensor in self.matched_sensors(message.topic):
+            if sensor.is_dummy:
+                continue
+            try:
+                sensor.load(message.topic, message.payload)
+            except ValueError:
+                self.logger.warn("Bad retained payload for sensor %s: %r", sensor.name, message.payload)
+                continue
+            self.logger.debug("Sensor %s loaded from retained message, state %s", sensor.name, sensor.state)
+            self.rules.update(sensor, silent=True)
+            self.store_sensor(sensor, state=sensor.state, changed=sensor.changed)
+        self.state_snapshot.notify()
         pass
 
     @PatternMessageHandler("/video( .*)?", authorized=True)
     def cmd_video(self, chat, text, message_id, is_callback):
         params = text.split()
-        video = params[1] if len(params) > 1 else None
 
-        if video is None:
-            files = sorted([x for x in os.listdir('/home/hub/motion/storage')
-                            if re.match(r'\d{8}_\d{6}\.mp4', x)], reverse=True)
+        def show_menu(message_text, buttons, page, page_callback, back_callback=None):
+            keyboard = self.paginate(buttons, page, page_callback)
+            if back_callback is not None:
+                keyboard.append([{'callback_data': back_callback, 'text': 'Back'}])
+            message_params = {
+                'to': chat['id'],
+                'reply_markup': {'inline_keyboard': keyboard},
+                'message': message_text,
+                'text': message_text,
+                'message_id': message_id
+            }
+            send_method = self.bot.send_message
+            if is_callback:
+                send_method = self.bot.edit_message_text
+            send_method(**message_params)
+            pass
+
+        def show_days(page=0):
+            buttons = [{
+                'callback_data': '/video %s' % day,
+                'text': '%s.%s.%s' % (day[6:8], day[4:6], day[0:4])
+            } for day in self.clips.days()]
+            show_menu('which day?', buttons, page, '/video days %d')
+
+        def show_hours(day):
+            buttons = [{
+                'callback_data': '/video %s %s' % (day, hour),
+                'text': '%s:00' % hour
+            } for hour in self.clips.hours(day)]
+            show_menu('which hour?', buttons, 0, '/video %s %%d' % day, '/video')
 
+        def show_clips(day, hour, page=0):
             buttons = [{
                 'callback_data': '/video '+fname,
                 'text': re.sub(r'^\d{8}_(\d{2})(\d{2}).*$', '\\1:\\2', fname)
-            } for fname in files]
-            max_btn_inrow = 6
-            keyboard = [
-                x for x in [
-                    buttons[i*max_btn_inrow:(i+1)*max_btn_inrow] for i in range(len(buttons)/max_btn_inrow+1)
-                ] if len(x) > 0
-            ]
-            self.bot.send_message(
-                to=chat.get('id'),
-                message='which video?',
-                reply_markup={'inline_keyboard': keyboard}
-            )
-        else:
+            } for fname in self.clips.clips(day, hour)]
+            show_menu('which video?', buttons, page, '/video %s %s %%d' % (day, hour), '/video %s' % day)
+
+        if len(params) == 1:
+            show_days()
+        elif params[1] == 'days':
+            show_days(int(params[2]) if len(params) > 2 else 0)
+        elif re.match(r'^\d{8}$', params[1]):
+            if len(params) == 2:
+                show_hours(params[1])
+            else:
+                show_clips(params[1], params[2], int(params[3]) if len(params) > 3 else 0)
+        elif params[1] in self.clips:
+            video = params[1]
             caption = re.sub(r'^\d{8}_(\d{2})(\d{2}).*$', '\\1:\\2', video)
-            self.bot.send_message(
-                to=chat.get('id'),
-                message=Video(
-                    video=File('video.mp4', open('/home/hub/motion/storage/'+video, 'rb'), 'video/mp4'),
-                    caption=caption
-                )
+            self.media.send(
+                [chat.get('id')], 'video', UploadSource(path=self.clips.filename(video)), 'video.mp4', 'video/mp4',
+                caption=caption
             )
+        else:
+            show_days()
         return True
 
+    @staticmethod
+    def paginate(buttons, page, page_callback, per_row=6, rows=5):
+        per_page = per_row * rows
+        pages = max((len(buttons) + per_page - 1) / per_page, 1)
+        page = min(max(page, 0), pages - 1)
+        buttons = buttons[page*per_page:(page+1)*per_page]
+        keyboard = [buttons[i:i+per_row] for i in range(0, len(buttons), per_row)]
+
+        navigation = []
+        if page > 0:
+            navigation.append({'callback_data': page_callback % (page - 1), 'text': '<< %d/%d' % (page, pages)})
+        if page < pages - 1:
+            navigation.append({'callback_data': page_callback % (page + 1), 'text': '%d/%d >>' % (page + 2, pages)})
+        if len(navigation) > 0:
+            keyboard.append(navigation)
+        return keyboard
+
     @PatternMessageHandler("/status", authorized=True)
     def cmd_status(self, chat):
         self.notify_sensor(chat['id'])
         return True
 
+    @PatternMessageHandler("/queue", authorized=True)
+    def cmd_queue(self, chat):
+        if self.ingest is None:
+            text = 'Messages are processed without queue'
+        else:
+            text = 'depth: %(depth)d (max %(max_depth)d)\nprocessed: %(processed)d\n' \
+                   'dropped: %(dropped)d\nmerged: %(merged)d' % self.ingest.stats
+        self.bot.send_message(to=chat['id'], message=text)
+        return True
+
     @PatternMessageHandler("/sensor( .*)?", authorized=True)
     def cmd_sensor(self, chat, text, message_id, is_callback):
         params = text.split()
 
         def show_menu():
+            subscribed = self.sensors.subscriptions.sensors(chat['id'])
             buttons = [
-                {'callback_data': '/sensor %s' % item.name, 'text': item.name}
+                {'callback_data': '/sensor %s' % item.name,
+                 'text': u'\u2714 %s' % item.name if item.name in subscribed else item.name}
                 for item in self.sensors
             ]
             message_text = 'Which sensor?'
@@ -194,7 +501,7 @@ class HomeBotHandler(BotRequestHandler, mqtt.TornadoMqttClient):
                 {'callback_data': '/sensor %s 1' % sensor.name, 'text': 'Subscribe'},
                 {'callback_data': '/sensor %s 0' % sensor.name, 'text': 'Unsubscribe'}
             ]
-            message_text = self.sensor_full_template.render(sensor=sensor)
+            message_text = self.full_fragments.get(sensor)
             message_params = {
                 'to': chat['id'],
                 'reply_markup': {
@@ -232,6 +539,7 @@ class HomeBotHandler(BotRequestHandler, mqtt.TornadoMqttClient):
                 sensor.add_subscription(chat['id'])
             else:
                 sensor.remove_subscription(chat['id'])
+            self.store_sensor(sensor, subscriptions=sorted(sensor.subscriptions))
 
             message_text = 'Sensor <b>%s</b> changed' % sensor.name
             message_params = {
@@ -247,22 +555,156 @@ class HomeBotHandler(BotRequestHandler, mqtt.TornadoMqttClient):
             send_method(**message_params)
         return True
 
+    @PatternMessageHandler("/(un)?subscribe( .*)?", authorized=True)
+    def cmd_subscribe(self, chat, text):
+        params = text.split()
+        subscribe = params[0] == '/subscribe'
+        if len(params) != 2:
+            self.bot.send_message(
+                to=chat['id'], message='Usage: %s <sensor type|topic pattern|*>' % params[0]
+            )
+            return True
+
+        changed = []
+        for sensor in self.sensors.select(params[1]):
+            if subscribe:
+                updated = sensor.add_subscription(chat['id'])
+            else:
+                updated = sensor.remove_subscription(chat['id'])
+            if updated:
+                changed.append(sensor)
+                self.store_sensor(sensor, subscriptions=sorted(sensor.subscriptions))
+
+        self.bot.send_message(
+            to=chat['id'], parse_mode='HTML',
+            message='%s %d sensors: %s' % (
+                'Subscribed to' if subscribe else 'Unsubscribed from', len(changed),
+                ', '.join('<b>%s</b>' % x.name for x in changed)
+            )
+        )
+        return True
+
     def notify_sensor(self, chat_id, sensor=None):
+        now = time.time()
         messages = [
-            self.sensor_template.render(sensor=item)
-            for item in self.sensors
-            if (sensor is None or item == sensor) and not item.is_dummy
+            self.status_fragments.get(item, now)
+            for item in (self.sensors if sensor is None else [sensor])
+            if not item.is_dummy
         ]
         return self.bot.send_message(to=chat_id, message="\n".join(messages), parse_mode='HTML')
 
-    @PatternMessageHandler(r'/camera (\S+)', authorized=True)
+    def send_digest(self, chat_id, lines):
+        return self.broadcast_digest([chat_id], lines)
+
+    def broadcast_digest(self, chat_ids, lines):
+        text = "\n".join(lines)
+        return self.broadcaster.send(
+            chat_ids, lambda chat_id: self.bot.send_message(to=chat_id, message=text, parse_mode='HTML')
+        )
+
+    @PatternMessageHandler(r'/history( .*)?', authorized=True)
+    def cmd_history(self, chat, text):
+        params = text.split()
+        sensor = self.sensor_by_name(params[1]) if len(params) > 1 else None
+        period = re.match(r'^(\d+)([hdwmy])$', params[2] if len(params) > 2 else '24h')
+        if self.history is None or sensor is None or period is None:
+            self.bot.send_message(to=chat['id'], message='Usage: /history <sensor> [24h|7d|4w|6m|1y]')
+            return True
+
+        seconds = int(period.group(1)) * self.history_units[period.group(2)]
+        since = time.time() - seconds
+        # answer only from hourly or daily buckets, raw events are never scanned
+        if seconds <= 2*86400:
+            rows = [
+                (datetime.datetime.fromtimestamp(start).strftime('%d.%m %H:00'), changes, triggers)
+                for start, changes, triggers in self.history.hourly(sensor.name, since)
+            ]
+        else:
+            rows = []
+            label_format = '%d.%m' if seconds <= 62*86400 else '%m.%Y'
+            for day, changes, triggers in self.history.daily(sensor.name, since):
+                label = day.strftime(label_format)
+                if len(rows) > 0 and rows[-1][0] == label:
+                    rows[-1] = (label, rows[-1][1] + changes, rows[-1][2] + triggers)
+                else:
+                    rows.append((label, changes, triggers))
+
+        lines = ['<b>%s</b> for %s: %d changes, %d triggers' % (
+            sensor.name, period.group(0), sum(x[1] for x in rows), sum(x[2] for x in rows)
+        )]
+        lines.extend('%s: %d/%d' % row for row in rows[-40:])
+        self.bot.send_message(to=chat['id'], message='\n'.join(lines), parse_mode='HTML')
+        return True
+
+    def photo_preference(self, chat_id):
+        variant = self.photo_preferences.get(chat_id, self.photo_default)
+        if self.photo_variants is None or variant not in self.photo_variants.names:
+            return PhotoVariants.original
+        return variant
+
+    @PatternMessageHandler(r'/photosize( .*)?', authorized=True)
+    def cmd_photosize(self, chat, text):
+        params = text.split()
+        if self.photo_variants is None:
+            self.bot.send_message(to=chat['id'], message='Photo size: original only')
+            return True
+        if len(params) != 2 or params[1] not in self.photo_variants.names:
+            self.bot.send_message(
+                to=chat['id'], message='Photo size: %s\nUsage: /photosize <%s>' % (
+                    self.photo_preference(chat['id']), '|'.join(self.photo_variants.names)
+                )
+            )
+            return True
+
+        self.photo_preferences[chat['id']] = params[1]
+        record = self.records.setdefault(self.photo_record, {})
+        record[str(chat['id'])] = params[1]
+        if self.journal is not None:
+            self.journal.append(self.photo_record, **{str(chat['id']): params[1]})
+            if self.journal.should_compact():
+                self.journal.compact(self.sensors_table())
+        self.bot.send_message(to=chat['id'], message='Photo size: %s' % params[1])
+        return True
+
+    @PatternMessageHandler(r'/camera (\S+)( .*)?', authorized=True)
     def cmd_camera(self, chat, text):
         params = text.split()
-        if len(params) != 2:
-            return
         camera = self.sensor_by_name(params[1])
-        if camera is not None and chat['id'] not in camera.one_time_sub:
-            camera.one_time_sub.append(chat['id'])
+        if not isinstance(camera, CameraSensor):
+            return
+        if len(params) == 2:
+            if chat['id'] not in camera.one_time_sub:
+                camera.one_time_sub.append(chat['id'])
+            return True
+        if params[2] == 'original' and len(params) > 3:
+            frame = self.snapshots.get(int(params[3])) if params[3].isdigit() else None
+            if frame is None or frame.camera != camera.name:
+                self.bot.send_message(to=chat['id'], message='Frame is not available anymore')
+                return True
+            # document is not recompressed by telegram
+            self.media.send(
+                [chat['id']], 'document', frame.payload, 'camera_%s_%d.jpg' % (camera.name, frame.id), 'image/jpeg',
+                caption='camera#%s %s' % (
+                    camera.name, datetime.datetime.fromtimestamp(frame.time).strftime('%H:%M:%S')
+                )
+            )
+            return True
+        if params[2] != 'last':
+            return
+
+        if len(params) > 3 and not params[3].isdigit():
+            self.bot.send_message(to=chat['id'], message='Usage: /camera %s last [1-10]' % camera.name)
+            return True
+        count = min(max(int(params[3]), 1), 10) if len(params) > 3 else 1
+        frames = self.snapshots.last(camera.name, count)
+        if len(frames) == 0:
+            self.bot.send_message(to=chat['id'], message='No frames from camera %s' % camera.name)
+            return True
+        self.media.send_album(chat['id'], 'photo', [
+            (frame.payload, 'image.jpg', 'image/jpeg',
+             'camera#%s %s' % (camera.name, datetime.datetime.fromtimestamp(frame.time).strftime('%H:%M:%S')))
+            for frame in frames
+        ])
         return True
 
     @MessageHandler(authorized=True)  
@@ -270,101 +712,335 @@ class HomeBotHandler(BotRequestHandler, mqtt.TornadoMqttClient):
         if text in self.shell_commands:
             command = self.shell_commands[text]
             logging.debug("Executing shell command: %s", command)
-            process = subprocess.Popen(
-                shlex.split(command), stderr=subprocess.STDOUT, stdout=subprocess.PIPE
-            )
-            self.background_processes.append((process, chat, command))
+            self.run_shell(chat['id'], command, self.shell_timeouts.get(text))
             return True
         return False
 
+    @gen.coroutine
+    def run_shell(self, chat_id, command, timeout=None):
+        message = ProgressMessage(self.bot, chat_id)
+        try:
+            code, output = yield self.processes.run(command, on_output=message.progress, timeout=timeout)
+        except Exception as e:
+            self.logger.exception('Error while executing "%s"', command)
+            code, output = None, 'Command failed: %s' % e
+        if code:
+            output = '%s\n[exit code %d]' % (output, code)
+        yield message.update(output)
+        pass
+
     def event_camera(self, camera):
         event_type = camera.event_type
+        self.state_snapshot.notify()
         self.logger.info("Camera sensor %s triggered for event %s", camera.name, camera.event_type)
 
         # Photo events send only subscribers
         if event_type == 'photo':
-            markup = {
-                    'inline_keyboard': [[{
-                        'text': 'Subscribe',
-                        'callback_data': '/camera %s' % camera.name
-                    }]]
-            }
-            for chat_id in camera.subscriptions:
-                self.bot.send_message(
-                    to=chat_id,
-                    message=Photo(
-                        photo=File('image.jpg', StringIO(camera.state), 'image/jpeg'),
-                        caption='camera#%s' % camera.name
-                    ),
-                    reply_markup=markup
-                )
+            frame = self.snapshots.add(camera.name, camera.state)
+            self.send_camera_photo(camera, frame)
             return None
 
         if event_type == 'videom':
-            for chat_id in camera.subscriptions:
-                self.bot.send_message(
-                    to=chat_id,
-                    message=Video(
-                        video=File('camera_%s.mp4' % camera.name, StringIO(camera.state), 'video/mp4')
-                    )
-                )
+            self.send_camera_video(camera, camera.subscriptions)
 
         if event_type == 'video':
-            for chat_id in camera.one_time_sub:
-                self.bot.send_message(
-                    to=chat_id,
-                    message=Video(
-                        video=File('camera_%s.mp4' % camera.name, StringIO(camera.state), 'video/mp4')
-                    )
-                )
+            self.send_camera_video(camera, camera.one_time_sub)
             camera.one_time_sub = []
+
+        if isinstance(camera.state, SpooledPayload):
+            # spool file is kept only until all sends are finished
+            camera.state.release()
+        pass
+
+    @gen.coroutine
+    def send_camera_photo(self, camera, frame):
+        payload = camera.state
+        buttons = [{'text': 'Subscribe', 'callback_data': '/camera %s' % camera.name}]
+        if self.photo_variants is None:
+            variants = {PhotoVariants.original: list(camera.subscriptions)}
+        else:
+            variants = defaultdict(list)
+            for chat_id in camera.subscriptions:
+                variants[self.photo_preference(chat_id)].append(chat_id)
+            if frame is not None:
+                buttons.append({
+                    'text': 'Original', 'callback_data': '/camera %s original %d' % (camera.name, frame.id)
+                })
+        markup = {'inline_keyboard': [buttons]}
+
+        # each variant is built once and uploaded once, other chats of variant get file_id
+        futures = []
+        for variant, chat_ids in variants.iteritems():
+            photo = payload
+            if variant != PhotoVariants.original:
+                photo = yield self.photo_variants.get(payload, variant)
+            futures.append(self.media.send(
+                chat_ids, 'photo', photo, 'image.jpg', 'image/jpeg',
+                caption='camera#%s' % camera.name, reply_markup=markup
+            ))
+        yield futures
         pass
 
+    def send_camera_video(self, camera, chat_ids):
+        payload = camera.state
+        future = self.media.send(chat_ids, 'video', payload, 'camera_%s.mp4' % camera.name, 'video/mp4')
+        if isinstance(payload, SpooledPayload):
+            if future.done():
+                # done callbacks are deferred to next IOLoop iteration
+                return future
+            payload.acquire()
+            future.add_done_callback(lambda _: payload.release())
+        return future
+
     def event_notify(self, sensor):
         self.logger.info("Notify sensor %s triggered", sensor.name)
-        for chat_id in sensor.subscriptions:
-            self.bot.send_message(
-                to=chat_id,
-                message="<b>%s</b>: %s" % (sensor.name, sensor.state),
-                parse_mode='HTML'
-            )
+        self.state_snapshot.notify()
+        text = "<b>%s</b>: %s" % (sensor.name, sensor.state)
+        urgent = sensor.type in self.urgent_types
+        self.digest.add_many(sensor.subscriptions, text, urgent)
         pass
 
     def event_sensor(self, sensor):
         self.logger.info("Sensor %s changed to %d", sensor.name, sensor.state)
         status = sensor.state
         now = time.time()
+        self.rules.update(sensor, now)
 
-        if status > 0 and (now-sensor.triggered) > self.trigger_gap:
+        triggered = status > 0 and (now-sensor.triggered) > self.trigger_gap
+        if triggered:
             sensor.triggered = now
-            for chat_id in sensor.subscriptions:
-                self.notify_sensor(chat_id, sensor)
+            text = self.status_fragments.get(sensor, now)
+            urgent = sensor.type in self.urgent_types
+            self.digest.add_many(sensor.subscriptions, text, urgent)
+        self.store_sensor(sensor, state=sensor.state, changed=sensor.changed, triggered=sensor.triggered)
+        if self.history is not None:
+            self.history.add(sensor.name, sensor.state, sensor.changed, triggered)
+        self.state_snapshot.notify()
         pass
 
+    def fire_rule(self, rule, sensor):
+        # rule is notified to chats subscribed to any of its sensors
+        chats = set()
+        for name in rule.members:
+            member = self.sensors.get(name)
+            if member is not None:
+                chats.update(member.subscriptions)
+        text = "<b>%s</b>: %s (%s)" % (rule.name, rule.expression, sensor.name)
+        self.digest.add_many(chats, text, 'rule' in self.urgent_types)
+        pass
 
-def main():
 
-    class LoadFromFile(argparse.Action):
-        def __call__(self, parser, namespace, values, option_string=None):
-            with values as f:
+class HomeBotShard(mqtt.TornadoMqttClient):
+    # Ingestion worker: decodes messages for its partition of sensor topics
+    # and forwards state changes to coordinator process
+    def __init__(self, ioloop, mqtt_url, sensors, index, count, socket_path, warm_start=True,
+                 template_limit=None, template_idle=None, subscribe_wildcards=0):
+        self.logger = logging.getLogger('%s-%d' % (self.__class__.__name__, index))
+        self.subscribe_wildcards = subscribe_wildcards
+        self.forwarder = ShardForwarder(socket_path)
+        self.warm_start = warm_start
+        self.sensors = SensorRegistry()
+        self.index = index
+        self.count = count
+        # every worker subscribes wildcard templates, sensors are created only for topics of its partition,
+        # topics of static sensors are left to their own worker
+        self.static_topics = set()
+        self.templates = SensorTemplates(
+            self.sensors, -(-template_limit // count) if template_limit is not None else None, template_idle,
+            on_created=self.setup_sensor, accept=self.owns_topic
+        )
+        for url in sensors or []:
+            if SensorTemplate.is_template(url):
+                self.templates.add(SensorTemplate(url))
+                continue
+            sensor = Sensor.from_url(url)
+            self.static_topics.add(sensor.topic)
+            if is_sharded(sensor) and shard_of(sensor.topic, count) == index:
+                self.sensors.add(self.setup_sensor(sensor))
+        self.logger.info("Worker %d of %d owns %d sensors", index, count, len(self.sensors))
+
+        mqtt.TornadoMqttClient.__init__(
+            self, ioloop=ioloop, host=mqtt_url.hostname,
+            port=mqtt_url.port if mqtt_url.port is not None else 1883,
+            username=mqtt_url.username, password=mqtt_url.password
+        )
+        pass
+
+    def setup_sensor(self, sensor):
+        sensor.on_changed = self.forwarder.forward
+        return sensor
+
+    def owns_topic(self, topic):
+        return shard_of(topic, self.count) == self.index and topic not in self.static_topics
+
+    def on_mqtt_connect(self, client, obj, flags, rc):
+        self.logger.info("MQTT broker: %s", mqtt.connack_string(rc))
+        if rc == 0:
+            topics = set(sensor.topic for sensor in self.sensors if sensor.name not in self.templates)
+            topics.update(self.templates.topics)
+            if self.subscribe_wildcards > 0:
+                topics = consolidate(topics, self.subscribe_wildcards)
+            subscribe_topics(client, topics)
+        pass
+
+    def on_mqtt_message(self, client, obj, message):
+        self.templates.materialize(message.topic)
+        for sensor in self.sensors.match(message.topic):
+            if not message.retain:
+                sensor.process(message.topic, message.payload)
+            elif self.warm_start:
+                try:
+                    sensor.load(message.topic, message.payload)
+                except ValueError:
+                    self.logger.warn("Bad retained payload for sensor %s: %r", sensor.name, message.payload)
+                    continue
+                self.forwarder.forward(sensor, retained=True)
+        pass
+
+
+def fork_process(target, *args):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            target(*args)
+        except Exception:
+            logging.exception("Process %s failed", target.__name__)
+            os._exit(1)
+        os._exit(0)
+    return pid
+
+
+def run_supervisor(args, socket_path):
+    # workers are forked from this process which is started before coordinator opens
+    # any socket or file, so restarted workers inherit nothing from coordinator
+    ioloop = IOLoop()
+    ioloop.make_current()
+    signal.signal(signal.SIGTERM, lambda signum, frame: ioloop.add_callback_from_signal(ioloop.stop))
+    supervisor = ShardSupervisor(lambda index: fork_process(run_shard, index, args, socket_path), args.shards)
+    supervisor.start()
+    supervisor.watch()
+    watch_parent(ioloop.stop)
+    try:
+        ioloop.start()
+    except KeyboardInterrupt:
+        ioloop.stop()
+    finally:
+        supervisor.stop()
+    pass
+
+
+def run_shard(index, args, socket_path):
+    # worker forked from running supervisor must not share its IOLoop
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    IOLoop.clear_instance()
+    ioloop = IOLoop()
+    ioloop.make_current()
+    watch_parent(ioloop.stop)
+    shard = HomeBotShard(
+        ioloop=ioloop, mqtt_url=args.url, sensors=args.sensors, index=index, count=args.shards,
+        socket_path=socket_path, warm_start=args.warm_start, template_limit=args.template_limit,
+        template_idle=args.template_idle, subscribe_wildcards=args.subscribe_wildcards
+    )
+    shard.start()
+    try:
+        ioloop.start()
+    except KeyboardInterrupt:
+        ioloop.stop()
+    pass
+
+
+class LoadFromFile(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        try:
+            with open(values) as f:
                 parser.parse_args(shlex.split(f.read()), namespace)
+        except IOError as e:
+            parser.error(str(e))
+        # path is kept to reload config when it is changed
+        setattr(namespace, self.dest, values)
+
 
+def build_parser():
     parser = argparse.ArgumentParser(fromfile_prefix_chars='@')
 
     basic = parser.add_argument_group('basic', 'Basic parameters')
-    basic.add_argument("-c", "--config", type=open, action=LoadFromFile, help="Load config from file")
+    basic.add_argument("-c", "--config", action=LoadFromFile, help="Load config from file")
     basic.add_argument("-u", "--url", default="mqtt://localhost:1883", type=urlparse.urlparse,
                        help="MQTT Broker address host:port")
     basic.add_argument("--token", help="Telegram API bot token")
     basic.add_argument("--admin", nargs="+", help="Bot admin", type=int, dest="admins")
-    basic.add_argument("--extra", help="Run process on command /command:shell_exe", nargs="*", dest="extra")
+    basic.add_argument("--extra", help="Run process on command /command[@timeout]:shell_exe", nargs="*",
+                       dest="extra", default=[])
+    basic.add_argument("--extra-max", help="Max concurrently running processes", type=int, default=2,
+                       dest="extra_max")
     basic.add_argument("--proxy")
+    basic.add_argument("--upload-chunk", type=int, default=64, dest="upload_chunk",
+                       help="Media upload chunk size in KB")
+    basic.add_argument("--broadcast-max", type=int, default=8, dest="broadcast_max",
+                       help="Max concurrently sent messages when notifying many chats")
+    basic.add_argument("--watch", type=float, default=0, dest="watch",
+                       help="Check config file every N seconds and reload sensors when it is changed")
+    basic.add_argument("--http-port", dest="http_port", type=int, default=None,
+                       help="Serve sensors state as JSON on /sensors")
+    basic.add_argument("--queue", type=int, default=0, dest="queue_size",
+                       help="Process MQTT messages through queue of this size, 0 - process immediately")
+    basic.add_argument("--queue-policy", nargs="*", default=[], dest="queue_policies",
+                       help="Queue policy for topics pattern:keep|latest|drop, e.g. home/wireless/+:latest")
+    basic.add_argument("--shards", type=int, default=0, dest="shards",
+                       help="Run N ingestion worker processes for sensor topics")
+    basic.add_argument("--shard-socket", dest="shard_socket", help="Unix socket for ingestion workers")
+    basic.add_argument("--subscribe-wildcards", type=int, default=0, dest="subscribe_wildcards",
+                       help="Subscribe parent/+ instead of N or more sibling sensor topics")
     basic.add_argument("--logfile", help="Logging into file")
     basic.add_argument("-v", action="store_true", default=False, help="Verbose logging", dest="verbose")
 
     status = parser.add_argument_group('status', 'Home state parameters')
-    status.add_argument("--sensors", nargs="*", help="Sensor in URL format: type://name[!]@mqtt_topic")
+    status.add_argument("--sensors", nargs="*", help="Sensor in URL format: type://name[!]@mqtt_topic, "
+                        "name may refer to topic wildcards: type://{1}@home/+")
+    status.add_argument("--template-limit", type=int, default=None, dest="template_limit",
+                        help="Max sensors created from wildcard sensors")
+    status.add_argument("--template-idle", type=float, default=None, dest="template_idle",
+                        help="Remove wildcard sensors without messages during this time, seconds")
+    status.add_argument("--state", help="Directory to persist sensors state and subscriptions", dest="state_path")
+    status.add_argument("--digest-window", type=float, default=0, dest="digest_window",
+                        help="Collect sensor notifications into one message during this time, seconds")
+    status.add_argument("--urgent", nargs="*", default=[], dest="urgent_types",
+                        help="Sensor types notified immediately regardless of digest window")
+    status.add_argument("--no-warm-start", action="store_false", default=True, dest="warm_start",
+                        help="Ignore retained MQTT messages on startup")
+    status.add_argument("--snapshot-memory", type=int, default=16, dest="snapshot_memory",
+                        help="Memory for recent camera frames, MB")
+    status.add_argument("--snapshot-frames", type=int, default=10, dest="snapshot_frames",
+                        help="Recent frames kept per camera")
+    status.add_argument("--photo-sizes", nargs="*", default=[], dest="photo_sizes",
+                        help="Camera photo variants name:max_side chosen by /photosize, e.g. thumb:320 phone:1280, "
+                        "requires Pillow")
+    status.add_argument("--spool", dest="spool_path", help="Directory for large camera payloads")
+    status.add_argument("--spool-threshold", type=int, default=512, dest="spool_threshold",
+                        help="Camera video payloads from this size are kept on disk, KB")
+    status.add_argument("--rule", nargs="*", default=[], dest="rules",
+                        help="Notification rule name:expression, e.g. 'alarm: door_1 and not any presence'")
+    status.add_argument("--history", dest="history_path", help="Sensors history database file")
+    status.add_argument("--storage", help="Motion video clips directory", dest="video_path",
+                        default="/home/hub/motion/storage")
+    return parser
+
+
+def watch_config(parser, args, argv, handler):
+    # config file is parsed again with the same command line, only sensors are applied
+    if args.config is None or args.watch <= 0:
+        return None
+
+    def reload_config(path):
+        try:
+            handler.reload_sensors(parser.parse_args(argv).sensors or [])
+        except SystemExit:
+            logging.error("Bad config file %s, sensors are not reloaded", path)
+    return FileWatcher(args.config, reload_config, args.watch)
 
+
+def main():
+    parser = build_parser()
     args = parser.parse_args()
 
     # configure logging
@@ -374,18 +1050,70 @@ def main():
         filename=args.logfile
     )
     logging.info("Starting telegram bot")
+
+    shard_socket = None
+    supervisor = None
+    if args.shards > 0:
+        shard_socket = args.shard_socket or os.path.join(tempfile.gettempdir(), 'homebot-%d.sock' % os.getpid())
+        # supervisor process is forked before IOLoop is created, it is only watched by coordinator
+        supervisor = ShardSupervisor(
+            lambda index: fork_process(run_supervisor, args, shard_socket), 1,
+            restart_delay=None, name='Shards supervisor'
+        )
+        supervisor.start()
     ioloop = IOLoop.instance()
+    # SIGTERM stops IOLoop, so workers are stopped too
+    signal.signal(signal.SIGTERM, lambda signum, frame: ioloop.add_callback_from_signal(ioloop.stop))
     bot = Bot(args.token, args.admins, proxy=args.proxy, ioloop=ioloop)
 
-    cmds = {x.split(':', 1)[0]: x.split(':', 1)[1] for x in args.extra}
-    handler = HomeBotHandler(ioloop=ioloop, admins=bot.admins, mqtt_url=args.url, sensors=args.sensors, extra_cmds=cmds)
+    cmds = {}
+    timeouts = {}
+    for extra in args.extra:
+        name, command = extra.split(':', 1)
+        name, _, timeout = name.partition('@')
+        cmds[name] = command
+        if timeout:
+            timeouts[name] = int(timeout)
+    # streaming uploads go directly to Bot API, proxy is supported only by bot itself
+    uploader = MediaUploader(args.token, chunk_size=args.upload_chunk*1024) if args.proxy is None else None
+    handler = HomeBotHandler(
+        ioloop=ioloop, admins=bot.admins, mqtt_url=args.url, sensors=args.sensors, extra_cmds=cmds,
+        state_path=args.state_path, video_path=args.video_path, uploader=uploader,
+        shell_timeouts=timeouts, shell_max=args.extra_max,
+        digest_window=args.digest_window, urgent_types=args.urgent_types, warm_start=args.warm_start,
+        snapshot_memory=args.snapshot_memory*1024*1024, snapshot_frames=args.snapshot_frames,
+        spool_path=args.spool_path, spool_threshold=args.spool_threshold*1024,
+        broadcast_max=args.broadcast_max, history_path=args.history_path,
+        rules=args.rules, template_limit=args.template_limit, template_idle=args.template_idle,
+        queue_size=args.queue_size, queue_policies=[x.rsplit(':', 1) for x in args.queue_policies],
+        shard_socket=shard_socket,
+        subscribe_wildcards=args.subscribe_wildcards,
+        photo_sizes=dict((name, int(size)) for name, size in (x.split(':', 1) for x in args.photo_sizes))
+    )
     bot.add_handler(handler)
+    if handler.coordinator is not None:
+        handler.coordinator.listen_unix()
+    if supervisor is not None:
+        supervisor.watch()
+    if args.http_port is not None:
+        webapp = tornado.web.Application(
+            [(r'/sensors', SensorStateHandler, {'snapshot': handler.state_snapshot})]
+        )
+        webapp.listen(port=args.http_port)
+    watcher = watch_config(parser, args, sys.argv[1:], handler)
+    if watcher is not None:
+        watcher.start()
     bot.loop_start()
     handler.start()
     try:
         ioloop.start()
     except KeyboardInterrupt:
         ioloop.stop()
+    finally:
+        if supervisor is not None:
+            supervisor.stop()
+        if handler.history is not None:
+            handler.history.close()
     pass
 
 
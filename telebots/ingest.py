@@ -0,0 +1,119 @@
+import logging
+from collections import deque
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.locks import Condition
+from tornado.concurrent import is_future
+from topics import TopicTrie
+
+
+class IngestQueue(object):
+    # Bounded queue of incoming MQTT messages drained by worker coroutines.
+    # Policy is chosen by topic pattern:
+    #   keep   - never dropped, queue may grow over the limit
+    #   latest - only the last queued message of topic is processed
+    #   drop   - new message is dropped when queue is full
+    policies = ('keep', 'latest', 'drop')
+
+    def __init__(self, handle, maxsize=1000, workers=1, policies=None, default_policy='drop', batch=20):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.handle = handle
+        self.maxsize = maxsize
+        self.workers = workers
+        self.default_policy = default_policy
+        self.batch = batch
+        self._policies = TopicTrie()
+        self._topic_policy = {}
+        for pattern, policy in policies or []:
+            self.add_policy(pattern, policy)
+
+        self._queue = deque()
+        self._latest = {}
+        self._ready = Condition()
+        self._started = False
+        self.processed = 0
+        self.dropped = 0
+        self.merged = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def stats(self):
+        return {
+            'depth': len(self._queue), 'max_depth': self.max_depth,
+            'processed': self.processed, 'dropped': self.dropped, 'merged': self.merged
+        }
+
+    def add_policy(self, pattern, policy):
+        if policy not in self.policies:
+            raise ValueError("Unknown queue policy %s" % policy)
+        self._policies.add(pattern, policy)
+        self._topic_policy = {}
+
+    def policy(self, topic):
+        policy = self._topic_policy.get(topic)
+        if policy is None:
+            matched = self._policies.match(topic)
+            policy = self._topic_policy[topic] = matched[0] if len(matched) > 0 else self.default_policy
+        return policy
+
+    def put(self, message):
+        policy = self.policy(message.topic)
+        if policy == 'latest':
+            if message.topic in self._latest:
+                # queued message is replaced, its place in queue is kept
+                self._latest[message.topic] = message
+                self.merged += 1
+                return True
+        elif policy == 'drop' and len(self._queue) >= self.maxsize:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                self.logger.warn("Queue is full (%d), %d messages dropped", len(self._queue), self.dropped)
+            return False
+
+        if policy == 'latest':
+            self._latest[message.topic] = message
+            self._queue.append(message.topic)
+        else:
+            self._queue.append(message)
+        self.max_depth = max(self.max_depth, len(self._queue))
+
+        if not self._started:
+            self.start()
+        self._ready.notify()
+        return True
+
+    def get(self):
+        item = self._queue.popleft()
+        if isinstance(item, basestring):
+            return self._latest.pop(item)
+        return item
+
+    def start(self):
+        self._started = True
+        for _ in xrange(self.workers):
+            IOLoop.current().spawn_callback(self.worker)
+        pass
+
+    @gen.coroutine
+    def worker(self):
+        handled = 0
+        while True:
+            if len(self._queue) == 0:
+                yield self._ready.wait()
+                continue
+            message = self.get()
+            try:
+                result = self.handle(message)
+                if is_future(result):
+                    yield result
+            except Exception:
+                self.logger.exception("Error while processing message from %s", message.topic)
+            self.processed += 1
+            handled += 1
+            if handled % self.batch == 0:
+                # let IOLoop serve other events during backlog
+                yield gen.moment
+        pass
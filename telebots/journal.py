@@ -0,0 +1,76 @@
+import os
+import os.path
+import json
+import logging
+
+
+class SensorJournal(object):
+    # Sensor table persistence: changes are appended to the journal log,
+    # the log is periodically compacted into a full snapshot
+    def __init__(self, path, compact_limit=1000):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.compact_limit = compact_limit
+        self.snapshot_file = os.path.join(path, 'snapshot.json')
+        self.log_file = os.path.join(path, 'journal.log')
+        self._log = None
+        self._records = 0
+
+    @property
+    def records(self):
+        return self._records
+
+    def should_compact(self):
+        return self._records >= self.compact_limit
+
+    def load(self):
+        table = {}
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'rb') as f:
+                table = json.load(f)
+
+        self._records = 0
+        if os.path.exists(self.log_file):
+            with open(self.log_file, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # incomplete tail record after crash
+                        self.logger.warn("Skip broken journal record: %r", line)
+                        continue
+                    table.setdefault(record.pop('name'), {}).update(record)
+                    self._records += 1
+        self.logger.info("Loaded %d sensors, %d journal records", len(table), self._records)
+        return table
+
+    def append(self, name, **fields):
+        if self._log is None:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            self._log = open(self.log_file, 'ab')
+        fields['name'] = name
+        self._log.write(json.dumps(fields, separators=(',', ':')) + '\n')
+        self._log.flush()
+        self._records += 1
+
+    def compact(self, table):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        temp_file = self.snapshot_file + '.tmp'
+        with open(temp_file, 'wb') as f:
+            json.dump(table, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_file, self.snapshot_file)
+
+        self.close()
+        open(self.log_file, 'wb').close()
+        self._records = 0
+        self.logger.info("Journal compacted into snapshot with %d sensors", len(table))
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        pass
@@ -0,0 +1,172 @@
+import json
+import hashlib
+import logging
+import cachetools
+from tornado import gen
+from tornado.concurrent import Future
+from pytelegram_async.entity import Photo, Video, Document, File
+from upload import UploadSource
+from broadcast import Broadcaster
+
+
+class MediaBroadcaster(object):
+    # Uploads media payload only once, other recipients get Telegram file_id
+    media_types = {
+        'photo': Photo,
+        'video': Video,
+        'document': Document
+    }
+
+    def __init__(self, bot, uploader=None, cache_size=128, broadcaster=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.bot = bot
+        self.uploader = uploader
+        self.broadcaster = broadcaster or Broadcaster()
+        self.file_ids = cachetools.LRUCache(maxsize=cache_size)
+        self._uploads = {}
+
+    @staticmethod
+    def content_key(media_type, source):
+        # file_id of photo can't be sent as document and vice versa
+        if source.path is None:
+            return media_type, hashlib.sha1(source.data).hexdigest()
+        return media_type, source.digest()
+
+    def build_message(self, media_type, media, caption=None):
+        params = {media_type: media}
+        if caption is not None:
+            params['caption'] = caption
+        return self.media_types[media_type](**params)
+
+    @staticmethod
+    def extract_file_id(media_type, response):
+        try:
+            result = json.loads(response.body)['result']
+        except (AttributeError, TypeError, ValueError, KeyError):
+            return None
+        for key in (media_type, 'animation', 'document'):
+            media = result.get(key)
+            if isinstance(media, list):
+                # photo sizes, the last one is the largest
+                media = media[-1] if len(media) > 0 else None
+            if isinstance(media, dict) and 'file_id' in media:
+                return media['file_id']
+        return None
+
+    @staticmethod
+    def extract_album_file_ids(media_type, response):
+        try:
+            messages = json.loads(response.body)['result']
+        except (AttributeError, TypeError, ValueError, KeyError):
+            return []
+        result = []
+        for message in messages:
+            media = message.get(media_type)
+            if isinstance(media, list):
+                media = media[-1] if len(media) > 0 else None
+            result.append(media.get('file_id') if isinstance(media, dict) else None)
+        return result
+
+    @gen.coroutine
+    def _send(self, chat_id, message, params):
+        try:
+            response = yield self.bot.send_message(to=chat_id, message=message, **params)
+        except Exception:
+            self.logger.exception("Error while sending media to %s", chat_id)
+            response = None
+        raise gen.Return(response)
+
+    @gen.coroutine
+    def _upload(self, chat_id, media_type, source, filename, mime_type, caption, params):
+        if self.uploader is None:
+            stream = source.open()
+            try:
+                message = self.build_message(media_type, File(filename, stream, mime_type), caption)
+                response = yield self._send(chat_id, message, params)
+            finally:
+                stream.close()
+            raise gen.Return(response)
+        try:
+            response = yield self.uploader.send_media(
+                chat_id, media_type, source, filename, mime_type, caption=caption, **params
+            )
+        except Exception:
+            self.logger.exception("Error while uploading media to %s", chat_id)
+            response = None
+        raise gen.Return(response)
+
+    @gen.coroutine
+    def send(self, chat_ids, media_type, payload, filename, mime_type, caption=None, **params):
+        chat_ids = list(chat_ids)
+        if len(chat_ids) == 0:
+            raise gen.Return([])
+        source = payload if isinstance(payload, UploadSource) else UploadSource(data=payload)
+        key = self.content_key(media_type, source)
+        responses = []
+
+        file_id = self.file_ids.get(key)
+        while len(chat_ids) > 0 and file_id is None:
+            # same payload is uploading right now, wait for its file_id
+            if key in self._uploads:
+                yield self._uploads[key]
+                file_id = self.file_ids.get(key)
+                continue
+
+            chat_id = chat_ids.pop(0)
+            uploaded = self._uploads[key] = Future()
+            try:
+                response = yield self._upload(chat_id, media_type, source, filename, mime_type, caption, params)
+                responses.append(response)
+
+                file_id = self.extract_file_id(media_type, response)
+                if file_id is not None:
+                    self.logger.debug("Uploaded %s %s as %s", media_type, key[1], file_id)
+                    self.file_ids[key] = file_id
+            finally:
+                del self._uploads[key]
+                uploaded.set_result(None)
+
+        if len(chat_ids) > 0:
+            message = self.build_message(media_type, file_id, caption)
+            sent = yield self.broadcaster.send(
+                chat_ids, lambda chat_id: self.bot.send_message(to=chat_id, message=message, **params)
+            )
+            responses.extend(sent.responses)
+        raise gen.Return(responses)
+
+    @gen.coroutine
+    def send_album(self, chat_id, media_type, items):
+        # items are tuples (payload, filename, mime_type, caption)
+        if self.uploader is None or len(items) < 2:
+            responses = []
+            for payload, filename, mime_type, caption in items:
+                sent = yield self.send([chat_id], media_type, payload, filename, mime_type, caption=caption)
+                responses.extend(sent)
+            raise gen.Return(responses)
+
+        media = []
+        files = []
+        keys = []
+        for idx, (payload, filename, mime_type, caption) in enumerate(items[:10]):
+            source = payload if isinstance(payload, UploadSource) else UploadSource(data=payload)
+            key = self.content_key(media_type, source)
+            file_id = self.file_ids.get(key)
+            if file_id is None:
+                name = 'file%d' % idx
+                files.append((name, filename, mime_type, source))
+                file_id = 'attach://' + name
+            keys.append(key)
+            item = {'type': media_type, 'media': file_id}
+            if caption is not None:
+                item['caption'] = caption
+            media.append(item)
+
+        try:
+            response = yield self.uploader.send_media_group(chat_id, media, files)
+        except Exception:
+            self.logger.exception("Error while sending album to %s", chat_id)
+            raise gen.Return([None])
+        for key, file_id in zip(keys, self.extract_album_file_ids(media_type, response)):
+            if file_id is not None:
+                self.file_ids[key] = file_id
+        raise gen.Return([response])
@@ -0,0 +1,105 @@
+import cgi
+import json
+import time
+import shlex
+import logging
+import subprocess
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.locks import Lock, Semaphore
+from tornado.process import Subprocess
+
+
+class ProcessManager(object):
+    # Runs shell commands asynchronously with concurrency cap and timeouts,
+    # output is captured by chunks as soon as it arrives
+    def __init__(self, max_running=2, timeout=None, output_limit=64*1024, chunk_size=4096):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.max_running = max_running
+        self.timeout = timeout
+        self.output_limit = output_limit
+        self.chunk_size = chunk_size
+        self.running = {}
+        self._slots = Semaphore(max_running)
+
+    def kill(self, process, command):
+        self.logger.warn('Command "%s" is killed by timeout', command)
+        try:
+            process.proc.kill()
+        except OSError:
+            pass
+        pass
+
+    @gen.coroutine
+    def run(self, command, on_output=None, timeout=None):
+        timeout = timeout or self.timeout
+        yield self._slots.acquire()
+        timer = None
+        process = None
+        try:
+            self.logger.info('Starting command "%s"', command)
+            process = Subprocess(shlex.split(command), stdout=Subprocess.STREAM, stderr=subprocess.STDOUT)
+            self.running[process.pid] = command
+            if timeout:
+                timer = IOLoop.current().call_later(timeout, self.kill, process, command)
+
+            output = ''
+            while True:
+                try:
+                    chunk = yield process.stdout.read_bytes(self.chunk_size, partial=True)
+                except StreamClosedError:
+                    break
+                output = (output + chunk)[-self.output_limit:]
+                if on_output is not None:
+                    on_output(output)
+
+            code = yield process.wait_for_exit(raise_error=False)
+            self.logger.info('Command "%s" is ends with code %d', command, code)
+        finally:
+            if timer is not None:
+                IOLoop.current().remove_timeout(timer)
+            if process is not None:
+                self.running.pop(process.pid, None)
+            self._slots.release()
+        raise gen.Return((code, output))
+
+
+class ProgressMessage(object):
+    # Telegram message which is sent on first output and edited on next ones
+    def __init__(self, bot, chat_id, interval=2.0, max_length=4000):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self.max_length = max_length
+        self.message_id = None
+        self.text = ''
+        self.updated = 0
+        self._lock = Lock()
+
+    def render(self, text):
+        text = text.strip()[-self.max_length:]
+        return '<pre>%s</pre>' % cgi.escape(text) if text != '' else ''
+
+    def progress(self, output):
+        now = time.time()
+        if now - self.updated >= self.interval:
+            self.updated = now
+            self.update(output)
+        pass
+
+    @gen.coroutine
+    def update(self, output):
+        with (yield self._lock.acquire()):
+            text = self.render(output)
+            if text == '' or text == self.text:
+                return
+            if self.message_id is None:
+                response = yield self.bot.send_message(to=self.chat_id, message=text, parse_mode='HTML')
+                self.message_id = json.loads(response.body)['result']['message_id']
+            else:
+                yield self.bot.edit_message_text(
+                    to=self.chat_id, message_id=self.message_id, text=text, parse_mode='HTML'
+                )
+            self.text = text
+        pass
@@ -0,0 +1,216 @@
+import re
+import time
+import logging
+from collections import defaultdict, deque
+
+
+# Rule expression is terms joined by "and", each term may be negated by "not":
+#   <sensor>                         sensor is on (opened, motion, present...)
+#   any <selector>                   at least one of sensors is on
+#   all <selector>                   all sensors are on
+#   <N> of <selector> within <S>     N different sensors turned on during last S seconds
+# selector is sensor type or comma separated sensor names
+class Term(object):
+    def __init__(self, selector):
+        self.selector = selector
+        self.members = set()
+
+    def matches(self, sensor):
+        if ',' in self.selector:
+            return sensor.name in self.selector.split(',')
+        return sensor.type == self.selector or sensor.name == self.selector
+
+    def missing(self):
+        # selectors without any registered sensor
+        if ',' in self.selector:
+            return [name for name in self.selector.split(',') if name not in self.members]
+        return [self.selector] if len(self.members) == 0 else []
+
+    def attach(self, sensor):
+        self.members.add(sensor.name)
+        self.update(sensor, 0)
+
+    def update(self, sensor, now, silent=False):
+        pass
+
+    def value(self, now):
+        raise NotImplementedError()
+
+
+class SensorTerm(Term):
+    def __init__(self, selector):
+        Term.__init__(self, selector)
+        self.on = False
+
+    def matches(self, sensor):
+        return sensor.name == self.selector
+
+    def update(self, sensor, now, silent=False):
+        self.on = bool(sensor.state)
+
+    def value(self, now):
+        return self.on
+
+
+class AnyTerm(Term):
+    def __init__(self, selector):
+        Term.__init__(self, selector)
+        self.on = set()
+
+    def update(self, sensor, now, silent=False):
+        if sensor.state:
+            self.on.add(sensor.name)
+        else:
+            self.on.discard(sensor.name)
+
+    def value(self, now):
+        return len(self.on) > 0
+
+
+class AllTerm(AnyTerm):
+    def value(self, now):
+        return len(self.members) > 0 and len(self.on) == len(self.members)
+
+
+class WindowTerm(Term):
+    # sensors triggered in sliding window, old triggers are dropped as window moves
+    def __init__(self, selector, count, window):
+        Term.__init__(self, selector)
+        self.count = count
+        self.window = window
+        self.events = deque()
+        self.last = {}
+
+    def update(self, sensor, now, silent=False):
+        if not sensor.state or now <= 0:
+            return
+        timestamp = now
+        if silent:
+            # restored state happened at its change time, old changes are out of window
+            if not isinstance(sensor.changed, (int, long, float)) or now - sensor.changed > self.window:
+                return
+            timestamp = min(sensor.changed, now)
+        if len(self.events) > 0 and self.events[-1][0] > timestamp:
+            self.events = deque(sorted(list(self.events) + [(timestamp, sensor.name)]))
+        else:
+            self.events.append((timestamp, sensor.name))
+        self.last[sensor.name] = max(self.last.get(sensor.name, 0), timestamp)
+
+    def value(self, now):
+        limit = now - self.window
+        while len(self.events) > 0 and self.events[0][0] < limit:
+            timestamp, name = self.events.popleft()
+            if self.last.get(name) == timestamp:
+                del self.last[name]
+        return len(self.last) >= self.count
+
+
+class Rule(object):
+    term_regex = re.compile(r'^(not\s+)?(?:(any|all)\s+(\S+)|(\d+)\s+of\s+(\S+)\s+within\s+(\d+(?:\.\d+)?)s?|(\S+))$')
+
+    def __init__(self, name, expression):
+        self.name = name
+        self.expression = expression
+        self.terms = []
+        self.active = False
+        self.fired = 0
+        for text in re.split(r'\s+and\s+', expression.strip()):
+            match = self.term_regex.match(text.strip())
+            if match is None:
+                raise ValueError("Bad rule term: %s" % text)
+            negate, kind, selector, count, window_selector, window, sensor_name = match.groups()
+            if kind == 'any':
+                term = AnyTerm(selector)
+            elif kind == 'all':
+                term = AllTerm(selector)
+            elif count is not None:
+                term = WindowTerm(window_selector, int(count), float(window))
+            else:
+                term = SensorTerm(sensor_name)
+            self.terms.append((term, negate is not None))
+        pass
+
+    @property
+    def members(self):
+        return set().union(*[term.members for term, _ in self.terms])
+
+    def evaluate(self, now):
+        for term, negate in self.terms:
+            if term.value(now) == negate:
+                return False
+        return True
+
+
+class RuleEngine(object):
+    # Rules are re-evaluated only when sensor they depend on is changed
+    def __init__(self, fire):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.fire = fire
+        self.rules = []
+        self._index = defaultdict(list)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add(self, name, expression, sensors=(), templates=()):
+        rule = Rule(name, expression)
+        for sensor in sensors:
+            self._attach(rule, sensor)
+        for term, _ in rule.terms:
+            for selector in term.missing():
+                # sensor may appear later from wildcard template, otherwise selector is a typo
+                if not [x for x in templates if x.type == selector or x.may_create(selector)]:
+                    self._detach_rule(rule)
+                    raise ValueError("Rule %s: no sensor matches %s" % (name, selector))
+                self.logger.warn("Rule %s: no sensors match %s yet", name, selector)
+        self.rules.append(rule)
+        rule.active = rule.evaluate(time.time())
+        return rule
+
+    def attach(self, sensor):
+        # new sensor registered, add it to rules selecting it
+        for rule in self.rules:
+            self._attach(rule, sensor)
+        pass
+
+    def _attach(self, rule, sensor):
+        for term, _ in rule.terms:
+            if term.matches(sensor) and sensor.name not in term.members:
+                term.attach(sensor)
+                if rule not in self._index[sensor.name]:
+                    self._index[sensor.name].append(rule)
+        pass
+
+    def _detach_rule(self, rule):
+        for sensor_name in rule.members:
+            self._index[sensor_name].remove(rule)
+        pass
+
+    def detach(self, sensor):
+        for rule in self._index.pop(sensor.name, []):
+            for term, _ in rule.terms:
+                term.members.discard(sensor.name)
+                if isinstance(term, AnyTerm):
+                    term.on.discard(sensor.name)
+        pass
+
+    def dependent(self, sensor):
+        return self._index.get(sensor.name, [])
+
+    def update(self, sensor, now=None, silent=False):
+        now = now or time.time()
+        fired = []
+        for rule in self._index.get(sensor.name, []):
+            for term, _ in rule.terms:
+                if sensor.name in term.members:
+                    term.update(sensor, now, silent)
+            active = rule.evaluate(now)
+            if active and not rule.active and not silent:
+                rule.fired += 1
+                fired.append(rule)
+            rule.active = active
+
+        for rule in fired:
+            self.logger.info("Rule %s fired by %s", rule.name, sensor.name)
+            self.fire(rule, sensor)
+        return fired
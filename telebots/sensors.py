@@ -1,5 +1,10 @@
-from urlparse import urlparse
+from urlparse import urlparse, parse_qs
 from itertools import chain
+from collections import defaultdict
+from topics import TopicTrie
+from subscriptions import SubscriptionIndex
+from tornado.ioloop import IOLoop
+import struct
 import time
 import json
 
@@ -8,11 +13,76 @@ def subclasses(cls):
     return list(chain(cls.__subclasses__(), *[subclasses(x) for x in cls.__subclasses__()]))
 
 
+# Payload codecs, each returns tuple (state, changed), changed is None when payload has no timestamp
+def decode_json(payload):
+    value = json.loads(payload)
+    if isinstance(value, dict):
+        return value.get('status'), value.get('changed')
+    return value, None
+
+
+_int_states = {'0': 0, '1': 1}
+
+
+def decode_int(payload):
+    state = _int_states.get(payload)
+    if state is None:
+        state = int(payload)
+    return state, None
+
+
+_binary_state = struct.Struct('!b')
+_binary_state_changed = struct.Struct('!bI')
+
+
+def decode_binary(payload):
+    # 1 byte signed state, optionally followed by 4 byte unix time of change
+    if len(payload) == _binary_state_changed.size:
+        return _binary_state_changed.unpack(payload)
+    if len(payload) != _binary_state.size:
+        raise ValueError("Binary payload of %d bytes" % len(payload))
+    return _binary_state.unpack(payload)[0], None
+
+
+def decode_raw(payload):
+    return payload, None
+
+
+codecs = {
+    'json': decode_json,
+    'int': decode_int,
+    'binary': decode_binary,
+    'raw': decode_raw
+}
+
+
 class Sensor(object):
     __names__ = ['sensor']
     __states__ = ('alert', 'normal')
-
-    def __init__(self, topic, sensor_type, name, subscriptions=None):
+    __slots__ = (
+        '_topic', '_type', '_name', '_state', '_changed', '_triggered', '_on_changed', '_subscriptions', '_decode',
+        '_debounce', '_accepted', '_pending', '_repeats', '_flaps', '_index', '_version'
+    )
+    __codec__ = 'json'
+    is_dummy = False
+    # global change counter, sensor version is the counter value at its last change
+    clock = 0
+    # clock value at the last change of state sensor, camera and notify events do not move it
+    state_clock = 0
+
+    @staticmethod
+    def tick(state=True):
+        Sensor.clock += 1
+        if state:
+            Sensor.state_clock = Sensor.clock
+        return Sensor.clock
+
+    def __init__(self, topic, sensor_type, name, subscriptions=None, codec=None, debounce=0):
+        if codec is None:
+            codec = self.__codec__
+        if codec not in codecs:
+            raise ValueError("Unknown codec %s for sensor %s" % (codec, name))
+        self._decode = codecs[codec]
         self._topic = topic
         self._type = sensor_type
         self._name = name
@@ -20,9 +90,14 @@ class Sensor(object):
         self._changed = 0
         self._triggered = 0
         self._on_changed = None
-        self._subscriptions = subscriptions or []
-        self.one_time_sub = []
-        self.is_dummy = False
+        self._subscriptions = set(subscriptions) if subscriptions else set()
+        self._index = None
+        self._debounce = debounce
+        self._accepted = 0
+        self._pending = None
+        self._repeats = 0
+        self._flaps = 0
+        self._version = 0
         pass
 
     @property
@@ -44,24 +119,76 @@ class Sensor(object):
     @state.setter
     def state(self, value):
         if isinstance(value, dict):
-            self._state = value.get('status')
-            self._changed = value.get('changed')
+            self.update(value.get('status'), value.get('changed'))
         else:
-            self._state = value
-            self._changed = time.time()
-        if self.on_changed is not None:
-            self.on_changed(self)
+            self.update(value)
+
+    def update(self, state, changed=None):
+        if not self.is_dummy:
+            if self._pending is not None:
+                # debounce window is open, only the last state will be settled
+                if state == self._pending[0]:
+                    self._repeats += 1
+                else:
+                    self._flaps += 1
+                self._pending = (state, changed)
+                return False
+            if state == self._state and self._changed:
+                self._repeats += 1
+                return False
+            if self._debounce > 0:
+                now = time.time()
+                if now - self._accepted < self._debounce:
+                    self._flaps += 1
+                    self._pending = (state, changed)
+                    IOLoop.current().call_later(self._accepted + self._debounce - now, self._settle)
+                    return False
+                self._accepted = now
+        self._commit(state, changed)
+        return True
+
+    def apply(self, state, changed=None):
+        # state is already filtered, e.g. by ingestion worker
+        self._commit(state, changed)
+
+    def _settle(self):
+        state, changed = self._pending
+        self._pending = None
+        if state != self._state:
+            self._accepted = time.time()
+            self._commit(state, changed)
+        pass
+
+    def _commit(self, state, changed):
+        self._version = Sensor.tick(not self.is_dummy)
+        self._state = state
+        self._changed = changed if changed is not None else time.time()
+        if self._on_changed is not None:
+            self._on_changed(self)
 
     @property
     def changed(self):
         return self._changed
 
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def debounce(self):
+        return self._debounce
+
+    @property
+    def suppressed(self):
+        return {'repeats': self._repeats, 'flaps': self._flaps}
+
     @property
     def triggered(self):
         return self._triggered
 
     @triggered.setter
     def triggered(self, value):
+        self._version = Sensor.tick(not self.is_dummy)
         self._triggered = value
 
     @property
@@ -77,15 +204,56 @@ class Sensor(object):
         return self._subscriptions
 
     def add_subscription(self, value):
-        if not self.is_subscribed(value):
-            self._subscriptions.append(value)
+        if value in self._subscriptions:
+            return False
+        self._subscriptions.add(value)
+        if self._index is not None:
+            self._index.add(self._name, value)
+        return True
 
     def is_subscribed(self, value):
         return value in self._subscriptions
 
     def remove_subscription(self, value):
-        if self.is_subscribed(value):
-            self._subscriptions.remove(value)
+        if value not in self._subscriptions:
+            return False
+        self._subscriptions.remove(value)
+        if self._index is not None:
+            self._index.remove(self._name, value)
+        return True
+
+    def set_index(self, index):
+        # keep chat -> sensors side of subscriptions in the registry index
+        if self._index is not None:
+            self._index.drop_sensor(self._name)
+        self._index = index
+        if index is not None:
+            for chat_id in self._subscriptions:
+                index.add(self._name, chat_id)
+        pass
+
+    def load(self, topic, payload):
+        # set state without notification, e.g. from retained message
+        state, changed = self._decode(payload)
+        if changed is None:
+            changed = self._changed if state == self._state and self._changed else time.time()
+        self._version = Sensor.tick(not self.is_dummy)
+        self._state = state
+        self._changed = changed
+        pass
+
+    def restore(self, record):
+        self._version = Sensor.tick(not self.is_dummy)
+        self._state = record.get('state', self._state)
+        self._changed = record.get('changed', self._changed)
+        self._triggered = record.get('triggered', self._triggered)
+        if 'subscriptions' in record:
+            chats = set(record['subscriptions'])
+            for chat_id in self._subscriptions - chats:
+                self.remove_subscription(chat_id)
+            for chat_id in chats - self._subscriptions:
+                self.add_subscription(chat_id)
+        pass
 
     @classmethod
     def from_url(cls, url, subscriptions=None):
@@ -94,6 +262,15 @@ class Sensor(object):
         sensor_type = parsed.scheme
         name = parsed.username.strip('!')
         default_state = parsed.username.endswith('!')
+        options = parse_qs(parsed.query)
+        codec = options['codec'][0] if 'codec' in options else None
+        debounce = float(options['debounce'][0]) if 'debounce' in options else 0
+        return cls.create(
+            sensor_type, topic, name, subscriptions if not default_state else None, codec=codec, debounce=debounce
+        )
+
+    @classmethod
+    def create(cls, sensor_type, topic, name, subscriptions=None, codec=None, debounce=0):
         # default class
         target_cls = cls
 
@@ -103,45 +280,46 @@ class Sensor(object):
                 break
         return target_cls(
             topic=topic, sensor_type=sensor_type, name=name,
-            subscriptions=subscriptions if not default_state else None
+            subscriptions=subscriptions, codec=codec, debounce=debounce
         )
 
     def state_text(self):
         return self.__states__[int(not self.state)]
 
     def process(self, topic, payload):
-        self.state = json.loads(payload)
+        state, changed = self._decode(payload)
+        self.update(state, changed)
 
 
 class DoorSensor(Sensor):
     __names__ = ['door']
     __states__ = ['opened', 'closed']
+    __slots__ = ()
 
 
 class MotionSensor(Sensor):
     __names__ = ['motion']
     __states__ = ['active', 'passive']
+    __slots__ = ()
 
 
 class PresenceSensor(Sensor):
     __names__ = ['presence', 'wireless']
     __states__ = ['home', 'away']
+    __slots__ = ()
 
 
 class DeviceSensor(Sensor):
     __names__ = ['device']
     __states__ = ['on', 'off']
+    __slots__ = ()
 
 
 class DummySensor(Sensor):
     __names__ = ['notify']
-
-    def __init__(self, topic, sensor_type, name, subscriptions=None):
-        Sensor.__init__(self, topic, sensor_type, name, subscriptions)
-        self.is_dummy = True
-
-    def process(self, topic, payload):
-        self.state = payload
+    __slots__ = ()
+    __codec__ = 'raw'
+    is_dummy = True
 
     def state_text(self):
         return "n/a"
@@ -149,12 +327,92 @@ class DummySensor(Sensor):
 
 class CameraSensor(DummySensor):
     __names__ = ['camera']
+    __slots__ = ('event_type', 'one_time_sub', 'spool')
+    __spooled_events__ = ('video', 'videom')
 
-    def __init__(self, topic, sensor_type, name, subscriptions=None):
+    def __init__(self, topic, sensor_type, name, subscriptions=None, codec=None, debounce=0):
         self.event_type = None
+        self.one_time_sub = []
+        self.spool = None
         topic = topic + '/#'
-        DummySensor.__init__(self, topic, sensor_type, name, subscriptions)
+        DummySensor.__init__(self, topic, sensor_type, name, subscriptions, codec, debounce)
 
     def process(self, topic, payload):
         self.event_type = topic.split('/').pop()
-        self.state = payload
+        if self.spool is not None and self.event_type in self.__spooled_events__ and self.spool.should_spool(payload):
+            # large video is kept on disk, sensor holds only the file handle
+            payload = self.spool.store(payload)
+        DummySensor.process(self, topic, payload)
+
+
+class SensorRegistry(object):
+    def __init__(self, sensors=None):
+        self._sensors = []
+        self._by_name = {}
+        self._by_type = defaultdict(list)
+        self._topics = TopicTrie()
+        self.subscriptions = SubscriptionIndex()
+        for sensor in sensors or []:
+            self.add(sensor)
+
+    def __iter__(self):
+        return iter(self._sensors)
+
+    def __len__(self):
+        return len(self._sensors)
+
+    def __contains__(self, sensor):
+        return self._by_name.get(sensor.name) is sensor
+
+    def add(self, sensor):
+        if sensor.name in self._by_name:
+            raise ValueError("Sensor %s already registered" % sensor.name)
+        self._sensors.append(sensor)
+        self._by_name[sensor.name] = sensor
+        self._by_type[sensor.type].append(sensor)
+        self._topics.add(sensor.topic, sensor)
+        sensor.set_index(self.subscriptions)
+        Sensor.tick()
+        return sensor
+
+    def remove(self, sensor):
+        if sensor not in self:
+            return False
+        del self._by_name[sensor.name]
+        self._sensors.remove(sensor)
+        self._by_type[sensor.type].remove(sensor)
+        self._topics.remove(sensor.topic, sensor)
+        sensor.set_index(None)
+        Sensor.tick()
+        return True
+
+    @property
+    def version(self):
+        # grows on any change of state sensors or sensors set, the clock is shared
+        # by all sensors and registries, so it is not recomputed over sensors
+        return Sensor.state_clock
+
+    def get(self, name):
+        return self._by_name.get(name)
+
+    def by_type(self, sensor_type):
+        return list(self._by_type.get(sensor_type, []))
+
+    def match(self, topic):
+        return self._topics.match(topic)
+
+    def subscribed(self, chat_id):
+        return [self._by_name[name] for name in self.subscriptions.sensors(chat_id) if name in self._by_name]
+
+    def select(self, selector):
+        # sensors by type, by MQTT topic pattern or all of them with '*'
+        if selector == '*':
+            return list(self._sensors)
+        if selector in self._by_type:
+            return self.by_type(selector)
+        pattern = TopicTrie()
+        pattern.add(selector, True)
+        return [
+            sensor for sensor in self._sensors
+            if pattern.match(sensor.topic[:-2] if sensor.topic.endswith('/#') else sensor.topic)
+        ]
@@ -0,0 +1,195 @@
+import os
+import json
+import zlib
+import signal
+import socket
+import logging
+from collections import deque
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.iostream import IOStream, StreamClosedError
+from tornado.netutil import bind_unix_socket
+from tornado.tcpserver import TCPServer
+
+
+def shard_of(topic, count):
+    # stable across processes and restarts unlike hash()
+    return (zlib.crc32(topic) & 0xffffffff) % count
+
+
+def is_sharded(sensor):
+    # camera and notify payloads are not state, they are processed by coordinator
+    return not sensor.is_dummy
+
+
+class ShardForwarder(object):
+    # Sends sensor changes from ingestion worker to coordinator as JSON lines,
+    # changes are buffered while coordinator is not connected
+    def __init__(self, path, retry_delay=1.0, buffer_size=10000):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.retry_delay = retry_delay
+        self.pending = deque()
+        self.buffer_size = buffer_size
+        self.stream = None
+        self.sent = 0
+        self.dropped = 0
+        self._connecting = False
+
+    @staticmethod
+    def encode(sensor, retained=False):
+        return json.dumps({
+            'name': sensor.name, 'topic': sensor.topic, 'state': sensor.state, 'changed': sensor.changed,
+            'retained': retained
+        }, separators=(',', ':')) + '\n'
+
+    def forward(self, sensor, retained=False):
+        if len(self.pending) >= self.buffer_size:
+            # the oldest change is lost while coordinator is not available
+            self.pending.popleft()
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                self.logger.warn("Coordinator buffer is full (%d), %d changes dropped", len(self.pending), self.dropped)
+        self.pending.append(self.encode(sensor, retained))
+        self.flush()
+
+    def flush(self):
+        if self.stream is None or self.stream.closed():
+            self.connect()
+            return
+        while len(self.pending) > 0:
+            line = self.pending.popleft()
+            self.stream.write(line)
+            self.sent += 1
+        pass
+
+    @gen.coroutine
+    def connect(self):
+        if self._connecting:
+            return
+        self._connecting = True
+        try:
+            while True:
+                stream = IOStream(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM))
+                try:
+                    yield stream.connect(self.path)
+                    break
+                except (StreamClosedError, socket.error):
+                    self.logger.debug("Coordinator at %s is not available", self.path)
+                    yield gen.sleep(self.retry_delay)
+            self.stream = stream
+            self.logger.info("Connected to coordinator at %s", self.path)
+        finally:
+            self._connecting = False
+        self.flush()
+
+
+class ShardCoordinator(TCPServer):
+    # Receives sensor changes from ingestion workers over Unix socket
+    def __init__(self, path, on_change):
+        TCPServer.__init__(self)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.on_change = on_change
+        self.received = 0
+
+    def listen_unix(self):
+        self.add_socket(bind_unix_socket(self.path))
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        self.logger.info("Ingestion worker connected")
+        while True:
+            try:
+                line = yield stream.read_until('\n')
+            except StreamClosedError:
+                self.logger.warn("Ingestion worker disconnected")
+                break
+            try:
+                record = json.loads(line)
+                self.received += 1
+                self.on_change(record)
+            except Exception:
+                self.logger.exception("Error while processing record %r", line)
+        pass
+
+
+def watch_parent(on_exit, interval=1.0):
+    # worker stops when coordinator process is gone and worker is inherited by init
+    parent = os.getppid()
+
+    def check():
+        if os.getppid() != parent:
+            logging.getLogger('ShardWorker').warn("Coordinator process %d is gone", parent)
+            task.stop()
+            on_exit()
+    task = PeriodicCallback(check, interval*1000)
+    task.start()
+    return task
+
+
+class ShardSupervisor(object):
+    # Keeps ingestion worker processes running: exited workers are logged and started again,
+    # restart_delay None only logs. Workers are polled by pid, SIGCHLD handler belongs to
+    # tornado Subprocess used by shell commands
+    def __init__(self, spawn, count, restart_delay=5.0, interval=1.0, name='Ingestion worker'):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.name = name
+        self.spawn = spawn
+        self.count = count
+        self.restart_delay = restart_delay
+        self.interval = interval
+        self.workers = {}
+        self.restarts = 0
+        self.task = None
+        self.stopped = False
+
+    def start(self):
+        for index in xrange(self.count):
+            self.workers[self.spawn(index)] = index
+        pass
+
+    def watch(self):
+        self.task = PeriodicCallback(self.reap, self.interval*1000)
+        self.task.start()
+
+    def reap(self):
+        for pid, index in self.workers.items():
+            try:
+                exited, status = os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                exited, status = pid, -1
+            if exited == 0:
+                continue
+            del self.workers[pid]
+            if self.stopped:
+                continue
+            if self.restart_delay is None:
+                self.logger.error("%s %d (pid %d) exited with status %d", self.name, index, pid, status)
+                continue
+            self.logger.error(
+                "%s %d (pid %d) exited with status %d, restart in %.0fs",
+                self.name, index, pid, status, self.restart_delay
+            )
+            IOLoop.current().call_later(self.restart_delay, self.restart, index)
+        pass
+
+    def restart(self, index):
+        if self.stopped:
+            return
+        self.restarts += 1
+        pid = self.spawn(index)
+        self.workers[pid] = index
+        self.logger.info("%s %d restarted with pid %d", self.name, index, pid)
+
+    def stop(self):
+        self.stopped = True
+        if self.task is not None:
+            self.task.stop()
+            self.task = None
+        for pid in self.workers.keys():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        pass
@@ -0,0 +1,70 @@
+import time
+from collections import defaultdict, deque, OrderedDict
+
+
+class Frame(object):
+    __slots__ = ('id', 'camera', 'time', 'payload')
+
+    def __init__(self, frame_id, camera, timestamp, payload):
+        self.id = frame_id
+        self.camera = camera
+        self.time = timestamp
+        self.payload = payload
+
+    @property
+    def size(self):
+        return len(self.payload)
+
+
+class SnapshotBuffer(object):
+    # Ring buffer of recent camera frames per camera, total memory is capped,
+    # least recently used frames are evicted first across all cameras
+    def __init__(self, max_bytes=16*1024*1024, frames_per_camera=10):
+        self.max_bytes = max_bytes
+        self.frames_per_camera = frames_per_camera
+        self.size = 0
+        self._frames = defaultdict(deque)
+        self._lru = OrderedDict()
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._lru)
+
+    def add(self, camera, payload, timestamp=None):
+        if len(payload) > self.max_bytes:
+            return None
+        self._seq += 1
+        frame = Frame(self._seq, camera, timestamp or time.time(), payload)
+        frames = self._frames[camera]
+        frames.append(frame)
+        self._lru[frame.id] = frame
+        self.size += frame.size
+
+        while len(frames) > self.frames_per_camera:
+            self._drop(frames[0])
+        while self.size > self.max_bytes:
+            self._drop(next(self._lru.itervalues()))
+        return frame
+
+    def last(self, camera, count=1):
+        frames = self._frames.get(camera)
+        if not frames:
+            return []
+        result = list(frames)[-count:]
+        result.reverse()
+        for frame in result:
+            # mark as recently used
+            del self._lru[frame.id]
+            self._lru[frame.id] = frame
+        return result
+
+    def get(self, frame_id):
+        return self._lru.get(frame_id)
+
+    def _drop(self, frame):
+        frames = self._frames[frame.camera]
+        frames.remove(frame)
+        if len(frames) == 0:
+            del self._frames[frame.camera]
+        del self._lru[frame.id]
+        self.size -= frame.size
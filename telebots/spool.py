@@ -0,0 +1,77 @@
+import os
+import os.path
+import time
+import logging
+import tempfile
+from upload import UploadSource
+
+
+class SpooledPayload(UploadSource):
+    # Payload stored in spool file, the file is removed when the last reference is released
+    def __init__(self, path, size):
+        UploadSource.__init__(self, path=path)
+        self.created = time.time()
+        self.stored_size = size
+        self.refs = 1
+
+    @property
+    def size(self):
+        return self.stored_size
+
+    @property
+    def released(self):
+        return self.refs <= 0
+
+    def __len__(self):
+        return self.stored_size
+
+    def acquire(self):
+        self.refs += 1
+        return self
+
+    def release(self):
+        self.refs -= 1
+        if self.refs == 0:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        pass
+
+
+class PayloadSpool(object):
+    def __init__(self, path=None, threshold=512*1024):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.threshold = threshold
+        # stable default directory, so files left after crash are found by cleanup on next start
+        self._path = path if path is not None else os.path.join(tempfile.gettempdir(), 'homebot-spool')
+        self._seq = 0
+
+    @property
+    def path(self):
+        if not os.path.isdir(self._path):
+            os.makedirs(self._path)
+        return self._path
+
+    def should_spool(self, payload):
+        return len(payload) >= self.threshold
+
+    def store(self, payload):
+        self._seq += 1
+        path = os.path.join(self.path, '%d-%d.bin' % (os.getpid(), self._seq))
+        with open(path, 'wb') as f:
+            f.write(payload)
+        self.logger.debug("Spooled %d bytes to %s", len(payload), path)
+        return SpooledPayload(path, len(payload))
+
+    def cleanup(self):
+        # remove files left after previous run
+        if not os.path.isdir(self._path):
+            return
+        for name in os.listdir(self._path):
+            if name.endswith('.bin'):
+                try:
+                    os.remove(os.path.join(self._path, name))
+                except OSError:
+                    pass
+        pass
@@ -0,0 +1,39 @@
+from collections import defaultdict
+
+
+class SubscriptionIndex(object):
+    # Two-way subscription index: sensor name -> chats and chat -> sensor names
+    def __init__(self):
+        self._chats = defaultdict(set)
+        self._sensors = defaultdict(set)
+
+    def add(self, sensor_name, chat_id):
+        self._chats[sensor_name].add(chat_id)
+        self._sensors[chat_id].add(sensor_name)
+
+    def remove(self, sensor_name, chat_id):
+        chats = self._chats.get(sensor_name)
+        if chats is not None:
+            chats.discard(chat_id)
+            if len(chats) == 0:
+                del self._chats[sensor_name]
+        sensors = self._sensors.get(chat_id)
+        if sensors is not None:
+            sensors.discard(sensor_name)
+            if len(sensors) == 0:
+                del self._sensors[chat_id]
+        pass
+
+    def drop_sensor(self, sensor_name):
+        for chat_id in list(self._chats.get(sensor_name, [])):
+            self.remove(sensor_name, chat_id)
+        pass
+
+    def chats(self, sensor_name):
+        return frozenset(self._chats.get(sensor_name, ()))
+
+    def sensors(self, chat_id):
+        return frozenset(self._sensors.get(chat_id, ()))
+
+    def is_subscribed(self, sensor_name, chat_id):
+        return sensor_name in self._sensors.get(chat_id, ())
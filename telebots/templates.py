@@ -0,0 +1,156 @@
+import re
+import time
+import logging
+from string import Formatter
+from urlparse import urlparse, parse_qs
+from collections import OrderedDict
+from topics import TopicTrie
+from sensors import Sensor
+
+
+class SensorTemplate(object):
+    # Sensor URL with wildcard topic, name refers to topic wildcards: presence://{1}@home/wireless/+
+    def __init__(self, url, subscriptions=None):
+        parsed = urlparse(url)
+        self.url = url
+        self.type = parsed.scheme
+        self.topic = parsed.hostname + parsed.path
+        self.name_format = parsed.username.strip('!')
+        self.subscriptions = subscriptions if not parsed.username.endswith('!') else None
+        options = parse_qs(parsed.query)
+        self.codec = options['codec'][0] if 'codec' in options else None
+        self.debounce = float(options['debounce'][0]) if 'debounce' in options else 0
+        self.levels = self.topic.split('/')
+        if self.type == 'camera':
+            raise ValueError("Camera sensors can't be defined by template")
+        if '+' not in self.levels and '#' not in self.levels:
+            raise ValueError("Template topic %s has no wildcards" % self.topic)
+
+    @staticmethod
+    def is_template(url):
+        return '{' in url.split('://', 1)[-1].split('@', 1)[0]
+
+    def name(self, topic):
+        # {0} is whole topic, {1}, {2}... are wildcard levels
+        levels = topic.split('/')
+        values = []
+        for idx, level in enumerate(self.levels):
+            if level == '+':
+                values.append(levels[idx])
+            elif level == '#':
+                values.append('/'.join(levels[idx:]))
+                break
+        return self.name_format.format(topic, *values)
+
+    def may_create(self, name):
+        # whether sensor with this name may be created from some topic
+        pattern = ''.join(
+            re.escape(literal) + ('.+' if field is not None else '')
+            for literal, field, _, _ in Formatter().parse(self.name_format)
+        )
+        return re.match(pattern + '$', name) is not None
+
+    def create(self, topic):
+        return Sensor.create(
+            self.type, topic, self.name(topic), self.subscriptions, codec=self.codec, debounce=self.debounce
+        )
+
+
+class SensorTemplates(object):
+    # Sensors are created on the first message from matching topic,
+    # sensors without messages during idle time are removed
+    def __init__(self, registry, limit=None, idle=None, on_created=None, on_evicted=None, accept=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.registry = registry
+        # accept(topic) selects topics which sensors are created for, e.g. by ingestion worker
+        self.accept = accept
+        self.limit = limit
+        self.idle = idle
+        self.on_created = on_created
+        self.on_evicted = on_evicted
+        self.templates = []
+        self._topics = TopicTrie()
+        # materialized sensor name -> last message time, least recently seen first
+        self._seen = OrderedDict()
+        self._origin = {}
+
+    def __len__(self):
+        return len(self._seen)
+
+    def __contains__(self, name):
+        return name in self._seen
+
+    @property
+    def topics(self):
+        return [template.topic for template in self.templates]
+
+    def add(self, template):
+        self.templates.append(template)
+        self._topics.add(template.topic, template)
+        return template
+
+    def remove(self, url):
+        # remove template and all sensors created from it
+        removed = []
+        for template in [x for x in self.templates if x.url == url]:
+            self.templates.remove(template)
+            self._topics.remove(template.topic, template)
+            for name in [name for name, origin in self._origin.iteritems() if origin is template]:
+                sensor = self.drop(name)
+                if sensor is not None:
+                    removed.append(sensor)
+        return removed
+
+    def drop(self, name):
+        self._seen.pop(name, None)
+        self._origin.pop(name, None)
+        sensor = self.registry.get(name)
+        if sensor is None:
+            return None
+        self.registry.remove(sensor)
+        if self.on_evicted is not None:
+            self.on_evicted(sensor)
+        return sensor
+
+    def materialize(self, topic, now=None):
+        now = now or time.time()
+        created = []
+        if self.accept is not None and not self.accept(topic):
+            return created
+        for template in self._topics.match(topic):
+            name = template.name(topic)
+            if name in self._seen:
+                del self._seen[name]
+                self._seen[name] = now
+                continue
+            if self.registry.get(name) is not None:
+                # statically configured sensor
+                continue
+            if self.limit is not None and len(self._seen) >= self.limit:
+                self.logger.warn("Sensors limit %d reached, %s is not created", self.limit, name)
+                continue
+
+            sensor = self.registry.add(template.create(topic))
+            self._seen[name] = now
+            self._origin[name] = template
+            created.append(sensor)
+            self.logger.info("Sensor %s created for topic %s", name, topic)
+            if self.on_created is not None:
+                self.on_created(sensor)
+        self.evict(now)
+        return created
+
+    def evict(self, now=None):
+        if self.idle is None:
+            return []
+        now = now or time.time()
+        evicted = []
+        while len(self._seen) > 0:
+            name, seen = next(self._seen.iteritems())
+            if now - seen < self.idle:
+                break
+            self.logger.info("Sensor %s removed after %.0fs without messages", name, now - seen)
+            sensor = self.drop(name)
+            if sensor is not None:
+                evicted.append(sensor)
+        return evicted
@@ -0,0 +1,125 @@
+class TopicNode(object):
+    __slots__ = ('children', 'values')
+
+    def __init__(self):
+        self.children = {}
+        self.values = []
+
+
+# Subscription trie for MQTT topic filters with '+' and '#' wildcards,
+# lookup cost depends on topic depth and not on the number of filters
+class TopicTrie(object):
+
+    def __init__(self):
+        self._root = TopicNode()
+        self._seq = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, pattern, value):
+        node = self._root
+        for level in pattern.split('/'):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = TopicNode()
+            node = child
+        self._seq += 1
+        self._size += 1
+        node.values.append((self._seq, value))
+        return value
+
+    def remove(self, pattern, value):
+        path = [self._root]
+        levels = pattern.split('/')
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return False
+            path.append(node)
+
+        node = path[-1]
+        for item in node.values:
+            if item[1] == value:
+                node.values.remove(item)
+                self._size -= 1
+                break
+        else:
+            return False
+
+        # drop empty branches
+        for level, parent, child in reversed(zip(levels, path[:-1], path[1:])):
+            if child.values or child.children:
+                break
+            del parent.children[level]
+        return True
+
+    def match(self, topic):
+        levels = topic.split('/')
+        found = []
+        nodes = [self._root]
+        for idx, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                # topics starting with '$' are not matched by wildcards on first level
+                if idx > 0 or not level.startswith('$'):
+                    child = node.children.get('#')
+                    if child is not None:
+                        found.extend(child.values)
+                    child = node.children.get('+')
+                    if child is not None:
+                        next_nodes.append(child)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+            nodes = next_nodes
+            if not nodes:
+                break
+        else:
+            for node in nodes:
+                found.extend(node.values)
+                # "a/#" also matches the parent level "a"
+                child = node.children.get('#')
+                if child is not None:
+                    found.extend(child.values)
+
+        if len(found) > 1:
+            found.sort(key=lambda item: item[0])
+        return [value for _, value in found]
+
+
+def is_wildcard(pattern):
+    return '+' in pattern or '#' in pattern
+
+
+def consolidate(topics, min_siblings=8):
+    # Replaces min_siblings or more concrete topics of the same parent with "parent/+",
+    # concrete topics already matched by other wildcard filters are dropped
+    filters = set(x for x in topics if is_wildcard(x))
+    siblings = {}
+    for topic in topics:
+        if is_wildcard(topic):
+            continue
+        parent, sep, _ = topic.rpartition('/')
+        siblings.setdefault((parent, sep), []).append(topic)
+
+    for (parent, sep), children in siblings.iteritems():
+        if sep and parent and len(children) >= min_siblings:
+            filters.add(parent + '/+')
+        else:
+            filters.update(children)
+
+    wildcards = TopicTrie()
+    for pattern in filters:
+        if is_wildcard(pattern):
+            wildcards.add(pattern, pattern)
+    return set(x for x in filters if is_wildcard(x) or not wildcards.match(x))
+
+
+def batches(topics, size=100):
+    # topics are grouped to be sent in multi-topic SUBSCRIBE/UNSUBSCRIBE packets
+    topics = sorted(topics)
+    for start in xrange(0, len(topics), size):
+        yield topics[start:start+size]
+    pass
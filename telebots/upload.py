@@ -0,0 +1,157 @@
+import os
+import os.path
+import json
+import time
+import uuid
+import hashlib
+import logging
+from cStringIO import StringIO
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+
+class UploadSource(object):
+    # Media payload held in memory or stored in file, read by chunks
+    def __init__(self, data=None, path=None):
+        if (data is None) == (path is None):
+            raise ValueError("Either data or path must be specified")
+        self.data = data
+        self.path = path
+
+    @property
+    def size(self):
+        if self.path is not None:
+            return os.path.getsize(self.path)
+        return len(self.data)
+
+    def chunks(self, chunk_size):
+        if self.path is not None:
+            with open(self.path, 'rb') as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        else:
+            view = memoryview(self.data)
+            for offset in xrange(0, len(view), chunk_size):
+                yield view[offset:offset+chunk_size]
+        pass
+
+    def digest(self, chunk_size=64*1024):
+        digest = hashlib.sha1()
+        for chunk in self.chunks(chunk_size):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def open(self):
+        if self.path is not None:
+            return open(self.path, 'rb')
+        return StringIO(self.data)
+
+
+class MultipartProducer(object):
+    # tornado body_producer which streams multipart/form-data request body
+    def __init__(self, fields, files, chunk_size=64*1024):
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.parts = []
+        for name, value in fields.iteritems():
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            header = '--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n' % (self.boundary, name)
+            self.parts.append((header, str(value)))
+        for name, filename, mime_type, source in files:
+            header = '--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n' \
+                     'Content-Type: %s\r\n\r\n' % (self.boundary, name, filename, mime_type)
+            self.parts.append((header, source))
+        self.footer = '--%s--\r\n' % self.boundary
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    @property
+    def content_length(self):
+        length = len(self.footer)
+        for header, body in self.parts:
+            length += len(header) + 2
+            length += body.size if isinstance(body, UploadSource) else len(body)
+        return length
+
+    @gen.coroutine
+    def __call__(self, write):
+        for header, body in self.parts:
+            yield write(header)
+            if isinstance(body, UploadSource):
+                for chunk in body.chunks(self.chunk_size):
+                    yield write(chunk)
+            else:
+                yield write(body)
+            yield write('\r\n')
+        yield write(self.footer)
+
+
+class MediaUploader(object):
+    # Sends media to Telegram Bot API with the request body streamed from source
+    api_methods = {
+        'photo': 'sendPhoto',
+        'video': 'sendVideo',
+        'document': 'sendDocument'
+    }
+
+    def __init__(self, token, chunk_size=64*1024, timeout=300, client=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.api_url = 'https://api.telegram.org/bot%s/' % token
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.client = client or AsyncHTTPClient()
+        self.uploaded_bytes = 0
+        self.upload_time = 0.0
+
+    @property
+    def throughput(self):
+        return self.uploaded_bytes / self.upload_time if self.upload_time > 0 else 0.0
+
+    @gen.coroutine
+    def send_media(self, chat_id, media_type, source, filename, mime_type, caption=None, reply_markup=None,
+                   **params):
+        fields = dict(params, chat_id=chat_id)
+        if caption is not None:
+            fields['caption'] = caption
+        if reply_markup is not None:
+            fields['reply_markup'] = json.dumps(reply_markup)
+
+        response = yield self.post(
+            self.api_methods[media_type], fields, [(media_type, filename, mime_type, source)], chat_id
+        )
+        raise gen.Return(response)
+
+    @gen.coroutine
+    def send_media_group(self, chat_id, media, files, **params):
+        # media items refer to uploaded files as attach://<name>
+        fields = dict(params, chat_id=chat_id, media=json.dumps(media))
+        response = yield self.post('sendMediaGroup', fields, files, chat_id)
+        raise gen.Return(response)
+
+    @gen.coroutine
+    def post(self, method, fields, files, chat_id):
+        producer = MultipartProducer(fields, files, self.chunk_size)
+        length = producer.content_length
+        request = HTTPRequest(
+            self.api_url + method, method='POST',
+            headers={'Content-Type': producer.content_type, 'Content-Length': str(length)},
+            body_producer=producer, request_timeout=self.timeout
+        )
+
+        started = time.time()
+        response = yield self.client.fetch(request, raise_error=False)
+        elapsed = time.time() - started
+        self.uploaded_bytes += length
+        self.upload_time += elapsed
+        self.logger.info(
+            "%s to %s: %d bytes in %.2fs (%.1f KB/s), HTTP %d",
+            method, chat_id, length, elapsed, length / max(elapsed, 0.001) / 1024, response.code
+        )
+        response.rethrow()
+        raise gen.Return(response)
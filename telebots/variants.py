@@ -0,0 +1,71 @@
+import hashlib
+import logging
+import cachetools
+from cStringIO import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.concurrent import Future
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def resize_jpeg(payload, max_side, quality=80):
+    image = Image.open(StringIO(payload))
+    if max(image.size) <= max_side:
+        return payload
+    image.thumbnail((max_side, max_side), Image.ANTIALIAS)
+    output = StringIO()
+    image.convert('RGB').save(output, 'JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+
+class PhotoVariants(object):
+    # Downscaled photo variants are built once per content in worker threads and cached,
+    # without PIL all variants are the original photo
+    original = 'original'
+
+    def __init__(self, sizes=None, workers=2, cache_size=64, quality=80, resize=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.sizes = sizes if sizes is not None else {'thumb': 320, 'phone': 1280}
+        self.quality = quality
+        self.resize = resize or (resize_jpeg if Image is not None else None)
+        self.executor = ThreadPoolExecutor(workers) if self.resize is not None else None
+        self.cache = cachetools.LRUCache(maxsize=cache_size)
+        self._building = {}
+
+    @property
+    def available(self):
+        return self.resize is not None
+
+    @property
+    def names(self):
+        return sorted(self.sizes.keys()) + [self.original]
+
+    @gen.coroutine
+    def get(self, payload, variant):
+        if self.resize is None or variant not in self.sizes:
+            raise gen.Return(payload)
+
+        key = (hashlib.sha1(payload).hexdigest(), variant)
+        result = self.cache.get(key)
+        if result is not None:
+            raise gen.Return(result)
+        if key in self._building:
+            # same variant is building right now
+            result = yield self._building[key]
+            raise gen.Return(result)
+
+        building = self._building[key] = Future()
+        try:
+            result = yield self.executor.submit(self.resize, payload, self.sizes[variant], self.quality)
+            self.logger.debug("Photo %s variant %s: %d -> %d bytes", key[0], variant, len(payload), len(result))
+        except Exception:
+            self.logger.exception("Error while building %s photo variant", variant)
+            result = payload
+        finally:
+            del self._building[key]
+        self.cache[key] = result
+        building.set_result(result)
+        raise gen.Return(result)
@@ -0,0 +1,43 @@
+import os
+import logging
+from tornado.ioloop import PeriodicCallback
+
+
+class FileWatcher(object):
+    # Calls on_change when file modification time or size is changed
+    def __init__(self, path, on_change, interval=5):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.task = None
+        self._stat = self.stat()
+
+    def stat(self):
+        try:
+            info = os.stat(self.path)
+        except OSError:
+            return None
+        return info.st_mtime, info.st_size
+
+    def check(self):
+        current = self.stat()
+        if current is None or current == self._stat:
+            return False
+        self._stat = current
+        self.logger.info("File %s is changed", self.path)
+        try:
+            self.on_change(self.path)
+        except Exception:
+            self.logger.exception("Error while reloading %s", self.path)
+        return True
+
+    def start(self):
+        self.task = PeriodicCallback(self.check, self.interval*1000)
+        self.task.start()
+
+    def stop(self):
+        if self.task is not None:
+            self.task.stop()
+            self.task = None
+        pass
@@ -25,8 +25,23 @@ class DummyBot(Bot):
 
 
 class DummyMqttClient(object):
-    def subscribe(self, topic):
-        pass
+    def __init__(self):
+        self.topics = set()
+        self.packets = 0
+
+    def subscribe(self, topic, qos=0):
+        self.packets += 1
+        if isinstance(topic, list):
+            self.topics.update(x[0] for x in topic)
+        else:
+            self.topics.add(topic)
+
+    def unsubscribe(self, topic):
+        self.packets += 1
+        if isinstance(topic, list):
+            self.topics.difference_update(topic)
+        else:
+            self.topics.discard(topic)
 
 
 class DummyMqttMessage(object):
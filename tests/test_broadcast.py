@@ -0,0 +1,64 @@
+from telebots.broadcast import Broadcaster
+from tornado import gen
+from tornado.httpclient import HTTPError
+from tornado.ioloop import IOLoop
+import pytest
+
+
+@pytest.fixture(name="broadcaster")
+def make_broadcaster():
+    yield Broadcaster(max_concurrent=2, retries=2, retry_delay=0.01)
+
+
+class TestBroadcaster(object):
+    def test_send(self, broadcaster):
+        sent = []
+
+        @gen.coroutine
+        def send(chat_id):
+            sent.append(chat_id)
+            raise gen.Return(chat_id * 10)
+
+        result = IOLoop.current().run_sync(lambda: broadcaster.send([1, 2, 3], send))
+        assert sent == [1, 2, 3]
+        assert result.responses == [10, 20, 30]
+        assert result.failed == []
+        assert broadcaster.sent == 3
+
+    def test_bounded(self, broadcaster):
+        state = {'running': 0, 'max': 0}
+
+        @gen.coroutine
+        def send(chat_id):
+            state['running'] += 1
+            state['max'] = max(state['max'], state['running'])
+            yield gen.sleep(0.01 if chat_id != 1 else 0.1)
+            state['running'] -= 1
+            raise gen.Return(chat_id)
+
+        result = IOLoop.current().run_sync(lambda: broadcaster.send(range(1, 7), send))
+        assert state['max'] == 2
+        assert result.responses == range(1, 7)
+        # slow chat delays only itself
+        deliveries = list(result)
+        assert deliveries[0].latency > max(x.latency for x in deliveries[1:])
+
+    def test_retry(self, broadcaster):
+        attempts = []
+
+        @gen.coroutine
+        def send(chat_id):
+            attempts.append(chat_id)
+            if chat_id == 1 and attempts.count(1) < 3:
+                raise HTTPError(429)
+            if chat_id == 2:
+                raise HTTPError(403)
+            raise gen.Return('ok')
+
+        result = IOLoop.current().run_sync(lambda: broadcaster.send([1, 2], send))
+        assert attempts.count(1) == 3
+        assert attempts.count(2) == 1
+        assert result.responses == ['ok', None]
+        assert [x.chat_id for x in result.failed] == [2]
+        assert result.failed[0].error.code == 403
+        assert broadcaster.failed == 1
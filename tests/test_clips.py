@@ -0,0 +1,36 @@
+from telebots.clips import ClipIndex
+import pytest
+import os
+
+
+@pytest.fixture(name="index")
+def make_index(tmpdir):
+    for name in ["20190101_101500.mp4", "20190101_103000.mp4", "20190101_230000.mp4",
+                 "20190102_080000.mp4", "20190102_080000.jpg", "lastsnap.mp4"]:
+        tmpdir.join(name).write("")
+    yield ClipIndex(str(tmpdir))
+
+
+class TestClipIndex(object):
+    def test_grouping(self, index):
+        assert len(index) == 4
+        assert index.days() == ["20190102", "20190101"]
+        assert index.hours("20190101") == ["23", "10"]
+        assert index.clips("20190101", "10") == ["20190101_103000.mp4", "20190101_101500.mp4"]
+        assert index.clips("20190103", "10") == []
+        assert "lastsnap.mp4" not in index
+
+    def test_rescan(self, index):
+        assert index.refresh()
+        assert not index.refresh()
+        os.remove(index.filename("20190102_080000.mp4"))
+        open(index.filename("20190103_120000.mp4"), "w").close()
+        os.utime(index.path, (0, os.stat(index.path).st_mtime + 1))
+
+        assert index.days() == ["20190103", "20190101"]
+        assert "20190102_080000.mp4" not in index
+        assert "20190103_120000.mp4" in index
+
+    def test_missing_dir(self, tmpdir):
+        index = ClipIndex(str(tmpdir.join("missing")))
+        assert index.days() == []
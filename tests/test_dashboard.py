@@ -0,0 +1,116 @@
+from telebots.sensors import Sensor, SensorRegistry
+from telebots.dashboard import SensorSnapshot, SensorStateHandler
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncHTTPTestCase, gen_test
+import tornado.web
+import pytest
+import json
+import time
+
+
+@pytest.fixture(name="snapshot")
+def make_snapshot():
+    yield SensorSnapshot(SensorRegistry(
+        Sensor.from_url(url, [1]) for url in [
+            "door://door_1@home/sensor/door1",
+            "camera://cam@home/camera/cam"
+        ]
+    ))
+
+
+class TestSensorSnapshot(object):
+    def test_snapshot(self, snapshot):
+        etag, body = snapshot.snapshot()
+        data = json.loads(body)
+        assert [x['name'] for x in data['sensors']] == ['door_1']
+        assert data['sensors'][0]['state'] == 'closed'
+
+        assert snapshot.snapshot() == (etag, body)
+        snapshot.sensors.get('door_1').state = 1
+        changed, body = snapshot.snapshot()
+        assert changed != etag
+        assert json.loads(body)['sensors'][0]['state'] == 'opened'
+
+    def test_registry_version(self, snapshot):
+        etag, _ = snapshot.snapshot()
+        snapshot.sensors.remove(snapshot.sensors.get('door_1'))
+        assert snapshot.etag() != etag
+        assert json.loads(snapshot.snapshot()[1])['sensors'] == []
+
+    def test_unchanged_version(self, snapshot):
+        etag, body = snapshot.snapshot()
+        # reading state does not move version
+        assert [x.state for x in snapshot.sensors]
+        assert snapshot.snapshot() == (etag, body)
+
+    def test_dummy_events(self):
+        camera = Sensor.from_url("camera://cam@home/camera/cam")
+        snapshot = SensorSnapshot(SensorRegistry([Sensor.from_url("door://door_1@home/sensor/door1"), camera]))
+        etag, _ = snapshot.snapshot()
+        # camera is not in snapshot, its events do not change etag
+        camera.process("home/camera/cam/photo", 'jpeg')
+        assert camera.version > 0
+        assert snapshot.etag() == etag
+
+    def test_wait(self, snapshot):
+        etag, _ = snapshot.snapshot()
+
+        @gen.coroutine
+        def change():
+            yield gen.sleep(0.05)
+            snapshot.sensors.get('door_1').state = 1
+            snapshot.notify()
+
+        @gen.coroutine
+        def scenario():
+            started = time.time()
+            yield [snapshot.wait(etag, 1), change()]
+            assert time.time() - started < 0.5
+            started = time.time()
+            yield snapshot.wait(snapshot.etag(), 0.1)
+            assert time.time() - started >= 0.1
+
+        IOLoop.current().run_sync(scenario)
+
+
+class TestSensorStateHandler(AsyncHTTPTestCase):
+    def get_app(self):
+        self.snapshot = SensorSnapshot(SensorRegistry([Sensor.from_url("door://door_1@home/sensor/door1")]))
+        return tornado.web.Application([(r'/sensors', SensorStateHandler, {'snapshot': self.snapshot})])
+
+    def test_etag(self):
+        response = self.fetch('/sensors')
+        assert response.code == 200
+        assert json.loads(response.body)['sensors'][0]['name'] == 'door_1'
+        etag = response.headers['Etag']
+
+        response = self.fetch('/sensors', headers={'If-None-Match': etag})
+        assert response.code == 304
+
+        self.snapshot.sensors.get('door_1').state = 1
+        response = self.fetch('/sensors', headers={'If-None-Match': etag})
+        assert response.code == 200
+        assert response.headers['Etag'] != etag
+
+    def test_bad_wait(self):
+        response = self.fetch('/sensors?wait=abc')
+        assert response.code == 400
+
+    @gen_test
+    def test_long_poll(self):
+        response = yield self.http_client.fetch(self.get_url('/sensors'))
+        etag = response.headers['Etag']
+
+        @gen.coroutine
+        def change():
+            yield gen.sleep(0.05)
+            self.snapshot.sensors.get('door_1').state = 1
+            self.snapshot.notify()
+
+        response, _ = yield [
+            self.http_client.fetch(self.get_url('/sensors?wait=5'), headers={'If-None-Match': etag}),
+            change()
+        ]
+        assert response.code == 200
+        assert json.loads(response.body)['sensors'][0]['state'] == 'opened'
@@ -0,0 +1,52 @@
+from telebots.digest import NotificationDigest
+from tornado import gen
+from tornado.ioloop import IOLoop
+import pytest
+
+
+@pytest.fixture(name="sent")
+def make_sent():
+    yield []
+
+
+class TestNotificationDigest(object):
+    def test_immediate(self, sent):
+        digest = NotificationDigest(lambda chat_id, lines: sent.append((chat_id, lines)))
+        digest.add(1, "a")
+        digest.add(1, "b")
+        assert sent == [(1, ["a"]), (1, ["b"])]
+
+    def test_window(self, sent):
+        digest = NotificationDigest(lambda chat_id, lines: sent.append((chat_id, lines)), window=0.1)
+
+        @gen.coroutine
+        def scenario():
+            digest.add(1, "a")
+            digest.add(2, "a")
+            digest.add(1, "b")
+            assert sent == []
+            yield gen.sleep(0.2)
+
+        IOLoop.current().run_sync(scenario)
+        assert sorted(sent) == [(1, ["a", "b"]), (2, ["a"])]
+        assert digest.pending == {}
+
+    def test_urgent(self, sent):
+        digest = NotificationDigest(lambda chat_id, lines: sent.append((chat_id, lines)), window=10)
+        digest.add(1, "a")
+        digest.add(1, "alarm", urgent=True)
+        assert sent == [(1, ["a"]), (1, ["alarm"])]
+        assert digest.pending == {}
+
+    def test_add_many(self, sent):
+        broadcasts = []
+        digest = NotificationDigest(
+            lambda chat_id, lines: sent.append((chat_id, lines)), window=10,
+            broadcast=lambda chat_ids, lines: broadcasts.append((chat_ids, lines))
+        )
+        digest.add_many([1, 2], "a")
+        assert sent == [] and broadcasts == []
+
+        digest.add_many([1, 2, 3], "alarm", urgent=True)
+        assert sorted(sent) == [(1, ["a"]), (2, ["a"])]
+        assert broadcasts == [([1, 2, 3], ["alarm"])]
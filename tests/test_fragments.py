@@ -0,0 +1,48 @@
+from telebots.sensors import Sensor
+from telebots.fragments import FragmentCache, time_bucket
+import pytest
+
+
+@pytest.fixture(name="rendered")
+def make_rendered():
+    yield []
+
+
+class TestFragmentCache(object):
+    def test_time_bucket(self):
+        assert time_bucket(1000, None) == 0
+        assert time_bucket(1005, 1000) == time_bucket(1009, 1000)
+        assert time_bucket(1005, 1000) != time_bucket(1011, 1000)
+        # hours old timestamp is refreshed every 10 minutes
+        assert time_bucket(7201, 1) == time_bucket(7799, 1)
+        assert time_bucket(7201, 1) != time_bucket(7800, 1)
+        # the most recent timestamp defines the step
+        assert time_bucket(7205, 1, 7200) != time_bucket(7215, 1, 7200)
+
+    def test_invalidate(self, rendered):
+        def render(sensor):
+            rendered.append(sensor.name)
+            return '%s: %s' % (sensor.name, sensor.state)
+
+        cache = FragmentCache(render)
+        sensor = Sensor.from_url("door://door@home/sensor/door")
+        sensor.update(0, 1000.0)
+
+        assert cache.get(sensor, 1001) == 'door: 0'
+        assert cache.get(sensor, 1002) == 'door: 0'
+        assert rendered == ['door']
+
+        sensor.update(1, 1003.0)
+        assert cache.get(sensor, 1004) == 'door: 1'
+        sensor.triggered = 1004
+        cache.get(sensor, 1005)
+        assert cache.get(sensor, 1030) == 'door: 1'
+        assert rendered == ['door', 'door', 'door', 'door']
+        assert (cache.hits, cache.misses) == (1, 4)
+
+    def test_replaced_sensor(self, rendered):
+        cache = FragmentCache(lambda sensor: rendered.append(sensor) or sensor.type)
+        assert cache.get(Sensor.from_url("door://s@home/s"), 100) == 'door'
+        assert cache.get(Sensor.from_url("motion://s@home/s"), 100) == 'motion'
+        cache.discard('s')
+        assert len(cache) == 0
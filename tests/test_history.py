@@ -0,0 +1,58 @@
+from telebots.history import SensorHistory
+import pytest
+import time
+
+
+@pytest.fixture(name="history")
+def make_history(tmpdir):
+    history = SensorHistory(str(tmpdir.join('state', 'history.db')), flush_interval=10, batch_size=100)
+    yield history
+    history.close()
+
+
+class TestSensorHistory(object):
+    def test_batch(self, history):
+        now = time.time()
+        history.add('door', 1, now)
+        history.add('door', 0, now + 1)
+        assert history.events('door', 0) == []
+        assert history.flush() == 2
+        assert history.events('door', 0) == [(now, 1), (now + 1, 0)]
+        assert history.flush() == 0
+
+    def test_batch_size(self, history):
+        now = time.time()
+        for idx in xrange(100):
+            history.add('door', idx % 2, now + idx)
+        assert history.pending == []
+        assert len(history.events('door', 0)) == 100
+
+    def test_buckets(self, history):
+        start = (int(time.time()) // 86400 - 3) * 86400 + 12*3600
+        for idx in xrange(10):
+            history.add('door', idx % 2, start + idx*60, triggered=idx % 2)
+            history.add('door', idx % 2, start + 3600 + idx*60, triggered=idx % 2)
+        history.add('motion', 1, start, triggered=True)
+        # state changes within trigger gap are not triggers
+        history.add('motion', 1, start + 1)
+        history.flush()
+        # counters are accumulated across batches
+        history.add('door', 1, start + 1, triggered=True)
+        history.flush()
+
+        assert history.hourly('door', start) == [(start, 11, 6), (start + 3600, 10, 5)]
+        daily = history.daily('door', start - 86400)
+        assert len(daily) == 1 and daily[0][1:] == (21, 11)
+        assert history.hourly('motion', start) == [(start, 2, 1)]
+
+    def test_expire(self, history):
+        now = time.time()
+        history.add('door', 1, now - 40*86400)
+        history.add('door', 1, now - 400*86400)
+        history.add('door', 1, now)
+        history.flush()
+        history.expire(now)
+
+        assert [x[0] for x in history.events('door', 0)] == [now]
+        assert len(history.hourly('door', 0)) == 2
+        assert len(history.daily('door', 0)) == 3
@@ -1,15 +1,20 @@
 from dummy_objects import DummyBot, DummyMqttClient, DummyMqttMessage
 import telebots
-from telebots.homebot import HomeBotHandler
+from telebots.homebot import HomeBotHandler, HomeBotShard, build_parser, watch_config
+from telebots.shards import shard_of
+from telebots import variants
 import pytelegram_async.entity
 import pytest
 import urlparse
 import uuid
 import random
+import os
+from tornado import gen
+from tornado.ioloop import IOLoop
 
 
 @pytest.fixture
-def handler():
+def handler(tmpdir):
     bot = DummyBot()
     dummy_mqtt = DummyMqttClient()
 
@@ -26,7 +31,8 @@ def handler():
         ],
         extra_cmds={
             '/photo': 'cmd /C dir'
-        }
+        },
+        spool_path=str(tmpdir.join('spool'))
     )
     handler.on_mqtt_connect(dummy_mqtt, None, None, 0)
     bot.add_handler(handler)
@@ -128,7 +134,8 @@ class TestHomeBot(object):
                      "text": "/sensor %s 1" % test_sensor.name}
         )
         assert len(handler.bot.messages) == 1
-        assert test_sensor.subscriptions.pop() == chat_id
+        assert test_sensor.is_subscribed(chat_id)
+        assert test_sensor in handler.sensors.subscribed(chat_id)
 
     def test_status(self, handler):
         chat_id = random.randint(1, 100000)
@@ -259,3 +266,424 @@ class TestHomeBot(object):
         message.payload = '1'
         handler.on_mqtt_message(None, None, message)
         assert len(handler.bot.messages) == 0
+
+    def test_state_restore(self, tmpdir):
+        bot = DummyBot()
+        urls = ["door://sensor_1@home/sensor/test", "door://sensor_2!@home/sensor/test2"]
+        handler = HomeBotHandler(
+            ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), admins=bot.admins,
+            sensors=urls, state_path=str(tmpdir)
+        )
+        bot.add_handler(handler)
+        chat_id = random.randint(1, 100000)
+
+        message = DummyMqttMessage()
+        message.retain = False
+        message.topic = 'home/sensor/test'
+        message.payload = '1'
+        handler.on_mqtt_message(None, None, message)
+        assert handler.bot.exec_command(
+            message={"from": {"id": handler.bot.admin}, "chat": {"id": chat_id}, "text": "/sensor sensor_2 1"}
+        )
+        handler.journal.close()
+
+        restored = HomeBotHandler(
+            ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), admins=bot.admins,
+            sensors=urls, state_path=str(tmpdir)
+        )
+        sensor = restored.sensor_by_name('sensor_1')
+        assert sensor.state == 1
+        assert sensor.changed == handler.sensor_by_name('sensor_1').changed
+        assert sensor.triggered > 0
+        assert restored.sensor_by_name('sensor_2').is_subscribed(chat_id)
+
+    def test_warm_start(self, handler):
+        test_sensor = [x for x in handler.sensors if not x.is_dummy and x.is_subscribed(handler.bot.admin)][0]
+        test_camera = [x for x in handler.sensors if x.type == 'camera'][0]
+
+        message = DummyMqttMessage()
+        message.retain = True
+        message.topic = test_sensor.topic
+        message.payload = '{"status": 1, "changed": 1547438413}'
+        handler.on_mqtt_message(None, None, message)
+
+        message.topic = test_camera.topic.strip('#') + 'photo'
+        message.payload = str(uuid.uuid4())
+        handler.on_mqtt_message(None, None, message)
+
+        assert len(handler.bot.messages) == 0
+        assert test_sensor.state == 1
+        assert test_sensor.changed == 1547438413
+        assert test_camera.state != message.payload
+
+    def test_camera_last(self, handler):
+        test_camera = [x for x in handler.sensors if x.type == 'camera'][0]
+        chat_id = random.randint(1, 100000)
+
+        assert handler.bot.exec_command(
+            message={"from": {"id": handler.bot.admin}, "chat": {"id": chat_id},
+                     "text": "/camera %s last" % test_camera.name}
+        )
+        assert len(handler.bot.messages) == 1
+        assert 'No frames' in handler.bot.messages.pop()['message']
+        assert handler.bot.exec_command(
+            message={"from": {"id": handler.bot.admin}, "chat": {"id": chat_id},
+                     "text": "/camera %s last many" % test_camera.name}
+        )
+        assert 'Usage' in handler.bot.messages.pop()['message']
+
+        message = DummyMqttMessage()
+        message.retain = False
+        message.topic = test_camera.topic.strip('#') + 'photo'
+        for _ in range(3):
+            message.payload = str(uuid.uuid4())
+            handler.on_mqtt_message(None, None, message)
+        handler.bot.clear()
+
+        assert handler.bot.exec_command(
+            message={"from": {"id": handler.bot.admin}, "chat": {"id": chat_id},
+                     "text": "/camera %s last 2" % test_camera.name}
+        )
+        assert len(handler.bot.messages) == 2
+        for message in handler.bot.messages:
+            assert message['to'] == chat_id
+            assert isinstance(message['message'], pytelegram_async.entity.Photo)
+
+    def test_photo_variants(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(variants, 'Image', object())
+        monkeypatch.setattr(variants, 'resize_jpeg', lambda payload, max_side, quality: payload[:max_side])
+        bot = DummyBot()
+        urls = ["camera://test@home/camera/test"]
+        handler = HomeBotHandler(
+            ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), admins=bot.admins,
+            sensors=urls, state_path=str(tmpdir), photo_sizes={'thumb': 320}
+        )
+        bot.add_handler(handler)
+        chat_id = handler.bot.admin
+
+        assert handler.bot.exec_command(
+            message={"from": {"id": handler.bot.admin}, "chat": {"id": chat_id}, "text": "/photosize huge"}
+        )
+        assert 'Usage' in handler.bot.messages.pop()['message']
+        assert handler.bot.exec_command(
+            message={"from": {"id": handler.bot.admin}, "chat": {"id": chat_id}, "text": "/photosize thumb"}
+        )
+        assert handler.photo_preference(chat_id) == 'thumb'
+
+        message = DummyMqttMessage()
+        message.retain = False
+        message.topic = 'home/camera/test/photo'
+        message.payload = str(uuid.uuid4())
+        handler.bot.clear()
+        handler.on_mqtt_message(None, None, message)
+
+        @gen.coroutine
+        def sent():
+            # variant is built in worker thread
+            while len(handler.bot.messages) == 0:
+                yield gen.sleep(0.01)
+        IOLoop.current().run_sync(sent, timeout=5)
+        assert isinstance(handler.bot.messages[-1]['message'], pytelegram_async.entity.Photo)
+        assert len(handler.photo_variants.cache) == 1
+        handler.bot.clear()
+
+        frame = handler.snapshots.last('test')[0]
+        assert handler.bot.exec_command(
+            message={"from": {"id": handler.bot.admin}, "chat": {"id": chat_id}, "text": "/camera test original x1"}
+        )
+        assert 'not available' in handler.bot.messages.pop()['message']
+        assert handler.bot.exec_command(
+            message={"from": {"id": handler.bot.admin}, "chat": {"id": chat_id},
+                     "text": "/camera test original %d" % frame.id}
+        )
+        assert len(handler.bot.messages) == 1
+        assert isinstance(handler.bot.messages[0]['message'], pytelegram_async.entity.Document)
+        handler.journal.close()
+
+        restored = HomeBotHandler(
+            ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), admins=bot.admins,
+            sensors=urls, state_path=str(tmpdir), photo_sizes={'thumb': 320}
+        )
+        assert restored.photo_preference(chat_id) == 'thumb'
+        assert restored.photo_preference(chat_id + 1) == 'original'
+
+    def test_photo_variants_without_pil(self, monkeypatch):
+        monkeypatch.setattr(variants, 'Image', None)
+        bot = DummyBot()
+        handler = HomeBotHandler(
+            ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), admins=bot.admins,
+            sensors=["camera://test@home/camera/test"], photo_sizes={'thumb': 320}
+        )
+        bot.add_handler(handler)
+        assert handler.photo_variants is None
+        assert handler.bot.exec_command(
+            message={"from": {"id": bot.admin}, "chat": {"id": bot.admin}, "text": "/photosize thumb"}
+        )
+        assert bot.messages.pop()['message'] == 'Photo size: original only'
+        assert handler.photo_preference(bot.admin) == 'original'
+
+    def test_event_video_spooled(self, handler):
+        test_camera = [x for x in handler.sensors if x.type == 'camera'].pop()
+        handler.spool.threshold = 10
+
+        message = DummyMqttMessage()
+        message.retain = False
+        message.topic = test_camera.topic.strip('#')+'videom'
+        message.payload = str(uuid.uuid4())
+        handler.on_mqtt_message(None, None, message)
+
+        assert len(handler.bot.messages) == 1
+        assert isinstance(handler.bot.messages[0]['message'], pytelegram_async.entity.Video)
+        assert test_camera.state.released
+        assert not os.path.exists(test_camera.state.path)
+        assert test_camera.state.path.startswith(handler.spool.path)
+
+    def test_subscribe_bulk(self, handler):
+        chat_id = random.randint(1, 100000)
+
+        assert handler.bot.exec_command(
+            message={"from": {"id": handler.bot.admin}, "chat": {"id": chat_id}, "text": "/subscribe door"}
+        )
+        assert len(handler.bot.messages) == 1
+        assert sorted(x.name for x in handler.sensors.subscribed(chat_id)) == ['sensor_1', 'sensor_2']
+        handler.bot.clear()
+
+        assert handler.bot.exec_command(
+            message={"from": {"id": handler.bot.admin}, "chat": {"id": chat_id}, "text": "/subscribe home/wireless/+"}
+        )
+        assert handler.sensor_by_name('wireless_sensor').is_subscribed(chat_id)
+
+        assert handler.bot.exec_command(
+            message={"from": {"id": handler.bot.admin}, "chat": {"id": chat_id}, "text": "/unsubscribe *"}
+        )
+        assert handler.sensors.subscribed(chat_id) == []
+
+    def test_history(self, tmpdir):
+        bot = DummyBot()
+        handler = HomeBotHandler(
+            ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), admins=bot.admins,
+            sensors=["door://sensor_1@home/sensor/test"], history_path=str(tmpdir.join('history.db'))
+        )
+        bot.add_handler(handler)
+
+        message = DummyMqttMessage()
+        message.retain = False
+        message.topic = 'home/sensor/test'
+        for payload in ['1', '0', '1']:
+            message.payload = payload
+            handler.on_mqtt_message(None, None, message)
+        handler.history.flush()
+        bot.clear()
+
+        assert handler.bot.exec_command(
+            message={"from": {"id": bot.admin}, "chat": {"id": 1}, "text": "/history sensor_1 7d"}
+        )
+        assert len(bot.messages) == 1
+        assert bot.messages[0]['message'].startswith('<b>sensor_1</b> for 7d: 3 changes, 1 triggers')
+        handler.history.close()
+
+    def test_rule(self):
+        bot = DummyBot()
+        handler = HomeBotHandler(
+            ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), admins=bot.admins,
+            sensors=["door://sensor_1@home/sensor/test", "presence://phone@home/wireless/phone"],
+            rules=["alarm: sensor_1 and not phone"]
+        )
+        bot.add_handler(handler)
+        handler.sensor_by_name('sensor_1').remove_subscription(bot.admin)
+
+        message = DummyMqttMessage()
+        message.retain = False
+        message.topic = 'home/sensor/test'
+        message.payload = '1'
+        handler.on_mqtt_message(None, None, message)
+        assert len(bot.messages) == 1
+        assert bot.messages[0]['to'] == bot.admin
+        assert bot.messages[0]['message'].startswith('<b>alarm</b>')
+
+    def test_sensor_template(self):
+        bot = DummyBot()
+        handler = HomeBotHandler(
+            ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), admins=bot.admins,
+            sensors=["presence://{1}@home/wireless/+"]
+        )
+        bot.add_handler(handler)
+        assert len(handler.sensors) == 0
+
+        message = DummyMqttMessage()
+        message.retain = False
+        message.topic = 'home/wireless/phone'
+        message.payload = '1'
+        handler.on_mqtt_message(None, None, message)
+
+        sensor = handler.sensor_by_name('phone')
+        assert sensor.state == 1
+        assert sensor.on_changed == handler.event_sensor
+        assert len(bot.messages) == 1
+
+    def test_reload_sensors(self, handler):
+        client = DummyMqttClient()
+        handler.on_mqtt_connect(client, None, None, 0)
+        sensor = handler.sensor_by_name('sensor_1')
+        sensor.state = 1
+        chat_id = random.randint(1, 100000)
+        sensor.add_subscription(chat_id)
+
+        added, removed = handler.reload_sensors([
+            "door://sensor_1@home/sensor/test",
+            "door://sensor_2!@home/sensor/test2",
+            "motion://motion@home/motion",
+            "presence://{1}@home/wireless/+",
+            "camera://test@home/camera/test"
+        ])
+        assert [x.name for x in added] == ['motion']
+        assert sorted(x.name for x in removed) == ['notify', 'wireless_sensor']
+        assert handler.sensor_by_name('sensor_1') is sensor
+        assert sensor.state == 1 and sensor.is_subscribed(chat_id)
+        assert handler.sensor_by_name('notify') is None
+        assert client.topics == {
+            'home/sensor/test', 'home/sensor/test2', 'home/motion', 'home/wireless/+', 'home/camera/test/#'
+        }
+
+        # invalid config is rejected before any sensor is changed
+        names = sorted(x.name for x in handler.sensors)
+        topics = set(client.topics)
+        for urls in (["door://sensor_1@home/sensor/test", "door://broken@home/broken?codec=xml"],
+                     ["door://sensor_1@home/sensor/test", "motion://sensor_1@home/other"]):
+            with pytest.raises(ValueError):
+                handler.reload_sensors(urls)
+            assert sorted(x.name for x in handler.sensors) == names
+            assert client.topics == topics
+
+    def test_subscribe_wildcards(self):
+        bot = DummyBot()
+        sensors = ["presence://device_%d@home/wireless/%d" % (idx, idx) for idx in range(10)]
+        sensors.append("door://door@home/sensor/door")
+        handler = HomeBotHandler(
+            ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), admins=bot.admins,
+            sensors=sensors, subscribe_wildcards=5
+        )
+        bot.add_handler(handler)
+        client = DummyMqttClient()
+        handler.on_mqtt_connect(client, None, None, 0)
+        assert client.topics == {'home/wireless/+', 'home/sensor/door'}
+        assert client.packets == 1
+
+        message = DummyMqttMessage()
+        message.retain = False
+        message.topic = 'home/wireless/unknown'
+        message.payload = '1'
+        handler.on_mqtt_message(None, None, message)
+        message.topic = 'home/wireless/3'
+        handler.on_mqtt_message(None, None, message)
+        assert handler.sensor_by_name('device_3').state == 1
+        assert [x.name for x in handler.sensors if x.state == 1] == ['device_3']
+
+        handler.reload_sensors(sensors[:3] + sensors[-1:])
+        assert client.topics == {'home/wireless/0', 'home/wireless/1', 'home/wireless/2', 'home/sensor/door'}
+
+    def test_watch_config(self, tmpdir):
+        config = tmpdir.join('homebot.conf')
+        config.write('--sensors door://sensor_1@home/sensor/test')
+        parser = build_parser()
+        argv = ['-c', str(config), '--watch', '5']
+        args = parser.parse_args(argv)
+        assert args.config == str(config)
+        assert args.sensors == ['door://sensor_1@home/sensor/test']
+
+        bot = DummyBot()
+        handler = HomeBotHandler(
+            ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), admins=bot.admins, sensors=args.sensors
+        )
+        bot.add_handler(handler)
+        watcher = watch_config(parser, args, argv, handler)
+        assert watcher.interval == 5
+
+        config.write('--sensors door://sensor_1@home/sensor/test door://sensor_2@home/sensor/test2')
+        assert watcher.check()
+        assert handler.sensor_by_name('sensor_2') is not None
+        assert watch_config(parser, parser.parse_args(['--watch', '5']), [], handler) is None
+
+    def test_queue(self):
+        bot = DummyBot()
+        handler = HomeBotHandler(
+            ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), admins=bot.admins,
+            sensors=["door://sensor_1@home/sensor/test"], queue_size=10
+        )
+        bot.add_handler(handler)
+
+        @gen.coroutine
+        def scenario():
+            message = DummyMqttMessage()
+            message.retain = False
+            message.topic = 'home/sensor/test'
+            message.payload = '1'
+            handler.on_mqtt_message(None, None, message)
+            assert len(bot.messages) == 0
+            yield gen.sleep(0.01)
+
+        IOLoop.current().run_sync(scenario)
+        assert handler.sensor_by_name('sensor_1').state == 1
+        assert len(bot.messages) == 1
+
+        bot.clear()
+        assert bot.exec_command(message={"from": {"id": bot.admin}, "chat": {"id": 1}, "text": "/queue"})
+        assert 'processed: 1' in bot.messages[0]['message']
+
+    def test_shard_coordinator(self, tmpdir):
+        bot = DummyBot()
+        handler = HomeBotHandler(
+            ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), admins=bot.admins,
+            sensors=["door://sensor_1@home/sensor/test", "camera://test@home/camera/test"],
+            shard_socket=str(tmpdir.join('shard.sock'))
+        )
+        bot.add_handler(handler)
+        client = DummyMqttClient()
+        handler.on_mqtt_connect(client, None, None, 0)
+        assert client.topics == {'home/camera/test/#'}
+
+        record = {'name': 'sensor_1', 'topic': 'home/sensor/test', 'state': 1, 'changed': 100.0, 'retained': True}
+        handler.apply_shard_change(record)
+        assert handler.sensor_by_name('sensor_1').state == 1
+        assert len(bot.messages) == 0
+
+        handler.apply_shard_change(dict(record, state=0, changed=200.0, retained=False))
+        handler.apply_shard_change(dict(record, state=1, changed=300.0, retained=False))
+        assert handler.sensor_by_name('sensor_1').changed == 300.0
+        assert len(bot.messages) == 1
+
+    def test_shard_templates(self, tmpdir):
+        urls = ["presence://{1}@home/wireless/+", "presence://phone@home/wireless/phone"]
+        workers = [
+            HomeBotShard(
+                ioloop=None, mqtt_url=urlparse.urlparse('mqtt://dummy/'), sensors=urls, index=index, count=2,
+                socket_path=str(tmpdir.join('shard.sock'))
+            )
+            for index in range(2)
+        ]
+        topics = ['home/wireless/%02d' % idx for idx in range(20)]
+        for worker in workers:
+            client = DummyMqttClient()
+            worker.on_mqtt_connect(client, None, None, 0)
+            # every worker receives the wildcard topic
+            assert 'home/wireless/+' in client.topics
+            for topic in topics + ['home/wireless/phone']:
+                worker.templates.materialize(topic)
+
+        for index, worker in enumerate(workers):
+            assert sorted(x.topic for x in worker.sensors if x.name in worker.templates) == [
+                topic for topic in topics if shard_of(topic, 2) == index
+            ]
+        # static sensor is owned by one worker and never created from template
+        assert len([worker for worker in workers if worker.sensors.get('phone') is not None]) == 1
+
+    def test_status_cache(self, handler):
+        chat_id = random.randint(1, 100000)
+        for _ in xrange(2):
+            assert handler.bot.exec_command(
+                message={"from": {"id": handler.bot.admin}, "chat": {"id": chat_id}, "text": "/status"}
+            )
+        assert handler.bot.messages[0]['message'] == handler.bot.messages[1]['message']
+        sensors = len([x for x in handler.sensors if not x.is_dummy])
+        assert handler.status_fragments.misses == sensors
+        assert handler.status_fragments.hits == sensors
@@ -0,0 +1,71 @@
+from telebots.ingest import IngestQueue
+from tornado import gen
+from tornado.ioloop import IOLoop
+import pytest
+
+
+class Message(object):
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+@pytest.fixture(name="handled")
+def make_handled():
+    yield []
+
+
+class TestIngestQueue(object):
+    def test_policies(self, handled):
+        queue = IngestQueue(
+            lambda message: handled.append((message.topic, message.payload)), maxsize=2,
+            policies=[('home/wireless/+', 'latest'), ('home/sensor/#', 'keep')]
+        )
+        assert queue.policy('home/wireless/phone') == 'latest'
+        assert queue.policy('home/sensor/door') == 'keep'
+        assert queue.policy('home/camera/cam') == 'drop'
+        with pytest.raises(ValueError):
+            queue.add_policy('home/#', 'unknown')
+
+    def test_drain(self, handled):
+        queue = IngestQueue(
+            lambda message: handled.append((message.topic, message.payload)), maxsize=2,
+            policies=[('home/wireless/+', 'latest'), ('home/sensor/#', 'keep')]
+        )
+
+        @gen.coroutine
+        def scenario():
+            assert queue.put(Message('home/wireless/phone', '1'))
+            assert queue.put(Message('home/camera/cam', 'a'))
+            # queue is full
+            assert not queue.put(Message('home/camera/cam', 'b'))
+            assert queue.put(Message('home/sensor/door', '1'))
+            assert queue.put(Message('home/wireless/phone', '0'))
+            assert queue.put(Message('home/sensor/door', '0'))
+            assert handled == []
+            assert len(queue) == 4
+            yield gen.sleep(0.01)
+
+        IOLoop.current().run_sync(scenario)
+        assert handled == [
+            ('home/wireless/phone', '0'), ('home/camera/cam', 'a'), ('home/sensor/door', '1'), ('home/sensor/door', '0')
+        ]
+        assert queue.stats == {'depth': 0, 'max_depth': 4, 'processed': 4, 'dropped': 1, 'merged': 1}
+
+    def test_errors(self, handled):
+        def handle(message):
+            if message.payload == 'bad':
+                raise ValueError()
+            handled.append(message.payload)
+
+        queue = IngestQueue(handle, batch=1)
+
+        @gen.coroutine
+        def scenario():
+            queue.put(Message('a', 'bad'))
+            queue.put(Message('a', 'good'))
+            yield gen.sleep(0.01)
+
+        IOLoop.current().run_sync(scenario)
+        assert handled == ['good']
+        assert queue.processed == 2
@@ -0,0 +1,44 @@
+from telebots.journal import SensorJournal
+import pytest
+
+
+@pytest.fixture(name="journal")
+def make_journal(tmpdir):
+    journal = SensorJournal(str(tmpdir.join('state')), compact_limit=3)
+    yield journal
+    journal.close()
+
+
+class TestSensorJournal(object):
+    def test_empty(self, journal):
+        assert journal.load() == {}
+
+    def test_replay(self, journal):
+        journal.append('door', state=1, changed=100.5, triggered=0)
+        journal.append('door', subscriptions=[1, 2])
+        journal.close()
+
+        table = SensorJournal(journal.path).load()
+        assert table == {'door': {'state': 1, 'changed': 100.5, 'triggered': 0, 'subscriptions': [1, 2]}}
+
+    def test_compact(self, journal):
+        journal.append('door', state=1)
+        journal.append('door', state=0)
+        journal.append('motion', state=1)
+        assert journal.should_compact()
+
+        journal.compact({'door': {'state': 0}, 'motion': {'state': 1}})
+        assert journal.records == 0
+        journal.append('door', state=1)
+        journal.close()
+
+        restored = SensorJournal(journal.path)
+        assert restored.load() == {'door': {'state': 1}, 'motion': {'state': 1}}
+        assert restored.records == 1
+
+    def test_broken_tail(self, journal):
+        journal.append('door', state=1)
+        journal.close()
+        with open(journal.log_file, 'ab') as f:
+            f.write('{"name": "do')
+        assert SensorJournal(journal.path).load() == {'door': {'state': 1}}
@@ -0,0 +1,66 @@
+from dummy_objects import DummyBot, DummyHTTPResponse
+from telebots.media import MediaBroadcaster
+from telebots.upload import UploadSource
+from pytelegram_async.entity import File
+from tornado import gen
+import pytest
+import json
+import uuid
+
+
+class FileIdBot(DummyBot):
+    @gen.coroutine
+    def send_message(self, to, message, callback=None, reply_markup=None, **extra):
+        self.messages.append({"to": to, "message": message})
+        raise gen.Return(DummyHTTPResponse(
+            code=200, headers={}, body=json.dumps({"result": {"photo": [
+                {"file_id": "small_%d" % len(self.messages)}, {"file_id": "large_%d" % len(self.messages)}
+            ]}})
+        ))
+
+
+@pytest.fixture(name="media")
+def make_media():
+    yield MediaBroadcaster(FileIdBot())
+
+
+class TestMediaBroadcaster(object):
+    def test_upload_once(self, media):
+        payload = str(uuid.uuid4())
+        media.send([1, 2, 3], 'photo', payload, 'image.jpg', 'image/jpeg', caption='test')
+
+        messages = media.bot.messages
+        assert [x['to'] for x in messages] == [1, 2, 3]
+        assert isinstance(messages[0]['message'].photo, File)
+        assert messages[1]['message'].photo == 'large_1'
+        assert messages[2]['message'].photo == 'large_1'
+
+    def test_cached_file_id(self, media):
+        payload = str(uuid.uuid4())
+        media.send([1], 'photo', payload, 'image.jpg', 'image/jpeg')
+        media.bot.clear()
+
+        media.send([2], 'photo', payload, 'image.jpg', 'image/jpeg')
+        assert media.bot.messages[0]['message'].photo == 'large_1'
+
+    def test_no_file_id(self):
+        media = MediaBroadcaster(DummyBot())
+        media.send([1, 2], 'video', str(uuid.uuid4()), 'video.mp4', 'video/mp4')
+        assert len(media.bot.messages) == 2
+        for message in media.bot.messages:
+            assert isinstance(message['message'].video, File)
+
+    def test_no_recipients(self, media):
+        # missing file is not read when nobody receives it
+        future = media.send([], 'video', UploadSource(path='/nonexistent/video.mp4'), 'video.mp4', 'video/mp4')
+        assert future.result() == []
+        assert media.bot.messages == []
+
+    def test_media_type_key(self, media):
+        payload = str(uuid.uuid4())
+        media.send([1], 'photo', payload, 'image.jpg', 'image/jpeg')
+        # photo file_id is not reused for document of the same content
+        media.send([2], 'document', payload, 'image.jpg', 'image/jpeg')
+        assert isinstance(media.bot.messages[1]['message'].document, File)
+        media.send([3], 'photo', payload, 'image.jpg', 'image/jpeg')
+        assert media.bot.messages[2]['message'].photo == 'large_1'
@@ -0,0 +1,43 @@
+from telebots.processes import ProcessManager
+from tornado import gen
+from tornado.ioloop import IOLoop
+import time
+import pytest
+
+
+@pytest.fixture(name="manager")
+def make_manager():
+    yield ProcessManager(max_running=1, timeout=5)
+
+
+class TestProcessManager(object):
+    def test_output(self, manager):
+        chunks = []
+        code, output = IOLoop.current().run_sync(
+            lambda: manager.run('sh -c "echo hello; echo world"', on_output=chunks.append)
+        )
+        assert code == 0
+        assert output == 'hello\nworld\n'
+        assert chunks[-1] == output
+        assert manager.running == {}
+
+    def test_timeout(self, manager):
+        started = time.time()
+        code, output = IOLoop.current().run_sync(lambda: manager.run('sleep 10', timeout=0.2))
+        assert code != 0
+        assert time.time() - started < 5
+
+    def test_concurrency(self, manager):
+        @gen.coroutine
+        def run_both():
+            results = yield [manager.run('sh -c "date +%s.%N; sleep 0.3"') for _ in range(2)]
+            raise gen.Return(results)
+
+        results = IOLoop.current().run_sync(run_both)
+        first, second = [float(output) for _, output in results]
+        assert abs(second - first) >= 0.3
+
+    def test_output_limit(self):
+        manager = ProcessManager(output_limit=10)
+        code, output = IOLoop.current().run_sync(lambda: manager.run('sh -c "seq 1 1000"'))
+        assert output == '\n999\n1000\n'
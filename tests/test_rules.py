@@ -0,0 +1,132 @@
+from telebots.sensors import Sensor
+from telebots.rules import RuleEngine, Rule
+from telebots.templates import SensorTemplate
+import pytest
+
+
+@pytest.fixture(name="sensors")
+def make_sensors():
+    yield {
+        sensor.name: sensor for sensor in (
+            Sensor.from_url(url) for url in [
+                "door://door_1@home/sensor/door1",
+                "presence://phone_1@home/wireless/1",
+                "presence://phone_2@home/wireless/2",
+                "motion://motion_1@home/motion/1",
+                "motion://motion_2@home/motion/2",
+                "motion://motion_3@home/motion/3"
+            ]
+        )
+    }
+
+
+@pytest.fixture(name="fired")
+def make_fired():
+    yield []
+
+
+def change(engine, sensor, state, now=None):
+    sensor.state = state
+    return engine.update(sensor, now)
+
+
+class TestRuleEngine(object):
+    def test_parse(self):
+        rule = Rule('test', 'door_1 and not any presence and 2 of motion within 60s')
+        assert [(type(term).__name__, negate) for term, negate in rule.terms] == [
+            ('SensorTerm', False), ('AnyTerm', True), ('WindowTerm', False)
+        ]
+        with pytest.raises(ValueError):
+            Rule('bad', 'door_1 and 2 of motion')
+
+    def test_dependencies(self, sensors, fired):
+        engine = RuleEngine(lambda rule, sensor: fired.append((rule.name, sensor.name)))
+        engine.add('alarm', 'door_1 and not any presence', sensors.values())
+        engine.add('motion', 'any motion_1,motion_2', sensors.values())
+
+        assert [x.name for x in engine.dependent(sensors['phone_1'])] == ['alarm']
+        assert [x.name for x in engine.dependent(sensors['motion_2'])] == ['motion']
+        assert engine.dependent(sensors['motion_3']) == []
+
+    def test_fire(self, sensors, fired):
+        engine = RuleEngine(lambda rule, sensor: fired.append((rule.name, sensor.name)))
+        engine.add('alarm', 'door_1 and not any presence', sensors.values())
+
+        change(engine, sensors['phone_1'], 1)
+        change(engine, sensors['door_1'], 1)
+        assert fired == []
+
+        change(engine, sensors['door_1'], 0)
+        change(engine, sensors['phone_1'], 0)
+        assert change(engine, sensors['door_1'], 1)[0].name == 'alarm'
+        # fired only on transition
+        change(engine, sensors['phone_2'], 0)
+        assert fired == [('alarm', 'door_1')]
+
+    def test_all(self, sensors, fired):
+        engine = RuleEngine(lambda rule, sensor: fired.append(rule.name))
+        engine.add('home', 'all presence', sensors.values())
+        change(engine, sensors['phone_1'], 1)
+        assert fired == []
+        change(engine, sensors['phone_2'], 1)
+        assert fired == ['home']
+
+    def test_window(self, sensors, fired):
+        engine = RuleEngine(lambda rule, sensor: fired.append(sensor.name))
+        engine.add('rooms', '2 of motion within 60', sensors.values())
+
+        change(engine, sensors['motion_1'], 1, 1000)
+        change(engine, sensors['motion_1'], 0, 1010)
+        change(engine, sensors['motion_1'], 1, 1020)
+        assert fired == []
+        change(engine, sensors['motion_2'], 1, 1100)
+        assert fired == []
+        change(engine, sensors['motion_3'], 1, 1150)
+        assert fired == ['motion_3']
+
+    def test_window_retained(self, sensors, fired):
+        engine = RuleEngine(lambda rule, sensor: fired.append(sensor.name))
+        engine.add('rooms', '2 of motion within 60', sensors.values())
+
+        # retained state changed long ago is not a recent trigger
+        sensors['motion_1'].restore({'state': 1, 'changed': 1000})
+        engine.update(sensors['motion_1'], 5000, silent=True)
+        change(engine, sensors['motion_2'], 1, 5010)
+        assert fired == []
+
+        # recent retained state counts at its change time
+        engine = RuleEngine(lambda rule, sensor: fired.append(sensor.name))
+        engine.add('rooms', '2 of motion within 60', sensors.values())
+        sensors['motion_3'].restore({'state': 1, 'changed': 4990})
+        engine.update(sensors['motion_3'], 5000, silent=True)
+        change(engine, sensors['motion_2'], 1, 5040)
+        assert fired == ['motion_2']
+        change(engine, sensors['motion_2'], 0, 5055)
+        change(engine, sensors['motion_2'], 1, 5060)
+        # motion_3 is out of window at 5060
+        assert fired == ['motion_2']
+
+    def test_attach(self, sensors, fired):
+        engine = RuleEngine(lambda rule, sensor: fired.append(rule.name))
+        engine.add('motion', 'any motion', [sensors['motion_1']])
+        engine.attach(sensors['motion_2'])
+        change(engine, sensors['motion_2'], 1)
+        assert fired == ['motion']
+
+        engine.detach(sensors['motion_2'])
+        assert engine.dependent(sensors['motion_2']) == []
+
+    def test_unknown_sensor(self, sensors, fired):
+        engine = RuleEngine(lambda rule, sensor: fired.append(rule.name))
+        with pytest.raises(ValueError):
+            engine.add('alarm', 'door_1 and not presense_typo', sensors.values())
+        with pytest.raises(ValueError):
+            engine.add('motion', 'any motion_1,motion_typo', sensors.values())
+        assert len(engine) == 0
+        assert engine.dependent(sensors['door_1']) == []
+
+        # sensors may be created from templates later
+        templates = [SensorTemplate("presence://phone_{1}@home/wireless/+"), SensorTemplate("leak://{1}@home/leak/+")]
+        engine.add('alarm', 'door_1 and not phone_3', sensors.values(), templates)
+        engine.add('flood', 'any leak', sensors.values(), templates)
+        assert len(engine) == 2
@@ -0,0 +1,168 @@
+from telebots.sensors import Sensor, SensorRegistry, DoorSensor, CameraSensor
+import pytest
+import struct
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+
+@pytest.fixture(name="registry")
+def make_registry():
+    registry = SensorRegistry(
+        Sensor.from_url(url, [1]) for url in [
+            "door://door_1@home/sensor/door1",
+            "door://door_2@home/sensor/door2",
+            "presence://phone@home/wireless/00:AA:BB:CC",
+            "camera://cam@home/camera/cam"
+        ]
+    )
+    yield registry
+
+
+class TestSensorRegistry(object):
+    def test_lookup(self, registry):
+        assert len(registry) == 4
+        assert isinstance(registry.get("door_1"), DoorSensor)
+        assert registry.get("unknown") is None
+        assert [x.name for x in registry.by_type("door")] == ["door_1", "door_2"]
+        assert registry.by_type("motion") == []
+
+    def test_match(self, registry):
+        assert registry.match("home/camera/cam/photo") == [registry.get("cam")]
+        assert registry.match("home/sensor/door3") == []
+
+    def test_add_remove(self, registry):
+        sensor = registry.get("door_2")
+        with pytest.raises(ValueError):
+            registry.add(Sensor.from_url("door://door_2@home/other"))
+        assert registry.remove(sensor)
+        assert not registry.remove(sensor)
+        assert registry.get("door_2") is None
+        assert registry.match(sensor.topic) == []
+        assert [x.name for x in registry.by_type("door")] == ["door_1"]
+
+    def test_compact(self, registry):
+        for sensor in registry:
+            assert not hasattr(sensor, '__dict__')
+        assert isinstance(registry.get("cam"), CameraSensor)
+
+    def test_own_subscriptions(self, registry):
+        registry.get("door_1").add_subscription(2)
+        assert not registry.get("door_2").is_subscribed(2)
+
+
+class TestSensorCodecs(object):
+    def test_json(self):
+        sensor = Sensor.from_url("door://door@home/door")
+        sensor.process("home/door", "1")
+        assert sensor.state == 1 and sensor.changed > 0
+        sensor.process("home/door", '{"status": 0, "changed": 1547438413}')
+        assert sensor.state == 0 and sensor.changed == 1547438413
+
+    def test_int(self):
+        sensor = Sensor.from_url("door://door@home/door?codec=int")
+        sensor.process("home/door", "1")
+        assert sensor.state == 1
+        sensor.process("home/door", "-5")
+        assert sensor.state == -5
+        with pytest.raises(ValueError):
+            sensor.process("home/door", '{"status": 1}')
+
+    def test_binary(self):
+        sensor = Sensor.from_url("presence://phone@home/wireless/00:AA?codec=binary")
+        sensor.process("home/wireless/00:AA", struct.pack('!b', 1))
+        assert sensor.state == 1
+        sensor.process("home/wireless/00:AA", struct.pack('!bI', 0, 1547438413))
+        assert sensor.state == 0 and sensor.changed == 1547438413
+        with pytest.raises(ValueError):
+            sensor.load("home/wireless/00:AA", 'abc')
+
+    def test_raw(self):
+        sensor = Sensor.from_url("notify://notify@home/notify")
+        sensor.process("home/notify", '{"status": 1}')
+        assert sensor.state == '{"status": 1}'
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            Sensor.from_url("door://door@home/door?codec=xml")
+
+
+class TestSensorSuppression(object):
+    def test_repeats(self):
+        changes = []
+        sensor = Sensor.from_url("motion://motion@home/motion?codec=int")
+        sensor.on_changed = changes.append
+        for payload in ["0", "1", "1", "1", "0", "0"]:
+            sensor.process("home/motion", payload)
+        assert len(changes) == 3
+        assert sensor.suppressed == {'repeats': 3, 'flaps': 0}
+
+    def test_dummy_repeats(self):
+        changes = []
+        sensor = Sensor.from_url("notify://notify@home/notify")
+        sensor.on_changed = changes.append
+        sensor.process("home/notify", "hello")
+        sensor.process("home/notify", "hello")
+        assert len(changes) == 2
+
+    def test_debounce(self):
+        changes = []
+        sensor = Sensor.from_url("door://door@home/door?codec=int&debounce=0.1")
+        sensor.on_changed = lambda item: changes.append(item.state)
+        assert sensor.debounce == 0.1
+
+        @gen.coroutine
+        def scenario():
+            for payload in ["1", "0", "1", "0"]:
+                sensor.process("home/door", payload)
+            assert changes == [1]
+            yield gen.sleep(0.2)
+            assert changes == [1, 0]
+            yield gen.sleep(0.1)
+            for payload in ["1", "0", "1"]:
+                sensor.process("home/door", payload)
+            yield gen.sleep(0.2)
+
+        IOLoop.current().run_sync(scenario)
+        # flapping back to settled state is not notified
+        assert changes == [1, 0, 1]
+        assert sensor.suppressed == {'repeats': 0, 'flaps': 5}
+
+    def test_load(self):
+        changes = []
+        sensor = Sensor.from_url("door://door@home/door")
+        sensor.on_changed = changes.append
+        sensor.load("home/door", '{"status": 1, "changed": 1547438413}')
+        assert sensor.state == 1 and sensor.changed == 1547438413
+        sensor.load("home/door", '1')
+        assert sensor.changed == 1547438413
+        # live repeat of loaded state is not a change
+        sensor.process("home/door", '1')
+        assert changes == []
+
+
+class TestSubscriptionIndex(object):
+    def test_reverse_index(self, registry):
+        door = registry.get("door_1")
+        door.add_subscription(2)
+        registry.get("cam").add_subscription(2)
+        assert sorted(x.name for x in registry.subscribed(2)) == ["cam", "door_1"]
+        assert len(registry.subscribed(1)) == 4
+
+        door.remove_subscription(2)
+        assert [x.name for x in registry.subscribed(2)] == ["cam"]
+        registry.remove(registry.get("cam"))
+        assert registry.subscribed(2) == []
+
+    def test_restore(self, registry):
+        door = registry.get("door_1")
+        door.restore({'subscriptions': [3]})
+        assert door.subscriptions == {3}
+        assert registry.subscribed(3) == [door]
+        assert door not in registry.subscribed(1)
+
+    def test_select(self, registry):
+        assert [x.name for x in registry.select("door")] == ["door_1", "door_2"]
+        assert [x.name for x in registry.select("home/sensor/+")] == ["door_1", "door_2"]
+        assert [x.name for x in registry.select("home/camera/#")] == ["cam"]
+        assert len(registry.select("*")) == 4
+        assert registry.select("unknown") == []
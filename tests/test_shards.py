@@ -0,0 +1,104 @@
+from telebots.sensors import Sensor
+from telebots.shards import ShardForwarder, ShardCoordinator, ShardSupervisor, shard_of, is_sharded
+from tornado import gen
+from tornado.ioloop import IOLoop
+import signal
+import time
+import os
+
+
+class TestShards(object):
+    def test_partition(self):
+        topics = ['home/sensor/%d' % idx for idx in xrange(100)]
+        shards = [shard_of(topic, 4) for topic in topics]
+        assert shards == [shard_of(topic, 4) for topic in topics]
+        assert set(shards) == {0, 1, 2, 3}
+        assert not is_sharded(Sensor.from_url("camera://cam@home/camera/cam"))
+        assert is_sharded(Sensor.from_url("door://door@home/sensor/door"))
+
+    def test_forward(self, tmpdir):
+        path = str(tmpdir.join('shard.sock'))
+        received = []
+        coordinator = ShardCoordinator(path, received.append)
+        forwarder = ShardForwarder(path, retry_delay=0.01)
+        sensor = Sensor.from_url("door://door@home/sensor/door")
+        sensor.on_changed = forwarder.forward
+
+        @gen.coroutine
+        def scenario():
+            # changes are buffered until coordinator is available
+            sensor.state = 1
+            yield gen.sleep(0.05)
+            assert received == []
+            coordinator.listen_unix()
+            yield gen.sleep(0.05)
+            sensor.state = 0
+            forwarder.forward(sensor, retained=True)
+            yield gen.sleep(0.05)
+
+        IOLoop.current().run_sync(scenario)
+        coordinator.stop()
+        assert [(x['name'], x['topic'], x['state'], x['retained']) for x in received] == [
+            ('door', 'home/sensor/door', 1, False), ('door', 'home/sensor/door', 0, False),
+            ('door', 'home/sensor/door', 0, True)
+        ]
+        assert received[1]['changed'] == sensor.changed
+        assert forwarder.sent == 3
+
+    def test_buffer_limit(self, tmpdir):
+        forwarder = ShardForwarder(str(tmpdir.join('missing.sock')), retry_delay=10, buffer_size=3)
+        forwarder.connect = lambda: None
+        sensor = Sensor.from_url("door://door@home/sensor/door")
+        for state in range(5):
+            sensor.state = state
+            forwarder.forward(sensor)
+        assert len(forwarder.pending) == 3
+        assert forwarder.dropped == 2
+
+    def test_supervisor(self):
+        spawned = []
+
+        def spawn(index):
+            pid = os.fork()
+            if pid == 0:
+                # the first worker crashes, restarted one runs until stopped
+                time.sleep(0.05 if len(spawned) == 0 else 10)
+                os._exit(3)
+            spawned.append(pid)
+            return pid
+
+        supervisor = ShardSupervisor(spawn, 1, restart_delay=0.01, interval=0.01)
+        supervisor.start()
+
+        @gen.coroutine
+        def scenario():
+            supervisor.watch()
+            for _ in range(200):
+                if supervisor.restarts > 0:
+                    break
+                yield gen.sleep(0.01)
+
+        IOLoop.current().run_sync(scenario)
+        assert supervisor.restarts == 1
+        assert supervisor.workers == {spawned[1]: 0}
+
+        supervisor.stop()
+        _, status = os.waitpid(spawned[1], 0)
+        assert os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGTERM
+
+    def test_supervisor_without_restart(self):
+        def spawn(index):
+            pid = os.fork()
+            if pid == 0:
+                os._exit(1)
+            return pid
+
+        supervisor = ShardSupervisor(spawn, 1, restart_delay=None)
+        supervisor.start()
+        for _ in range(100):
+            supervisor.reap()
+            if len(supervisor.workers) == 0:
+                break
+            time.sleep(0.01)
+        assert supervisor.workers == {}
+        assert supervisor.restarts == 0
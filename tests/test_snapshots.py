@@ -0,0 +1,33 @@
+from telebots.snapshots import SnapshotBuffer
+import pytest
+
+
+@pytest.fixture(name="snapshots")
+def make_snapshots():
+    yield SnapshotBuffer(max_bytes=100, frames_per_camera=3)
+
+
+class TestSnapshotBuffer(object):
+    def test_ring(self, snapshots):
+        for idx in range(5):
+            snapshots.add('cam1', str(idx) * 10)
+        assert [x.payload[0] for x in snapshots.last('cam1', 10)] == ['4', '3', '2']
+        assert [x.payload[0] for x in snapshots.last('cam1')] == ['4']
+        assert snapshots.size == 30
+        assert snapshots.last('cam2') == []
+
+    def test_memory_cap(self, snapshots):
+        snapshots.add('cam1', 'a' * 30)
+        snapshots.add('cam2', 'b' * 30)
+        snapshots.add('cam1', 'c' * 30)
+        # cam1 frame 'a' is the oldest but it was used recently
+        snapshots.last('cam1', 2)
+        snapshots.add('cam3', 'd' * 30)
+        assert snapshots.size <= 100
+        assert snapshots.last('cam2') == []
+        assert [x.payload[0] for x in snapshots.last('cam1', 2)] == ['c', 'a']
+        assert len(snapshots) == 3
+
+    def test_too_large(self, snapshots):
+        assert snapshots.add('cam1', 'x' * 101) is None
+        assert len(snapshots) == 0
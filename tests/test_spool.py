@@ -0,0 +1,46 @@
+from telebots.spool import PayloadSpool
+from telebots.sensors import Sensor
+import pytest
+import os
+
+
+@pytest.fixture(name="spool")
+def make_spool(tmpdir):
+    yield PayloadSpool(str(tmpdir.join('spool')), threshold=100)
+
+
+class TestPayloadSpool(object):
+    def test_store_release(self, spool):
+        payload = spool.store('x' * 200)
+        assert os.path.exists(payload.path)
+        assert payload.size == len(payload) == 200
+        assert payload.open().read() == 'x' * 200
+
+        payload.acquire()
+        payload.release()
+        assert os.path.exists(payload.path)
+        payload.release()
+        assert payload.released
+        assert not os.path.exists(payload.path)
+
+    def test_cleanup(self, spool):
+        payload = spool.store('x' * 200)
+        spool.cleanup()
+        assert not os.path.exists(payload.path)
+
+    def test_camera(self, spool):
+        camera = Sensor.from_url("camera://cam@home/camera/cam")
+        camera.spool = spool
+
+        camera.process("home/camera/cam/video", 'v' * 200)
+        assert camera.state.path.startswith(spool.path)
+        camera.state.release()
+
+        camera.process("home/camera/cam/video", 'v' * 10)
+        assert camera.state == 'v' * 10
+        camera.process("home/camera/cam/photo", 'p' * 200)
+        assert camera.state == 'p' * 200
+
+    def test_default_path(self):
+        # default directory is the same for every run, so cleanup finds files of crashed process
+        assert PayloadSpool().path == PayloadSpool().path
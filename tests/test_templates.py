@@ -0,0 +1,60 @@
+from telebots.sensors import Sensor, SensorRegistry, PresenceSensor
+from telebots.templates import SensorTemplate, SensorTemplates
+import pytest
+
+
+@pytest.fixture(name="templates")
+def make_templates():
+    registry = SensorRegistry([Sensor.from_url("presence://phone@home/wireless/phone", [1])])
+    templates = SensorTemplates(registry, limit=3, idle=60)
+    templates.add(SensorTemplate("presence://{1}@home/wireless/+", [1]))
+    templates.add(SensorTemplate("motion://{1}_motion!@home/+/motion?debounce=5"))
+    yield templates
+
+
+class TestSensorTemplates(object):
+    def test_template(self):
+        assert SensorTemplate.is_template("presence://{1}@home/wireless/+")
+        assert not SensorTemplate.is_template("presence://phone@home/wireless/+")
+        template = SensorTemplate("presence://mac_{1}@home/wireless/+")
+        assert template.name("home/wireless/00:AA:BB") == "mac_00:AA:BB"
+        with pytest.raises(ValueError):
+            SensorTemplate("presence://{1}@home/wireless/phone")
+
+    def test_materialize(self, templates):
+        registry = templates.registry
+        created = templates.materialize("home/wireless/00:AA:BB", 100)
+        assert [x.name for x in created] == ["00:AA:BB"]
+        sensor = registry.get("00:AA:BB")
+        assert isinstance(sensor, PresenceSensor)
+        assert sensor.topic == "home/wireless/00:AA:BB"
+        assert sensor.is_subscribed(1)
+        assert registry.match("home/wireless/00:AA:BB") == [sensor]
+
+        assert templates.materialize("home/wireless/00:AA:BB", 110) == []
+        # statically defined sensor is not replaced
+        assert templates.materialize("home/wireless/phone", 110) == []
+        assert len(templates) == 1
+
+        motion = templates.materialize("home/hall/motion", 120)[0]
+        assert motion.name == "hall_motion"
+        assert motion.debounce == 5
+        assert motion.subscriptions == set()
+
+    def test_limit(self, templates):
+        for idx in xrange(5):
+            templates.materialize("home/wireless/%d" % idx, 100)
+        assert len(templates) == 3
+        assert templates.registry.get("3") is None
+
+    def test_idle(self, templates):
+        evicted = []
+        templates.on_evicted = evicted.append
+        templates.materialize("home/wireless/a", 100)
+        templates.materialize("home/wireless/b", 130)
+        templates.materialize("home/wireless/a", 150)
+        templates.materialize("home/wireless/c", 195)
+        assert [x.name for x in evicted] == ["b"]
+        assert templates.registry.get("b") is None
+        assert "b" not in templates
+        assert sorted(x.name for x in templates.registry.by_type("presence")) == ["a", "c", "phone"]
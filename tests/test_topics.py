@@ -0,0 +1,57 @@
+from telebots.topics import TopicTrie, consolidate, batches
+from paho.mqtt.client import topic_matches_sub
+import pytest
+
+
+@pytest.fixture(name="trie")
+def make_trie():
+    trie = TopicTrie()
+    for pattern in ["home/sensor/test", "home/+/test", "home/camera/test/#", "#", "home/wireless/+"]:
+        trie.add(pattern, pattern)
+    yield trie
+
+
+class TestTopicTrie(object):
+    def test_match(self, trie):
+        for topic in ["home/sensor/test", "home/camera/test", "home/camera/test/photo",
+                      "home/wireless/00:AA:BB:CC", "home/wireless", "other", "$SYS/broker"]:
+            expected = [x for x in ["home/sensor/test", "home/+/test", "home/camera/test/#", "#", "home/wireless/+"]
+                        if topic_matches_sub(x, topic)]
+            assert trie.match(topic) == expected
+
+    def test_insertion_order(self, trie):
+        assert trie.match("home/sensor/test") == ["home/sensor/test", "home/+/test", "#"]
+
+    def test_remove(self, trie):
+        assert len(trie) == 5
+        assert trie.remove("home/camera/test/#", "home/camera/test/#")
+        assert not trie.remove("home/camera/test/#", "home/camera/test/#")
+        assert len(trie) == 4
+        assert trie.match("home/camera/test/video") == ["#"]
+
+
+class TestConsolidate(object):
+    def test_siblings(self):
+        topics = set("home/wireless/%02d" % idx for idx in range(10))
+        topics.update(["home/sensor/test", "home/sensor/test2", "home/camera/test/#"])
+        assert consolidate(topics, 8) == {
+            "home/wireless/+", "home/sensor/test", "home/sensor/test2", "home/camera/test/#"
+        }
+        assert consolidate(topics, 2) == {"home/wireless/+", "home/sensor/+", "home/camera/test/#"}
+
+    def test_covered(self):
+        topics = {"home/camera/test/#", "home/camera/test/photo", "home/+/state", "home/door/state", "top"}
+        assert consolidate(topics, 8) == {"home/camera/test/#", "home/+/state", "top"}
+
+    def test_covers_all_topics(self):
+        topics = set("home/%d/%d" % (x, y) for x in range(5) for y in range(x*3))
+        filters = consolidate(topics, 4)
+        assert len(filters) < len(topics)
+        for topic in topics:
+            assert [x for x in filters if topic_matches_sub(x, topic)]
+
+    def test_batches(self):
+        topics = ["t%03d" % idx for idx in range(250)]
+        result = list(batches(reversed(topics), 100))
+        assert [len(x) for x in result] == [100, 100, 50]
+        assert sum(result, []) == topics
@@ -0,0 +1,44 @@
+from telebots.upload import UploadSource, MultipartProducer
+from tornado import gen
+from tornado.ioloop import IOLoop
+import hashlib
+import pytest
+
+
+def produce(producer):
+    chunks = []
+
+    @gen.coroutine
+    def write(chunk):
+        chunks.append(chunk.tobytes() if isinstance(chunk, memoryview) else chunk)
+
+    IOLoop.current().run_sync(lambda: producer(write))
+    return chunks
+
+
+class TestUpload(object):
+    def test_source(self, tmpdir):
+        data = "x" * 1000
+        tmpdir.join("clip.mp4").write(data)
+        for source in [UploadSource(data=data), UploadSource(path=str(tmpdir.join("clip.mp4")))]:
+            assert source.size == 1000
+            assert [len(x) for x in source.chunks(300)] == [300, 300, 300, 100]
+            assert source.digest() == hashlib.sha1(data).hexdigest()
+            assert source.open().read() == data
+        with pytest.raises(ValueError):
+            UploadSource()
+
+    def test_multipart(self):
+        data = "y" * 5000
+        producer = MultipartProducer(
+            {'chat_id': 123, 'caption': u'test'},
+            [('video', 'clip.mp4', 'video/mp4', UploadSource(data=data))],
+            chunk_size=1024
+        )
+        chunks = produce(producer)
+        body = "".join(chunks)
+        assert len(body) == producer.content_length
+        assert max(len(x) for x in chunks) <= 1024
+        assert body.endswith('--%s--\r\n' % producer.boundary)
+        assert 'name="chat_id"\r\n\r\n123\r\n' in body
+        assert 'filename="clip.mp4"\r\nContent-Type: video/mp4\r\n\r\n' + data + '\r\n' in body
@@ -0,0 +1,69 @@
+from telebots import variants
+from telebots.variants import PhotoVariants
+from tornado import gen
+from tornado.ioloop import IOLoop
+import threading
+import pytest
+
+
+@pytest.fixture(name="resized")
+def make_resized():
+    yield []
+
+
+@pytest.fixture(name="photos")
+def make_photos(resized):
+    lock = threading.Lock()
+
+    def resize(payload, max_side, quality):
+        with lock:
+            resized.append((payload, max_side))
+        return payload[:max_side]
+
+    photos = PhotoVariants({'thumb': 2, 'phone': 4}, resize=resize)
+    yield photos
+    photos.executor.shutdown()
+
+
+class TestPhotoVariants(object):
+    def test_variant(self, photos, resized):
+        result = IOLoop.current().run_sync(lambda: photos.get('abcdefgh', 'thumb'))
+        assert result == 'ab'
+        result = IOLoop.current().run_sync(lambda: photos.get('abcdefgh', 'phone'))
+        assert result == 'abcd'
+        assert photos.names == ['phone', 'thumb', 'original']
+
+    def test_original(self, photos, resized):
+        assert IOLoop.current().run_sync(lambda: photos.get('abcdefgh', 'original')) == 'abcdefgh'
+        assert IOLoop.current().run_sync(lambda: photos.get('abcdefgh', 'unknown')) == 'abcdefgh'
+        assert resized == []
+
+    def test_cached(self, photos, resized):
+        for _ in range(3):
+            IOLoop.current().run_sync(lambda: photos.get('abcdefgh', 'thumb'))
+        assert resized == [('abcdefgh', 2)]
+        IOLoop.current().run_sync(lambda: photos.get('12345678', 'thumb'))
+        assert len(resized) == 2
+
+    def test_concurrent(self, photos, resized):
+        @gen.coroutine
+        def build():
+            result = yield [photos.get('abcdefgh', 'phone') for _ in range(5)]
+            raise gen.Return(result)
+
+        assert IOLoop.current().run_sync(build) == ['abcd'] * 5
+        assert len(resized) == 1
+
+    def test_failed(self):
+        def resize(payload, max_side, quality):
+            raise IOError('broken image')
+
+        photos = PhotoVariants({'thumb': 2}, resize=resize)
+        assert IOLoop.current().run_sync(lambda: photos.get('abcdefgh', 'thumb')) == 'abcdefgh'
+        photos.executor.shutdown()
+
+    def test_without_pil(self, monkeypatch):
+        monkeypatch.setattr(variants, 'Image', None)
+        photos = PhotoVariants()
+        assert photos.executor is None
+        assert IOLoop.current().run_sync(lambda: photos.get('abcdefgh', 'thumb')) == 'abcdefgh'
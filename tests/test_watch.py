@@ -0,0 +1,27 @@
+from telebots.watch import FileWatcher
+
+
+class TestFileWatcher(object):
+    def test_check(self, tmpdir):
+        config = tmpdir.join('homebot.conf')
+        config.write('--sensors a')
+        changes = []
+        watcher = FileWatcher(str(config), changes.append)
+        assert not watcher.check()
+
+        config.write('--sensors a b')
+        assert watcher.check()
+        assert changes == [str(config)]
+        assert not watcher.check()
+
+    def test_missing(self, tmpdir):
+        watcher = FileWatcher(str(tmpdir.join('missing.conf')), None)
+        assert not watcher.check()
+
+    def test_error(self, tmpdir):
+        config = tmpdir.join('homebot.conf')
+        config.write('')
+        watcher = FileWatcher(str(config), lambda path: 1/0)
+        config.write('--sensors')
+        # reload errors are logged, watcher keeps running
+        assert watcher.check()